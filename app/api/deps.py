@@ -1,55 +1,132 @@
-from fastapi import Depends, HTTPException, status
+from collections import OrderedDict
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
+from datetime import datetime
 import jwt
-import sqlite3
+import time
 
 from ..config import settings
-from ..storage.session_store import get_sso, set_sso
-from ..storage.db import get_conn
+from ..storage.session_store import get_sso, set_sso, sso_ttl
+from ..services.governor import UpstreamUnavailable
 from ..services.sso import get_sso_cookie
+from ..services.sso_refresher import touch_session, track_session
+from ..services.sync_jobs import SyncJobQueue
 from ..security import decrypt_password
+from ..storage.async_db import AsyncDatabase
+from ..utils.datetimes import parse_client_datetime
+from ..utils.deadline import set_deadline
+from ..utils.singleflight import SingleFlight
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
+# 按用户名合并并发的 SSO 自动续期（进程内）；跨 worker 的复用由共享会话存储保证
+sso_renewals = SingleFlight()
+
+# username -> 本进程上次写入 last_active_at 的时间，按写入先后排列；
+# 最多保留 SESSION_MAX_ENTRIES 人，被淘汰的用户下次访问时多写一次数据库
+_last_marked: "OrderedDict[str, int]" = OrderedDict()
+
+def get_db(request: Request) -> AsyncDatabase:
+    """lifespan 管理的异步数据库访问层；查询在数据库线程池中执行，不阻塞事件循环"""
+    return request.app.state.db
+
+def get_sync_jobs(request: Request) -> SyncJobQueue:
+    """lifespan 管理的后台同步任务队列"""
+    return request.app.state.sync_jobs
+
+async def upstream_deadline() -> None:
+    """
+    路由级依赖：为访问上游的请求设置整体截止时间，
+    sso / zdbk / timetable 的每一步上游调用都只能使用剩余的时间。
+    用法：@router.get(..., dependencies=[Depends(upstream_deadline)])
+    """
+    set_deadline(settings.UPSTREAM_REQUEST_DEADLINE)
+
+def parse_datetime_param(value: str, name: str, end_of_day: bool = False) -> datetime:
+    """在 API 边界统一规范化客户端传入的时间参数，格式错误返回 400"""
+    try:
+        return parse_client_datetime(value, end_of_day=end_of_day)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的时间参数 {name}: {value}")
+
+async def mark_active(db: AsyncDatabase, username: str) -> None:
+    """
+    记录用户最近活跃时间（全量刷新据此排优先级）。
+    每个进程对同一用户最多每 ACTIVE_MARK_INTERVAL 秒写一次数据库。
+    """
+    now = int(time.time())
+    if now - _last_marked.get(username, 0) < settings.ACTIVE_MARK_INTERVAL:
+        return
+    _last_marked[username] = now
+    _last_marked.move_to_end(username)
+    while len(_last_marked) > settings.SESSION_MAX_ENTRIES:
+        _last_marked.popitem(last=False)
+    await db.execute("UPDATE users SET last_active_at = ? WHERE username = ?", (now, username))
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)) -> str:
     """解码JWT，获取用户名"""
     try:
         payload = jwt.decode(token, settings.JWT_SECRET, algorithms=["HS256"])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="无效的认证凭证")
-        return username
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="无效的认证凭证")
+    await mark_active(request.app.state.db, username)
+    return username
 
-async def get_valid_sso_cookie(username: str = Depends(get_current_user)) -> str:
+async def renew_sso_cookie(db: AsyncDatabase, username: str, min_ttl: int = 0) -> str:
     """
-    获取有效的SSO Cookie。如果过期，则尝试自动重新登录。
+    用数据库中保存的凭证重新登录统一认证并写回会话存储。
+    同一用户的并发续期会合并为一次登录，所有调用方共享结果或异常。
+    min_ttl：已有 Cookie 剩余有效期超过该秒数时直接复用（后台续期用它判断其他 worker 是否已续过）。
     """
-    # 1. 尝试从会话存储中获取 cookie
-    sso_cookie = get_sso(username)
-    if sso_cookie:
-        return sso_cookie
+    async def renew() -> str:
+        # 其他 worker 可能刚刚完成续期，先复查共享会话存储
+        remaining = await sso_ttl(username)
+        if remaining is not None and remaining > min_ttl:
+            sso_cookie = await get_sso(username)
+            if sso_cookie:
+                return sso_cookie
 
-    # 2. 如果 cookie 不存在或已过期，尝试自动续期
-    print(f"SSO会话已过期，正在为用户 '{username}' 尝试自动续期...")
-    conn = get_conn(settings.DB_PATH)
-    try:
+        print(f"SSO会话已过期，正在为用户 '{username}' 尝试自动续期...")
         # 从数据库获取加密的密码
-        cur = conn.execute("SELECT password_encrypted FROM users WHERE username = ?", (username,))
-        user_row = cur.fetchone()
+        user_row = await db.fetchone("SELECT password_encrypted FROM users WHERE username = ?", (username,))
         if not user_row:
             raise HTTPException(status_code=401, detail="无法自动续期：找不到用户凭证")
 
         # 解密密码并重新登录
         decrypted_password = decrypt_password(user_row["password_encrypted"])
         new_sso_cookie = await get_sso_cookie(username, decrypted_password)
-        
+
         # 存储新的 cookie
-        set_sso(username, new_sso_cookie, ttl_seconds=3300)
+        await set_sso(username, new_sso_cookie, ttl_seconds=3300)
         print(f"用户 '{username}' 自动续期成功。")
         return new_sso_cookie
 
+    return await sso_renewals.do(username, renew)
+
+async def get_valid_sso_cookie(
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
+) -> str:
+    """
+    获取有效的SSO Cookie。如果过期，则尝试自动重新登录。
+    """
+    # 1. 尝试从会话存储中获取 cookie
+    await touch_session(username)
+    sso_cookie = await get_sso(username)
+    if sso_cookie:
+        return sso_cookie
+
+    # 2. 如果 cookie 不存在或已过期，尝试自动续期
+    try:
+        sso_cookie = await renew_sso_cookie(db, username)
+        await track_session(username)
+        return sso_cookie
+    except UpstreamUnavailable:
+        # 统一认证繁忙或超时不应让用户重新登录
+        raise
     except Exception as e:
         # 自动续期失败，要求用户重新登录
         print(f"用户 '{username}' 自动续期失败: {e}")
@@ -57,5 +134,3 @@ async def get_valid_sso_cookie(username: str = Depends(get_current_user)) -> str
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="登录态已过期，请重新登录",
         )
-    finally:
-        conn.close()
\ No newline at end of file
@@ -5,13 +5,15 @@ from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 
 from ..models.schemas import LoginReq, LoginResp, WeChatBindReq, WeChatLoginReq, CommonResp
+from ..services.governor import UpstreamUnavailable
 from ..services.sso import get_sso_cookie
 from ..services.wechat import get_openid_from_code # 导入微信服务
 from ..config import settings
 from ..storage.session_store import set_sso
-from ..storage.db import get_conn, init_schema
+from ..services.sso_refresher import touch_session, track_session
 from ..security import encrypt_password # 导入加密函数
-from .deps import get_current_user # 导入 get_current_user
+from .deps import get_current_user, get_db, mark_active, upstream_deadline # 导入 get_current_user
+from ..storage.async_db import AsyncDatabase
 
 router = APIRouter()
 
@@ -32,30 +34,32 @@ def _upsert_user_credentials(conn: sqlite3.Connection, username: str, password:
     conn.commit()
 
 
-@router.post("/login", response_model=LoginResp)
-async def login(req: LoginReq):
+@router.post("/login", response_model=LoginResp, dependencies=[Depends(upstream_deadline)])
+async def login(req: LoginReq, db: AsyncDatabase = Depends(get_db)):
     try:
         sso_cookie = await get_sso_cookie(req.username, req.password)
+    except UpstreamUnavailable:
+        # 上游繁忙/熔断/超时不是账号问题，原样返回 429/503/504
+        raise
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"登录失败: {e}")
 
     # --- 新增逻辑：保存或更新用户凭证 ---
-    conn = get_conn(settings.DB_PATH)
     is_bound = False
     try:
-        init_schema(conn) # 确保表存在
-        _upsert_user_credentials(conn, req.username, req.password)
-        is_bound = _check_is_bound(conn, req.username)
+        await db.run(_upsert_user_credentials, req.username, req.password)
+        is_bound = await db.run(_check_is_bound, req.username)
+        await mark_active(db, req.username)
     except Exception as db_err:
         # 即使数据库操作失败，本次登录也应该成功，只是无法自动续期
         # 此处可以添加日志记录
         print(f"警告: 存储用户凭证失败: {db_err}")
-    finally:
-        conn.close()
     # --- 新增逻辑结束 ---
 
     # 将 SSO 凭证保存到服务端“短期会话存储”
-    set_sso(req.username, sso_cookie, ttl_seconds=3300)
+    await set_sso(req.username, sso_cookie, ttl_seconds=3300)
+    await track_session(req.username)
+    await touch_session(req.username)
 
     token = jwt.encode(
         {"sub": req.username, "exp": int(time.time()) + 3600},
@@ -75,51 +79,43 @@ async def login(req: LoginReq):
 @router.post("/bind-wechat", response_model=CommonResp)
 async def bind_wechat(
     req: WeChatBindReq,
-    username: str = Depends(get_current_user)
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
 ):
     """
     将当前登录的用户账号与微信 openid 绑定。
     """
     openid = await get_openid_from_code(req.code)
-    conn = get_conn(settings.DB_PATH)
     try:
         # 将 openid 更新到当前用户的记录中
-        cur = conn.execute(
+        rowcount = await db.execute(
             "UPDATE users SET wechat_openid = ? WHERE username = ?",
             (openid, username)
         )
-        conn.commit()
-        if cur.rowcount == 0:
+        if rowcount == 0:
             raise HTTPException(status_code=404, detail="用户不存在")
     except sqlite3.IntegrityError:
         # UNIQUE 约束失败，意味着 openid 已被其他账号绑定
         raise HTTPException(status_code=400, detail="绑定失败，该微信已绑定其他账号")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"数据库操作失败: {e}")
-    finally:
-        conn.close()
     
     return CommonResp(code=0, message="绑定成功")
 
 
 @router.post("/login-by-wechat", response_model=LoginResp)
-async def login_by_wechat(req: WeChatLoginReq):
+async def login_by_wechat(req: WeChatLoginReq, db: AsyncDatabase = Depends(get_db)):
     """
     使用微信 code 进行免密登录。
     """
     openid = await get_openid_from_code(req.code)
-    conn = get_conn(settings.DB_PATH)
-    conn.row_factory = sqlite3.Row # 确保可以按列名访问
-    try:
-        cur = conn.execute("SELECT username FROM users WHERE wechat_openid = ?", (openid,))
-        user = cur.fetchone()
-    finally:
-        conn.close()
+    user = await db.fetchone("SELECT username FROM users WHERE wechat_openid = ?", (openid,))
 
     if not user:
         raise HTTPException(status_code=404, detail="该微信未绑定账号")
 
     username = user["username"]
+    await mark_active(db, username)
     # 生成新的 JWT Token
     token = jwt.encode(
         {"sub": username, "exp": int(time.time()) + 3600},
@@ -140,16 +136,15 @@ class UserInfoResp(CommonResp):
     data: dict
 
 @router.get("/me", response_model=UserInfoResp)
-async def get_my_info(username: str = Depends(get_current_user)):
+async def get_my_info(
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
+):
     """
     获取当前登录用户的基本信息（包括绑定状态）
     """
-    conn = get_conn(settings.DB_PATH)
-    try:
-        is_bound = _check_is_bound(conn, username)
-    finally:
-        conn.close()
-        
+    is_bound = await db.run(_check_is_bound, username)
+
     return {
         "code": 0,
         "message": "ok",
@@ -160,12 +155,14 @@ async def get_my_info(username: str = Depends(get_current_user)):
     }
 
 @router.post("/unbind-wechat", response_model=CommonResp)
-async def unbind_wechat(username: str = Depends(get_current_user)):
+async def unbind_wechat(
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
+):
     """
     解除当前登录用户与微信的绑定。
     """
-    conn = get_conn(settings.DB_PATH)
-    try:
+    def _unbind(conn: sqlite3.Connection):
         cur = conn.execute(
             "SELECT wechat_openid FROM users WHERE username = ?",
             (username,)
@@ -180,10 +177,10 @@ async def unbind_wechat(username: str = Depends(get_current_user)):
             (username,)
         )
         conn.commit()
+
+    try:
+        await db.run(_unbind)
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=f"数据库操作失败: {e}")
-    finally:
-        conn.close()
 
     return CommonResp(code=0, message="ok", data={"is_wechat_bound": False})
\ No newline at end of file
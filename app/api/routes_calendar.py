@@ -2,34 +2,35 @@ from fastapi import APIRouter, Query, Depends, HTTPException
 from fastapi.responses import Response
 from typing import Optional
 
-# 导入 get_conn 和 CommonResp
-from ..storage.db import get_conn
 from ..models.schemas import CommonResp
-from ..api.deps import get_current_user
+from ..api.deps import get_current_user, get_db, parse_datetime_param
+from ..storage.async_db import AsyncDatabase
 from ..services.calendar import build_events_from_db, generate_ics
-from ..config import settings
-import sqlite3
+from ..utils.datetimes import format_iso
+from fastapi.concurrency import run_in_threadpool
 
 router = APIRouter()
 
 
 # 1. 路径简化为 /calendar, 参数名与 events API 统一
 # 2. 使用 response_model 保持一致性
-# 3. 使用 Depends(get_conn) 管理数据库连接
+# 3. 使用 Depends(get_db) 获取异步数据库访问层，查询不阻塞事件循环
 @router.get("", response_model=CommonResp)
 async def get_calendar_events(
     start: str = Query(..., description="开始时间 (YYYY-MM-DDTHH:MM:SS)"),
     end: str = Query(..., description="结束时间 (YYYY-MM-DDTHH:MM:SS)"),
     season: Optional[str] = Query(None, description="可选：春/夏/秋/冬"),
     username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
 ):
     """
     返回指定日期区间内的日历事件（课程 + 自定义事件）
     """
-    conn = get_conn(settings.DB_PATH)
+    start = format_iso(parse_datetime_param(start, "start"))
+    end = format_iso(parse_datetime_param(end, "end", end_of_day=True))
     try:
         # 3. 直接将参数传递给服务层，不再手动拼接
-        events = build_events_from_db(conn, start, end, season=season, username=username)
+        events = await db.run(build_events_from_db, start, end, season=season, username=username)
         return CommonResp(code=0, message="ok", data=events)
     except Exception as e:
         # 打印错误方便调试
@@ -44,16 +45,19 @@ async def export_ics(
     end: str = Query(..., description="结束时间 (YYYY-MM-DDTHH:MM:SS)"),
     season: Optional[str] = Query(None, description="可选：春/夏/秋/冬"),
     username: str = Depends(get_current_user),
-    conn: sqlite3.Connection = Depends(get_conn),
+    db: AsyncDatabase = Depends(get_db),
 ):
     """
     在指定时间范围内导出 ICS 文件。
     """
+    start = format_iso(parse_datetime_param(start, "start"))
+    end = format_iso(parse_datetime_param(end, "end", end_of_day=True))
     try:
         # 关键修改：完全复用 build_events_from_db 函数，不再重复写 SQL
-        events = build_events_from_db(conn, start, end, season=season, username=username)
+        events = await db.run(build_events_from_db, start, end, season=season, username=username)
         
-        ics_text = generate_ics(events)
+        # ICS 文本拼接是纯 CPU 工作，放到线程池中执行
+        ics_text = await run_in_threadpool(generate_ics, events)
         return Response(content=ics_text, media_type="text/calendar")
     except HTTPException:
         raise
@@ -1,9 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from ..models.schemas import EventReq, CommonResp
 from typing import List, Optional
-from .deps import get_current_user
-from ..storage.db import get_conn
-from ..config import settings
+from .deps import get_current_user, get_db, parse_datetime_param
+from ..storage.async_db import AsyncDatabase
+from ..utils.datetimes import iso_to_epoch, to_epoch
 import sqlite3
 
 router = APIRouter()
@@ -16,19 +16,23 @@ def get_user_id(conn: sqlite3.Connection, username: str) -> int:
     return user_row["id"]
 
 @router.post("", response_model=CommonResp)
-async def add_event(req: EventReq, username: str = Depends(get_current_user)):
-    conn = get_conn(settings.DB_PATH)
-    try:
+async def add_event(
+    req: EventReq,
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
+):
+    def _add(conn: sqlite3.Connection):
         user_id = get_user_id(conn, username)
         conn.execute(
-            "INSERT INTO events (user_id, title, start_time, end_time, location) VALUES (?, ?, ?, ?, ?)",
-            (user_id, req.title, req.startTime, req.endTime, req.place)
+            "INSERT INTO events (user_id, title, start_time, end_time, location, start_ts, end_ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, req.title, req.startTime, req.endTime, req.place, iso_to_epoch(req.startTime), iso_to_epoch(req.endTime))
         )
         conn.commit()
+
+    try:
+        await db.run(_add)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建事件失败: {e}")
-    finally:
-        conn.close()
     return {"code": 0, "message": "ok"}
 
 # 改进：使用查询参数进行过滤，而不是请求体
@@ -37,66 +41,73 @@ async def list_events(
     username: str = Depends(get_current_user),
     start: Optional[str] = None, # 例如: 2025-12-01T00:00:00
     end: Optional[str] = None,   # 例如: 2025-12-31T23:59:59
+    db: AsyncDatabase = Depends(get_db),
 ):
-    conn = get_conn(settings.DB_PATH)
-    # 关键修复：确保返回的行是类似字典的对象
-    conn.row_factory = sqlite3.Row
-    try:
+    start_ts = to_epoch(parse_datetime_param(start, "start")) if start else None
+    end_ts = to_epoch(parse_datetime_param(end, "end", end_of_day=True)) if end else None
+
+    def _list(conn: sqlite3.Connection) -> List[dict]:
         user_id = get_user_id(conn, username)
         
         sql = "SELECT * FROM events WHERE user_id = ?"
         params = [user_id]
         
-        if start:
-            sql += " AND start_time >= ?"
-            params.append(start)
-        if end:
-            sql += " AND end_time <= ?"
-            params.append(end)
+        if start_ts is not None:
+            sql += " AND start_ts >= ?"
+            params.append(start_ts)
+        if end_ts is not None:
+            sql += " AND end_ts <= ?"
+            params.append(end_ts)
             
-        sql += " ORDER BY start_time"
+        sql += " ORDER BY start_ts"
         
         cur = conn.execute(sql, params)
         # 现在 dict(row) 可以正常工作了
-        events = [dict(row) for row in cur.fetchall()]
-        
+        return [dict(row) for row in cur.fetchall()]
+
+    try:
+        events = await db.run(_list)
     except Exception as e:
         # 增加日志打印，方便调试
         print(f"Error in list_events: {e}")
         raise HTTPException(status_code=500, detail=f"获取事件列表失败: {e}")
-    finally:
-        conn.close()
     return CommonResp(code=0, message="ok", data=events)
 
 @router.get("/{event_id}", response_model=CommonResp)
-async def get_event_by_id(event_id: int, username: str = Depends(get_current_user)):
+async def get_event_by_id(
+    event_id: int,
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
+):
     """
     获取单个事件的详情
     """
-    conn = get_conn(settings.DB_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
+    def _get(conn: sqlite3.Connection) -> Optional[sqlite3.Row]:
         user_id = get_user_id(conn, username)
         cur = conn.execute(
             "SELECT * FROM events WHERE id = ? AND user_id = ?",
             (event_id, user_id)
         )
-        event = cur.fetchone()
+        return cur.fetchone()
+
+    try:
+        event = await db.run(_get)
         if not event:
             raise HTTPException(status_code=404, detail="事件不存在或无权查看")
         
         return CommonResp(code=0, message="ok", data=dict(event))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取事件失败: {e}")
-    finally:
-        conn.close()
 
 
 # 改进：使用路径参数 {event_id} 来定位资源
 @router.delete("/{event_id}", response_model=CommonResp)
-async def delete_event(event_id: int, username: str = Depends(get_current_user)):
-    conn = get_conn(settings.DB_PATH)
-    try:
+async def delete_event(
+    event_id: int,
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
+):
+    def _delete(conn: sqlite3.Connection):
         user_id = get_user_id(conn, username)
         cur = conn.execute(
             "DELETE FROM events WHERE id = ? AND user_id = ?",
@@ -105,10 +116,11 @@ async def delete_event(event_id: int, username: str = Depends(get_current_user))
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="事件不存在或无权操作")
         conn.commit()
+
+    try:
+        await db.run(_delete)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除事件失败: {e}")
-    finally:
-        conn.close()
     return {"code": 0, "message": "ok"}
 
 # 改进：使用路径参数 {event_id} 来定位资源
@@ -116,22 +128,22 @@ async def delete_event(event_id: int, username: str = Depends(get_current_user))
 async def update_event(
     event_id: int,
     req: EventReq,
-    username: str = Depends(get_current_user)
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
 ):
-    conn = get_conn(settings.DB_PATH)
-    try:
+    def _update(conn: sqlite3.Connection):
         user_id = get_user_id(conn, username)
         cur = conn.execute(
-            "UPDATE events SET title = ?, start_time = ?, end_time = ?, location = ? "
+            "UPDATE events SET title = ?, start_time = ?, end_time = ?, location = ?, start_ts = ?, end_ts = ? "
             "WHERE id = ? AND user_id = ?",
-            (req.title, req.startTime, req.endTime, req.place, event_id, user_id)
+            (req.title, req.startTime, req.endTime, req.place, iso_to_epoch(req.startTime), iso_to_epoch(req.endTime), event_id, user_id)
         )
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="事件不存在或无权操作")
         conn.commit()
+
+    try:
+        await db.run(_update)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"更新事件失败: {e}")
-    finally:
-        conn.close()
     return {"code": 0, "message": "ok"}
-
@@ -1,6 +1,10 @@
 from fastapi import APIRouter
 from ..config import settings
-from typing import List, Dict
+from .deps import sso_renewals
+from ..services.governor import governor_stats
+from ..services.sso_refresher import refresher_stats
+from ..services.timetable import kcb_cache_stats
+from ..services.timetable_cache import cache_stats
 
 router = APIRouter()
 
@@ -15,4 +19,23 @@ async def get_term_configs():
     ]
     # 按学期ID降序排序，让最新的学期显示在最前面
     term_list.sort(key=lambda x: x["id"], reverse=True)
-    return {"code": 0, "message": "ok", "data": term_list}
\ No newline at end of file
+    return {"code": 0, "message": "ok", "data": term_list}
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    当前 worker 的运行指标。
+    sso_renewal.executed 为实际发起的 CAS 续期登录次数，shared 为被合并掉的并发续期次数；
+    sso_refresher 为后台续期器的排期与结果计数（未启用时为 null）；
+    timetable_cache 为 GET /timetable 缓存的命中 / 未命中 / 旧数据次数及合并的并发拉取；
+    upstream 为各上游主机闸门的排队深度、在途请求、拒绝次数与等待时间；
+    kcb_parser 为 kcb 文本解析 / 周次展开缓存的命中次数与命中率。
+    """
+    data = {
+        "sso_renewal": sso_renewals.stats(),
+        "sso_refresher": refresher_stats(),
+        "timetable_cache": cache_stats(),
+        "upstream": governor_stats(),
+        "kcb_parser": kcb_cache_stats(),
+    }
+    return {"code": 0, "message": "ok", "data": data}
@@ -1,11 +1,18 @@
-from fastapi import APIRouter, Query, Depends, HTTPException
-from typing import Optional, List, Literal
+import asyncio
+from fastapi import APIRouter, Query, Depends, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import Dict, Optional, List, Literal
 import sqlite3
-from ..models.schemas import TimetableRawResp
-from .deps import get_current_user, get_valid_sso_cookie # 导入新的依赖项
-from ..services.timetable import fetch_kblist, TimetableFetchError, parse_kblist_to_occurrences
-from ..storage.db import get_conn, init_schema, upsert_course, insert_occurrence, delete_occurrences_by_semester, cleanup_orphan_courses
 from ..config import settings
+from ..models.schemas import TimetableRawResp
+from .deps import get_current_user, get_valid_sso_cookie, get_db, get_sync_jobs, parse_datetime_param, upstream_deadline # 导入新的依赖项
+from ..services.timetable import fetch_kblist, fetch_kblists, parse_semester_id, TimetableFetchError
+from ..services.timetable_cache import get_kblist_cached, store_kblist
+from ..services.sync_jobs import JobQueueFull, SyncJobQueue
+from ..services.timetable_sync import plan_semester_sync, sync_kblist_to_db, sync_semesters_to_db
+from ..storage.async_db import AsyncDatabase
+from ..storage.db import get_sync_fingerprints, query_occurrences_in_range, query_occurrences_in_week
+from ..utils.datetimes import to_epoch
 
 router = APIRouter()
 
@@ -17,66 +24,141 @@ def get_user_id(conn: sqlite3.Connection, username: str) -> int:
         raise HTTPException(status_code=404, detail="用户不存在")
     return user_row["id"]
 
-@router.get("", response_model=TimetableRawResp)
+@router.get("", response_model=TimetableRawResp, dependencies=[Depends(upstream_deadline)])
 async def get_timetable(
+    response: Response,
     semester: str = Query(..., description="例如 2024-2025-1 或 2024-2025-2"),
     strict: Optional[bool] = Query(True, description="为 false 时不按学期过滤，直接返回全部 kbList"),
-    sso_cookie: str = Depends(get_valid_sso_cookie), # 使用新的依赖项
+    refresh: bool = Query(False, description="为 true 时跳过缓存，强制从教务系统拉取"),
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
 ):
+    async def fetch():
+        # 只有缓存未命中时才需要有效的 SSO 会话
+        sso_cookie = await get_valid_sso_cookie(username, db)
+        return await fetch_kblist(sso_cookie, semester_id=semester, strict_filter=bool(strict), username=username)
+
     try:
-        kb_list = await fetch_kblist(sso_cookie, semester_id=semester, strict_filter=bool(strict))
+        kb_list, cache_status = await get_kblist_cached(username, semester, bool(strict), fetch, refresh=refresh)
+        response.headers["X-Cache"] = cache_status
         return {"code": 0, "message": "ok", "data": {"kbList": kb_list}}
+    except HTTPException:
+        raise
     except TimetableFetchError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"未知错误: {e}")
 
-@router.post("/sync")
+@router.post("/sync", dependencies=[Depends(upstream_deadline)])
 async def sync_timetable(
     semester: str = Query(...),
+    async_: bool = Query(False, alias="async", description="为 true 时提交后台任务，立即返回 job_id"),
     username: str = Depends(get_current_user),
-    sso_cookie: str = Depends(get_valid_sso_cookie), # 使用新的依赖项
+    db: AsyncDatabase = Depends(get_db),
+    jobs: SyncJobQueue = Depends(get_sync_jobs),
 ):
+    if async_:
+        try:
+            parse_semester_id(semester)
+        except TimetableFetchError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        user_id = await db.run(get_user_id, username)
+        try:
+            # 同一用户同一学期已有未完成的任务时直接复用
+            job_id, attached = await jobs.submit(user_id, username, semester)
+        except JobQueueFull:
+            raise HTTPException(status_code=503, detail="同步任务排队已满，请稍后重试", headers={"Retry-After": "5"})
+        return {"code": 0, "message": "ok", "data": {"job_id": job_id, "attached": attached}}
+
+    sso_cookie = await get_valid_sso_cookie(username, db)
     try:
-        kb_list = await fetch_kblist(sso_cookie, semester_id=semester, strict_filter=True)
+        kb_list = await fetch_kblist(sso_cookie, semester_id=semester, strict_filter=True, username=username)
     except TimetableFetchError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    # 刚拉到的就是最新课表，顺带刷新 GET /timetable 的缓存
+    await store_kblist(username, semester, True, kb_list)
 
-    # 将课表数据转化为记录
-    occs = parse_kblist_to_occurrences(kb_list) 
+    def _sync(conn: sqlite3.Connection):
+        user_id = get_user_id(conn, username)
+        # 指纹未变直接返回；否则只应用行级差异（新增 / 变更 / 删除）
+        return sync_kblist_to_db(conn, user_id, semester, kb_list)
+
+    # 解析与写库都在数据库线程中完成
+    result = await db.run(_sync)
+
+    return {"code": 0, "message": "ok", "data": result}
+
+@router.get("/sync/{job_id}")
+async def get_sync_job(
+    job_id: str,
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
+    jobs: SyncJobQueue = Depends(get_sync_jobs),
+):
+    """查询后台同步任务：status 为 queued / running / succeeded / failed，stage 为当前阶段"""
+    user_id = await db.run(get_user_id, username)
+    job = await jobs.get(job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"code": 0, "message": "ok", "data": job}
 
-    conn = get_conn(settings.DB_PATH)
-    init_schema(conn)
+@router.post("/sync-range", dependencies=[Depends(upstream_deadline)])
+async def sync_timetable_range(
+    semesters: List[str] = Query(..., description="可重复传参或逗号分隔，例如 2025-2026-1,2025-2026-2"),
+    username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
+):
+    """
+    一次同步多个学期：只登录一次教务系统，并发拉取各学期 kbList，
+    在线程中并行计算指纹与解析，最后在同一个事务中写入全部学期。
+    返回每个学期各自的结果；拉取失败的学期给出 error，不影响其他学期写入。
+    """
+    semester_ids = list(dict.fromkeys(s.strip() for item in semesters for s in item.split(",") if s.strip()))
+    if not semester_ids:
+        raise HTTPException(status_code=400, detail="semesters 不能为空")
+    if len(semester_ids) > settings.SYNC_RANGE_MAX_SEMESTERS:
+        raise HTTPException(status_code=400, detail=f"一次最多同步 {settings.SYNC_RANGE_MAX_SEMESTERS} 个学期")
+    for semester in semester_ids:
+        try:
+            parse_semester_id(semester)
+        except TimetableFetchError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if semester not in settings.TERM_CONFIGS:
+            raise HTTPException(status_code=400, detail=f"未配置的学期: {semester}")
+
+    # 参数校验通过后才取 SSO Cookie，非法请求不会触发 CAS 续期
+    sso_cookie = await get_valid_sso_cookie(username, db)
     try:
+        fetched = await fetch_kblists(sso_cookie, semester_ids, username, concurrency=settings.SYNC_RANGE_CONCURRENCY)
+    except TimetableFetchError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    results: Dict[str, Dict] = {}
+    kb_lists: Dict[str, List[Dict]] = {}
+    for semester, outcome in fetched.items():
+        if isinstance(outcome, Exception):
+            detail = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+            results[semester] = {"error": detail}
+        else:
+            kb_lists[semester] = outcome
+            await store_kblist(username, semester, True, outcome)
+    if not kb_lists:
+        raise HTTPException(status_code=500, detail=f"所有学期拉取失败: {results}")
+
+    def _prepare(conn: sqlite3.Connection):
         user_id = get_user_id(conn, username)
-        # 先清空该学期旧数据
-        delete_occurrences_by_semester(conn, user_id, semester)
-
-        for occ in occs:
-            course_id = upsert_course(conn, user_id, occ["course_code"], occ["course_name"], occ["teacher"])
-            insert_occurrence(conn, {
-                "course_id": course_id,
-                "week": occ["week"],
-                "weekday": occ["weekday"],
-                "period_start": occ["period_start"],
-                "period_count": occ["period_count"],
-                "classroom": occ["classroom"],
-                "starts_at": occ["starts_at"],
-                "ends_at": occ["ends_at"],
-                "single_week": occ["single_week"],
-                "double_week": occ["double_week"],
-                "season": occ["season"],
-                "semester": occ.get("semester"),
-                "note": occ["note"],
-            })
-        # 可选：清理不再引用的课程
-        cleanup_orphan_courses(conn)
-
-        conn.commit()
-    finally:
-        conn.close()
-
-    return {"code": 0, "message": "ok", "data": {"synced": len(occs)}}
+        return user_id, get_sync_fingerprints(conn, user_id, kb_lists)
+
+    user_id, stored = await db.run(_prepare)
+    # 各学期的指纹计算与解析互不依赖，并行放到线程池
+    plans = await asyncio.gather(*(
+        run_in_threadpool(plan_semester_sync, kb_list, semester, stored.get(semester))
+        for semester, kb_list in kb_lists.items()
+    ))
+    written = await db.run(sync_semesters_to_db, user_id, dict(zip(kb_lists, plans)))
+    results.update(written)
+
+    return {"code": 0, "message": "ok", "data": {s: results[s] for s in semester_ids}}
 
 @router.get("/by-week")
 async def by_week(
@@ -84,78 +166,59 @@ async def by_week(
     season: Optional[str] = Query(None, pattern="^(春|夏|秋|冬)$"),
     weekday: Optional[int] = Query(None, ge=1, le=7),
     username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
 ):
-    conn = get_conn(settings.DB_PATH)
-    try:
+    def _query(conn: sqlite3.Connection) -> List[dict]:
         user_id = get_user_id(conn, username)
-        sql = """SELECT o.*, c.name as course_name, c.teacher, c.course_code
-                 FROM occurrences o JOIN courses c ON o.course_id = c.id
-                 WHERE c.user_id = ? AND o.week = ?"""
-        params: List = [user_id, week]
-        if season:
-            sql += " AND o.season = ?"
-            params.append(season)
-        if weekday:
-            sql += " AND o.weekday = ?"
-            params.append(weekday)
-        sql += " ORDER BY o.weekday, o.period_start"
-        cur = conn.execute(sql, params)
-        rows = [dict(r) for r in cur.fetchall()]
-        events = [
-            {
-                "id": r["id"],
-                "weekday": r["weekday"],
-                "season": r["season"],
-                "title": r["course_name"],
-                "teacher": r["teacher"],
-                "classroom": r["classroom"],
-                "periodStart": r["period_start"],
-                "periodCount": r["period_count"],
-                "start": r["starts_at"],
-                "end": r["ends_at"],
-                "courseCode": r["course_code"]
-            } for r in rows
-        ]
-        return {"code": 0, "message": "ok", "data": events}
-    finally:
-        conn.close()
+        # 只取该周有课的课程安排（周次位图筛选），再展开出这一周
+        return query_occurrences_in_week(conn, user_id, week, season=season, weekday=weekday)
+
+    rows = await db.run(_query)
+    events = [
+        {
+            "id": r["id"],
+            "weekday": r["weekday"],
+            "season": r["season"],
+            "title": r["course_name"],
+            "teacher": r["teacher"],
+            "classroom": r["classroom"],
+            "periodStart": r["period_start"],
+            "periodCount": r["period_count"],
+            "start": r["starts_at"],
+            "end": r["ends_at"],
+            "courseCode": r["course_code"]
+        } for r in rows
+    ]
+    return {"code": 0, "message": "ok", "data": events}
 
 @router.get("/by-date")
 async def by_date(
     date_str: str = Query(..., description="YYYY-MM-DD"),
     season: Optional[str] = Query(None, pattern="^(春|夏|秋|冬)$"),
     username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
 ):
-    conn = get_conn(settings.DB_PATH)
-    try:
+    start = parse_datetime_param(date_str, "date_str")
+    end = parse_datetime_param(date_str, "date_str", end_of_day=True)
+
+    def _query(conn: sqlite3.Connection) -> List[dict]:
         user_id = get_user_id(conn, username)
-        start = f"{date_str}T00:00:00"
-        end = f"{date_str}T23:59:59"
-        sql = """SELECT o.*, c.name as course_name, c.teacher, c.course_code
-                 FROM occurrences o JOIN courses c ON o.course_id = c.id
-                 WHERE c.user_id = ? AND o.starts_at >= ? AND o.ends_at <= ?"""
-        params: List = [user_id, start, end]
-        if season:
-            sql += " AND o.season = ?"
-            params.append(season)
-        sql += " ORDER BY o.starts_at ASC"
-        cur = conn.execute(sql, params)
-        rows = [dict(r) for r in cur.fetchall()]
-        events = [
-            {
-                "id": r["id"],
-                "season": r["season"],
-                "title": r["course_name"],
-                "subtitle": f'{r["teacher"]} · {r["classroom"]}',
-                "start": r["starts_at"],
-                "end": r["ends_at"],
-                "location": r["classroom"],
-                "courseCode": r["course_code"]
-            } for r in rows
-        ]
-        return {"code": 0, "message": "ok", "data": events}
-    finally:
-        conn.close()
+        return query_occurrences_in_range(conn, user_id, to_epoch(start), to_epoch(end), season=season)
+
+    rows = await db.run(_query)
+    events = [
+        {
+            "id": r["id"],
+            "season": r["season"],
+            "title": r["course_name"],
+            "subtitle": f'{r["teacher"]} · {r["classroom"]}',
+            "start": r["starts_at"],
+            "end": r["ends_at"],
+            "location": r["classroom"],
+            "courseCode": r["course_code"]
+        } for r in rows
+    ]
+    return {"code": 0, "message": "ok", "data": events}
 
 @router.get("/template")
 async def get_week_template(
@@ -163,6 +226,7 @@ async def get_week_template(
     season_type: int = Query(..., description="前半学期：1（春秋），后半学期：2（冬夏）"),
     week_type_input: int = Query(..., description="周类型：1=单周，2=双周"),
     username: str = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db),
 ):
     if semester.endswith("-1"):
         season = "秋" if season_type == 1 else "冬"
@@ -177,46 +241,45 @@ async def get_week_template(
     获取指定学期、季节和周类型的“周课表模板”。
     这个接口会返回一个去重后的、代表一周内所有课程安排的列表。
     """
-    conn = get_conn(settings.DB_PATH)
-    conn.row_factory = sqlite3.Row  # 确保可以按列名访问
     try:
-        user_id = get_user_id(conn, username)
-        # 我们使用 GROUP BY 对课程、星期、节次等关键信息进行分组
-        # 这样，一门每周都上的课在模板中只会出现一次
+        # 直接读课程安排：每个课程安排（课程 × 星期 × 节次 × 教室 × 季节）本来就只有一行，不必再按周折叠；
+        # 同一时段拆成多段周次的课程安排（如 1-8 周与 10-16 周）用 GROUP BY 合并为一条
         sql = """
         SELECT
-            o.weekday,
-            o.period_start,
-            o.period_count,
-            o.classroom,
-            o.season,
-            o.single_week,
-            o.double_week,
+            s.weekday,
+            s.period_start,
+            s.period_count,
+            s.classroom,
+            s.season,
+            s.single_week,
+            s.double_week,
             c.name AS course_name,
             c.teacher,
-            c.course_code,
-            GROUP_CONCAT(DISTINCT o.week) AS weeks_raw
-        FROM occurrences o
-        JOIN courses c ON o.course_id = c.id
-        WHERE c.user_id = ? AND o.semester = ? AND o.season = ?
+            c.course_code
+        FROM course_schedules s
+        JOIN courses c ON s.course_id = c.id
+        WHERE s.user_id = ? AND s.semester = ? AND s.season = ?
         """
-        params: List = [user_id, semester, season]
+        params: List = [semester, season]
 
         if week_type == "single":
-            sql += " AND o.double_week = 0"
+            sql += " AND s.double_week = 0"
         elif week_type == "double":
-            sql += " AND o.single_week = 0"
+            sql += " AND s.single_week = 0"
         # 如果 week_type 是 'all'，则不添加额外筛选条件
 
         sql += """
         GROUP BY
-            c.id, o.weekday, o.period_start, o.period_count, o.classroom, o.season, o.single_week, o.double_week
+            c.id, s.weekday, s.period_start, s.period_count, s.classroom, s.season, s.single_week, s.double_week
         ORDER BY
-            o.weekday, o.period_start;
+            s.weekday, s.period_start;
         """
 
-        cur = conn.execute(sql, params)
-        rows = cur.fetchall()
+        def _query(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+            user_id = get_user_id(conn, username)
+            return conn.execute(sql, [user_id] + params).fetchall()
+
+        rows = await db.run(_query)
 
         # 将查询结果格式化为更友好的 JSON
         template_events = [
@@ -234,6 +297,4 @@ async def get_week_template(
         return {"code": 0, "message": "ok", "data": template_events}
     except Exception as e:
         # 可以在这里添加更详细的日志记录
-        raise HTTPException(status_code=500, detail=f"生成课表模板时出错: {e}")
-    finally:
-        conn.close()
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"生成课表模板时出错: {e}")
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+命令行入口（与服务共用配置与数据库）。
+
+用法：
+    python -m app.cli fleet-refresh [--semester 2025-2026-1] [--concurrency 4] [--rate 2] [--parse-workers 2]
+    python -m app.cli fleet-report [--run-id 12]
+
+fleet-refresh 优先接手心跳已超时的中断 run，否则新建；
+该学期的 run 正由服务进程（或另一个命令行进程）执行时直接退出。
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from .api.deps import renew_sso_cookie
+from .config import settings
+from .services.fleet_refresh import FleetRefresh, build_report
+from .services.http import close_clients, start_clients
+from .services.parse_pool import ParsePool
+from .storage.async_db import AsyncDatabase
+from .storage.db import ConnectionPool
+from .storage.migrations import migrate
+from .storage.session_store import close_store, get_store
+
+def _open_db() -> AsyncDatabase:
+    return AsyncDatabase(ConnectionPool(
+        settings.DB_PATH,
+        size=settings.DB_POOL_SIZE,
+        timeout=settings.DB_POOL_TIMEOUT,
+        busy_timeout_ms=settings.DB_BUSY_TIMEOUT_MS,
+    ))
+
+async def fleet_refresh(args) -> int:
+    db = _open_db()
+    try:
+        await db.run(migrate)
+        get_store()
+        start_clients()
+        parse_pool = ParsePool(args.parse_workers, settings.PARSE_POOL_MIN_BATCH)
+        try:
+            refresh = FleetRefresh(
+                db,
+                lambda username, min_ttl: renew_sso_cookie(db, username, min_ttl=min_ttl),
+                semester=args.semester,
+                concurrency=args.concurrency,
+                rate=args.rate,
+                parse_pool=parse_pool,
+            )
+            run_id = await refresh.acquire_run()
+            if run_id is None:
+                print(f"学期 {refresh.semester} 的全量刷新正在其他进程中执行", file=sys.stderr)
+                return 1
+            report = await refresh.run(run_id)
+        finally:
+            parse_pool.close()
+            await close_clients()
+            close_store()
+    finally:
+        db.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report and report["failed"] == 0 else 2
+
+async def fleet_report(args) -> int:
+    db = _open_db()
+    try:
+        await db.run(migrate)
+        report = await db.run(build_report, args.run_id)
+    finally:
+        db.close()
+    if report is None:
+        print("没有找到刷新记录", file=sys.stderr)
+        return 1
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="课表服务命令行工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fleet-refresh", help="为所有已保存凭证的用户重新同步课表")
+    p.add_argument("--semester", default=settings.CURRENT_TERM)
+    p.add_argument("--concurrency", type=int, default=settings.FLEET_REFRESH_CONCURRENCY)
+    p.add_argument("--rate", type=float, default=settings.FLEET_REFRESH_RATE, help="每秒最多开始刷新的用户数")
+    p.add_argument("--parse-workers", type=int, default=settings.PARSE_POOL_WORKERS, help="解析子进程数，0 表示在本进程中解析")
+    p.set_defaults(handler=fleet_refresh)
+
+    p = sub.add_parser("fleet-report", help="输出全量刷新的汇总报告")
+    p.add_argument("--run-id", type=int, default=None, help="默认最近一次")
+    p.set_defaults(handler=fleet_report)
+
+    args = parser.parse_args()
+    return asyncio.run(args.handler(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,80 @@ TermPeriods = List[Tuple[time, time]]
 
 class Settings(BaseSettings):
     DB_PATH: str = "data/schedule.db"
+    # SQLite 连接池：连接在进程生命周期内复用，避免每个请求重复 connect / PRAGMA
+    DB_POOL_SIZE: int = 8
+    DB_POOL_TIMEOUT: float = 10.0        # 借出连接的最长等待秒数
+    DB_BUSY_TIMEOUT_MS: int = 5000       # 写锁冲突时的等待毫秒数（PRAGMA busy_timeout）
+    DB_CACHE_SIZE_KB: int = 8192         # 每个连接的页缓存大小（PRAGMA cache_size，单位 KiB）
+    DB_STATEMENT_CACHE_SIZE: int = 256   # 每个连接缓存的预编译语句数量
+    # SSO 等会话存储："sqlite" 为多 worker 共享的独立数据库文件，"memory" 仅限单 worker
+    SESSION_BACKEND: str = "sqlite"
+    SESSION_DB_PATH: str = "data/sessions.db"
+    SESSION_MAX_ENTRIES: int = 10000     # 超出后按最近访问时间淘汰
+    SESSION_SWEEP_INTERVAL: float = 60.0 # 后台清理过期会话的间隔秒数
+    # SSO 后台续期：对近期活跃用户在 Cookie 过期前 MARGIN 秒重新登录
+    SSO_REFRESH_ENABLED: bool = True
+    SSO_REFRESH_MARGIN: int = 300
+    SSO_REFRESH_JITTER: float = 60.0          # 在 MARGIN 基础上随机再提前 0~JITTER 秒，错开续期请求
+    SSO_REFRESH_CONCURRENCY: int = 4          # 同时进行的续期登录数上限
+    SSO_REFRESH_ACTIVE_WINDOW: int = 7200     # 最近多少秒内有请求的用户才会被续期
+    JW_SESSION_TTL: int = 1200                # 教务会话缓存秒数（每次成功使用后顺延）
+    CAS_PUBKEY_TTL: int = 300                 # 统一认证 RSA 公钥的缓存秒数
+    # GET /timetable 的 kbList 缓存：TTL 内直接返回；过期后 STALE_TTL 内先返回旧数据再后台刷新
+    TIMETABLE_CACHE_TTL: int = 600
+    TIMETABLE_CACHE_STALE_TTL: int = 86400
+    # kbList 缓存使用独立的存储与容量上限，不与 SSO / 教务会话争抢 SESSION_MAX_ENTRIES
+    TIMETABLE_CACHE_DB_PATH: str = "data/timetable_cache.db"
+    TIMETABLE_CACHE_MAX_ENTRIES: int = 2000
+    # 课表响应不超过该字符数时整体解析 JSON；更大时只解码 kbList 数组（响应越大越划算，见 bench_kblist_extract）
+    KBLIST_FULL_PARSE_MAX_CHARS: int = 65536
+    KCB_PARSE_CACHE_SIZE: int = 8192          # kcb 文本解析结果的 LRU 条目数（按教学班跨用户复用）
+    # 上游并发闸门：每个主机的并发上限与令牌桶限速（次/秒、突发量），以及共用的排队上限
+    UPSTREAM_CAS_CONCURRENCY: int = 8
+    UPSTREAM_CAS_RATE: float = 10.0
+    UPSTREAM_CAS_BURST: int = 20
+    UPSTREAM_ZDBK_CONCURRENCY: int = 8
+    UPSTREAM_ZDBK_RATE: float = 10.0
+    UPSTREAM_ZDBK_BURST: int = 20
+    UPSTREAM_MAX_QUEUE: int = 100             # 每个主机最多排队等待的请求数，超出直接 503
+    UPSTREAM_MAX_WAIT: float = 5.0            # 排队 + 限速的最长等待秒数
+    UPSTREAM_BREAKER_FAILURES: int = 5        # 连续多少次失败（连接/超时错误或 5xx 响应）后熔断
+    UPSTREAM_BREAKER_COOLDOWN: float = 30.0   # 熔断持续秒数，之后放行一个探测请求
+    UPSTREAM_REQUEST_DEADLINE: float = 20.0   # 访问上游的路由整体截止秒数（CAS + 教务各步共用）
+    # 多学期同步（/timetable/sync-range）
+    SYNC_RANGE_MAX_SEMESTERS: int = 8
+    SYNC_RANGE_CONCURRENCY: int = 3           # 同时拉取的学期数
+    # 后台同步任务（/timetable/sync?async=true）
+    SYNC_JOB_WORKERS: int = 2                 # 每个进程同时执行的任务数
+    SYNC_JOB_MAX_PENDING: int = 100           # 排队任务上限，超出直接 503
+    SYNC_JOB_TIMEOUT: float = 60.0            # 单个任务（拉取 + 写库）的截止秒数
+    SYNC_JOB_STALE_SECONDS: int = 600         # 超过该时长仍未完成的任务视为中断
+    SYNC_JOB_HEARTBEAT: float = 10.0          # 任务队列所在进程的心跳间隔秒数
+    SYNC_JOB_OWNER_TIMEOUT: int = 30          # 心跳超过该时长未更新的进程视为已退出，其未完成任务标记失败
+    SYNC_JOB_RETENTION: int = 86400           # 已完成任务记录保留秒数
+    # 全量定时刷新（所有已保存凭证的用户，学期为 CURRENT_TERM；也可用 python -m app.cli fleet-refresh 手动执行）
+    FLEET_REFRESH_ENABLED: bool = True
+    FLEET_REFRESH_HOUR: int = 3               # 每日在该小时（北京时间）内开始
+    FLEET_REFRESH_MIN_INTERVAL: int = 72000   # 两次 run 开始的最小间隔秒数
+    FLEET_REFRESH_CHECK_INTERVAL: float = 300.0
+    FLEET_REFRESH_CONCURRENCY: int = 4
+    FLEET_REFRESH_RATE: float = 2.0           # 每秒最多开始刷新的用户数（每人约 1~3 个上游请求）
+    FLEET_REFRESH_MAX_ATTEMPTS: int = 3       # 上游繁忙时每个用户的最多尝试次数
+    FLEET_REFRESH_USER_TIMEOUT: float = 30.0  # 单个用户（登录 + 拉取）的截止秒数
+    FLEET_REFRESH_BATCH_SIZE: int = 64        # 拉取完成的用户攒满这么多人一起解析、写库
+    FLEET_REFRESH_BATCH_WAIT: float = 1.0     # 攒批最多等待的秒数，不足一批也按时处理
+    FLEET_REFRESH_HEARTBEAT: float = 30.0
+    FLEET_REFRESH_STALE_SECONDS: int = 300    # 心跳超过该时长未更新的 run 可被接手
+    ACTIVE_MARK_INTERVAL: int = 300           # users.last_active_at 每个用户最多多久写一次
+    # kbList 解析进程池（全量刷新等大批量同步时使用，每批用户为一个任务；0 表示始终在本进程中解析）
+    PARSE_POOL_WORKERS: int = 2
+    PARSE_POOL_MIN_BATCH: int = 50            # 批次用户数少于该值时不启用子进程
+    # 上游 HTTP 连接池（每个上游主机一个长连接客户端，由 lifespan 管理）
+    HTTP_POOL_MAX_CONNECTIONS: int = 50
+    HTTP_POOL_MAX_KEEPALIVE: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_HTTP2: bool = False                  # 需要安装 h2（httpx[http2]）
     JWT_SECRET: str = "a_very_secret_key_change_it_in_production"
     ENCRYPTION_KEY: str = "5ZNNJxlB_leSfnTvWTWZp5dqc1-6gvW97_3CeYl43PE="
 
@@ -1,10 +1,85 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.security import HTTPBearer
 from .api.router import api_router
+from .config import settings
+from .storage.async_db import AsyncDatabase
+from .storage.db import ConnectionPool
+from .storage.migrations import migrate
+from .storage.session_store import close_store, get_store, run_sweeper
+from .services.http import close_clients, start_clients
+from .services.sso_refresher import start_refresher, stop_refresher
+from .services.sync_jobs import SyncJobQueue
+from .services.fleet_refresh import run_scheduler
+from .services.parse_pool import ParsePool
+from .api.deps import get_valid_sso_cookie, renew_sso_cookie
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 进程级资源：启动时建立，关闭时释放
+    pool = ConnectionPool(
+        settings.DB_PATH,
+        size=settings.DB_POOL_SIZE,
+        timeout=settings.DB_POOL_TIMEOUT,
+        busy_timeout_ms=settings.DB_BUSY_TIMEOUT_MS,
+        cache_size_kb=settings.DB_CACHE_SIZE_KB,
+        cached_statements=settings.DB_STATEMENT_CACHE_SIZE,
+    )
+    app.state.db = AsyncDatabase(pool)
+    try:
+        # 表结构只在启动时迁移一次；数据库版本高于代码时直接启动失败
+        await app.state.db.run(migrate)
+        # 提前建立会话存储，配置错误时启动即失败
+        get_store()
+        start_clients()
+        sweeper = asyncio.create_task(run_sweeper(settings.SESSION_SWEEP_INTERVAL))
+        refresher = None
+        if settings.SSO_REFRESH_ENABLED:
+            refresher = start_refresher(
+                lambda username, min_ttl: renew_sso_cookie(app.state.db, username, min_ttl=min_ttl),
+                margin=settings.SSO_REFRESH_MARGIN,
+                jitter=settings.SSO_REFRESH_JITTER,
+                concurrency=settings.SSO_REFRESH_CONCURRENCY,
+                active_window=settings.SSO_REFRESH_ACTIVE_WINDOW,
+            )
+        app.state.sync_jobs = SyncJobQueue(
+            app.state.db,
+            lambda username: get_valid_sso_cookie(username, app.state.db),
+            workers=settings.SYNC_JOB_WORKERS,
+            max_pending=settings.SYNC_JOB_MAX_PENDING,
+        )
+        await app.state.sync_jobs.start()
+        app.state.parse_pool = ParsePool(settings.PARSE_POOL_WORKERS, settings.PARSE_POOL_MIN_BATCH)
+        fleet = None
+        if settings.FLEET_REFRESH_ENABLED:
+            fleet = asyncio.create_task(run_scheduler(
+                app.state.db,
+                lambda username, min_ttl: renew_sso_cookie(app.state.db, username, min_ttl=min_ttl),
+                parse_pool=app.state.parse_pool,
+            ))
+        try:
+            yield
+        finally:
+            if fleet is not None:
+                fleet.cancel()
+                await asyncio.gather(fleet, return_exceptions=True)
+            await app.state.sync_jobs.stop()
+            app.state.parse_pool.close()
+            if refresher is not None:
+                await stop_refresher(refresher)
+            sweeper.cancel()
+            await close_clients()
+            close_store()
+    finally:
+        app.state.db.close()
+
 
 app = FastAPI(
     title="Schedule Backend",
     version="0.1.0",
+    lifespan=lifespan,
     # 添加安全定义（可选）
     openapi_tags=[
         {"name": "auth", "description": "认证与登录"},
@@ -20,4 +95,4 @@ app.include_router(api_router, prefix="/api")
 
 @app.get("/healthz")
 def healthz():
-    return {"ok": True}
\ No newline at end of file
+    return {"ok": True}
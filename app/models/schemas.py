@@ -1,6 +1,8 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, Any, List, Dict, Union
 
+from ..utils.datetimes import format_iso, parse_client_datetime
+
 class CommonResp(BaseModel):
     code: int = 0
     message: str = "ok"
@@ -49,6 +51,12 @@ class EventReq(BaseModel):
     endTime: str
     place: Optional[str] = None
 
+    # 入库前统一规范为 YYYY-MM-DDTHH:MM:SS
+    @field_validator("startTime", "endTime")
+    @classmethod
+    def normalize_time(cls, v: str) -> str:
+        return format_iso(parse_client_datetime(v))
+
 # 添加以下模型
 class UserCreate(BaseModel):
     username: str
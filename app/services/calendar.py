@@ -4,6 +4,9 @@ import sqlite3
 import hashlib
 import uuid
 
+from ..storage.db import query_occurrences_in_range
+from ..utils.datetimes import iso_to_epoch
+
 def _iso_to_dt(s: str) -> datetime:
     # 支持 ISO 格式字符串（无时区）
     return datetime.fromisoformat(s)
@@ -16,8 +19,8 @@ def _make_uid(event: dict) -> str:
 
 def build_events_from_db(conn: sqlite3.Connection, start_iso: str, end_iso: str, season: Optional[str]=None, username: Optional[str]=None) -> List[dict]:
     """
-    从数据库读取 occurrences + courses 并格式化为统一事件列表。
-    start_iso/end_iso 格式：YYYY-MM-DDTHH:MM:SS
+    从数据库读取课程安排（按周展开为上课记录）与自定义事件，并格式化为统一事件列表。
+    start_iso/end_iso 格式：YYYY-MM-DDTHH:MM:SS（由 API 层规范化），内部转为 epoch 秒做整数范围比较
     season: 可选 '春'/'夏'/'秋'/'冬' 进行过滤
     username: 可选，若你的表有 user/owner 字段可据此过滤（当前实现尝试兼容存在与否）
     """
@@ -33,19 +36,11 @@ def build_events_from_db(conn: sqlite3.Connection, start_iso: str, end_iso: str,
         # 如果没有用户上下文，则无法查询事件，可以返回空或抛出异常
         return []
 
-    # 1. 查询课程事件 (occurrences)
-    sql_courses = """SELECT o.*, c.name as course_name, c.teacher, c.course_code
-                     FROM occurrences o JOIN courses c ON o.course_id = c.id
-                     WHERE c.user_id = ? AND o.starts_at >= ? AND o.ends_at <= ?"""
-    params_courses = [user_id, start_iso, end_iso]
-    if season:
-        sql_courses += " AND o.season = ?"
-        params_courses.append(season)
-    sql_courses += " ORDER BY o.starts_at"
+    start_ts = iso_to_epoch(start_iso)
+    end_ts = iso_to_epoch(end_iso)
 
-    cur_courses = conn.execute(sql_courses, params_courses)
-    for r in cur_courses.fetchall():
-        r_dict = dict(r)
+    # 1. 查询课程事件：课程安排按时间范围筛选后按周展开
+    for r_dict in query_occurrences_in_range(conn, user_id, start_ts, end_ts, season):
         events.append({
             "id": r_dict.get("id"),
             "title": r_dict.get("course_name"),
@@ -62,9 +57,9 @@ def build_events_from_db(conn: sqlite3.Connection, start_iso: str, end_iso: str,
 
     # 2. 查询自定义事件 (events)
     sql_events = """SELECT * FROM events
-                    WHERE user_id = ? AND start_time >= ? AND end_time <= ?
-                    ORDER BY start_time"""
-    cur_events = conn.execute(sql_events, [user_id, start_iso, end_iso])
+                    WHERE user_id = ? AND start_ts >= ? AND end_ts <= ?
+                    ORDER BY start_ts"""
+    cur_events = conn.execute(sql_events, [user_id, start_ts, end_ts])
     for r in cur_events.fetchall():
         r_dict = dict(r)
         events.append({
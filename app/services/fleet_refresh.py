@@ -0,0 +1,379 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+from ..config import settings
+from ..storage.async_db import AsyncDatabase
+from ..utils.datetimes import LOCAL_TZ
+from ..utils.deadline import set_deadline
+from ..storage.db import get_sync_fingerprints_by_user
+from .governor import TokenBucket, UpstreamBusy
+from .parse_pool import ParsePool, PlanChunk
+from .timetable import fetch_kblist
+from .timetable_sync import SemesterPlan, sync_users_to_db
+
+# renew(username, min_ttl)：与 SsoRefresher 相同，由调用方注入（通常是 deps.renew_sso_cookie）
+RenewFn = Callable[[str, int], Awaitable[str]]
+
+# 报告里最多列出的变更用户 / 失败用户数
+REPORT_LIMIT = 100
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _create_run(conn: sqlite3.Connection, semester: str, owner: str) -> Optional[int]:
+    """新建一次全量刷新，为当前全部用户生成待处理条目；该学期已有进行中的 run 时返回 None"""
+    now = int(time.time())
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur = conn.execute(
+            "INSERT INTO fleet_refresh_runs(semester, status, owner, started_at, heartbeat_at) VALUES (?, 'running', ?, ?, ?)",
+            (semester, owner, now, now),
+        )
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return None
+    run_id = cur.lastrowid
+    conn.execute(
+        "INSERT INTO fleet_refresh_items(run_id, user_id, status) SELECT ?, id, 'pending' FROM users",
+        (run_id,),
+    )
+    conn.commit()
+    return run_id
+
+def _claim_run(conn: sqlite3.Connection, semester: str, owner: str, stale_before: int) -> Optional[int]:
+    """接手该学期进行中、但心跳已超时（所在进程已退出）的 run"""
+    row = conn.execute(
+        "SELECT id FROM fleet_refresh_runs WHERE semester = ? AND status = 'running' AND heartbeat_at < ?",
+        (semester, stale_before),
+    ).fetchone()
+    if not row:
+        return None
+    # 以心跳时间作条件更新，多个进程同时接手时只有一个成功
+    cur = conn.execute(
+        "UPDATE fleet_refresh_runs SET owner = ?, heartbeat_at = ? WHERE id = ? AND heartbeat_at < ?",
+        (owner, int(time.time()), row["id"], stale_before),
+    )
+    conn.commit()
+    return row["id"] if cur.rowcount else None
+
+def _heartbeat(conn: sqlite3.Connection, run_id: int, owner: str) -> bool:
+    """续心跳；返回 False 表示 run 已被其他进程接手"""
+    cur = conn.execute(
+        "UPDATE fleet_refresh_runs SET heartbeat_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+        (int(time.time()), run_id, owner),
+    )
+    conn.commit()
+    return cur.rowcount > 0
+
+def _pending_users(conn: sqlite3.Connection, run_id: int) -> List[Tuple[int, str]]:
+    """待处理用户，最近活跃的排在前面，从未活跃的排在最后"""
+    rows = conn.execute(
+        """SELECT u.id, u.username FROM fleet_refresh_items i JOIN users u ON u.id = i.user_id
+           WHERE i.run_id = ? AND i.status = 'pending'
+           ORDER BY u.last_active_at IS NULL, u.last_active_at DESC, u.id""",
+        (run_id,),
+    ).fetchall()
+    return [(row["id"], row["username"]) for row in rows]
+
+def _finish_item(conn: sqlite3.Connection, run_id: int, user_id: int, status: str, changed: bool,
+                 attempts: int, error: Optional[str]) -> None:
+    conn.execute(
+        """UPDATE fleet_refresh_items SET status = ?, changed = ?, attempts = ?, error = ?, finished_at = ?
+           WHERE run_id = ? AND user_id = ?""",
+        (status, int(changed), attempts, error, int(time.time()), run_id, user_id),
+    )
+    conn.commit()
+
+def _complete_run(conn: sqlite3.Connection, run_id: int, owner: str) -> None:
+    conn.execute(
+        "UPDATE fleet_refresh_runs SET status = 'completed', finished_at = ? WHERE id = ? AND owner = ?",
+        (int(time.time()), run_id, owner),
+    )
+    conn.commit()
+
+def _last_started_at(conn: sqlite3.Connection, semester: str) -> Optional[int]:
+    row = conn.execute("SELECT MAX(started_at) FROM fleet_refresh_runs WHERE semester = ?", (semester,)).fetchone()
+    return row[0]
+
+def build_report(conn: sqlite3.Connection, run_id: Optional[int] = None) -> Optional[Dict]:
+    """
+    汇总一次全量刷新（默认最近一次）：进度、吞吐、失败原因分布、变更用户。
+    吞吐按已处理用户数 / 已用时间计算（run 被中断后接手的，包含中断的时间）。
+    """
+    if run_id is None:
+        row = conn.execute("SELECT * FROM fleet_refresh_runs ORDER BY id DESC LIMIT 1").fetchone()
+    else:
+        row = conn.execute("SELECT * FROM fleet_refresh_runs WHERE id = ?", (run_id,)).fetchone()
+    if not row:
+        return None
+    run = dict(row)
+
+    counts = {"pending": 0, "succeeded": 0, "failed": 0}
+    for status, n in conn.execute(
+        "SELECT status, COUNT(*) FROM fleet_refresh_items WHERE run_id = ? GROUP BY status", (run["id"],)
+    ):
+        counts[status] = n
+    changed_users = [r[0] for r in conn.execute(
+        """SELECT u.username FROM fleet_refresh_items i JOIN users u ON u.id = i.user_id
+           WHERE i.run_id = ? AND i.changed = 1 ORDER BY i.finished_at LIMIT ?""",
+        (run["id"], REPORT_LIMIT),
+    )]
+    changed_total = conn.execute(
+        "SELECT COUNT(*) FROM fleet_refresh_items WHERE run_id = ? AND changed = 1", (run["id"],)
+    ).fetchone()[0]
+    failures = [
+        {"username": r["username"], "attempts": r["attempts"], "error": r["error"]}
+        for r in conn.execute(
+            """SELECT u.username, i.attempts, i.error FROM fleet_refresh_items i JOIN users u ON u.id = i.user_id
+               WHERE i.run_id = ? AND i.status = 'failed' ORDER BY i.finished_at""",
+            (run["id"],),
+        )
+    ]
+
+    processed = counts["succeeded"] + counts["failed"]
+    end = run["finished_at"] or int(time.time())
+    elapsed = max(1, end - run["started_at"])
+    return {
+        "run_id": run["id"],
+        "semester": run["semester"],
+        "status": run["status"],
+        "owner": run["owner"],
+        "started_at": run["started_at"],
+        "finished_at": run["finished_at"],
+        "elapsed_seconds": elapsed,
+        "total": processed + counts["pending"],
+        **counts,
+        "changed": changed_total,
+        "users_per_minute": round(processed * 60 / elapsed, 2),
+        "changed_users": changed_users,
+        "error_counts": dict(Counter(f["error"] for f in failures).most_common()),
+        "failures": failures[:REPORT_LIMIT],
+    }
+
+class FleetRefresh:
+    """
+    按学期为所有已保存凭证的用户重新同步课表（用于选课 / 退课期间的夜间刷新）。
+    进度逐个用户写入 fleet_refresh_items，进程退出后其他进程（或重启后的本进程）
+    在心跳超时后接手，只处理仍为 pending 的用户。
+    并发数与每秒处理用户数各有上限；每个上游请求仍经过 governor 的闸门，
+    遇到上游繁忙（429/503）按 Retry-After 等待后重试。
+    拉取完成的用户按批（FLEET_REFRESH_BATCH_SIZE 人或等待 FLEET_REFRESH_BATCH_WAIT 秒）一起解析：
+    整批课程安排由 build_schedules_batch 一次换算，再逐用户增量写库；
+    待处理人数达到 parse_pool.min_batch 时解析在子进程中进行，本进程只拉取与写库。
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        renew: RenewFn,
+        semester: Optional[str] = None,
+        concurrency: int = 4,
+        rate: float = 2.0,
+        owner: Optional[str] = None,
+        parse_pool: Optional[ParsePool] = None,
+    ):
+        self.db = db
+        self.renew = renew
+        self.parse_pool = parse_pool or ParsePool()
+        self._pooled = False
+        self.semester = semester or settings.CURRENT_TERM
+        self.concurrency = concurrency
+        self.owner = owner or default_owner()
+        self._bucket = TokenBucket(rate, burst=concurrency)
+        self._queue: Deque[Tuple[int, str]] = deque()
+        # 拉取完成、等待解析写库的用户：(user_id, username, kbList, 尝试次数)；None 表示拉取全部结束
+        self._fetched: "asyncio.Queue[Optional[Tuple[int, str, List[Dict], int]]]" = asyncio.Queue()
+        self.run_id: Optional[int] = None
+        self._lost = False
+
+    async def acquire_run(self, allow_new: bool = True) -> Optional[int]:
+        """优先接手中断的 run；没有时（allow_new 为真）新建一个。该学期的 run 正由其他进程执行时返回 None"""
+        stale_before = int(time.time()) - settings.FLEET_REFRESH_STALE_SECONDS
+        run_id = await self.db.run(_claim_run, self.semester, self.owner, stale_before)
+        if run_id is None and allow_new:
+            run_id = await self.db.run(_create_run, self.semester, self.owner)
+        return run_id
+
+    async def run(self, run_id: int) -> Optional[Dict]:
+        """执行（或继续执行）一个 run，结束后返回汇总报告"""
+        self.run_id = run_id
+        self._queue = deque(await self.db.run(_pending_users, run_id))
+        self._fetched = asyncio.Queue()
+        self._pooled = self.parse_pool.pooled(len(self._queue))
+        print(
+            f"[Fleet] 开始刷新 {self.semester} 课表（run {run_id}），待处理 {len(self._queue)} 人"
+            f"{'，使用解析子进程' if self._pooled else ''}"
+        )
+
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        writer = asyncio.create_task(self._writer())
+        heartbeat = asyncio.create_task(self._heartbeat([*workers, writer]))
+        try:
+            await asyncio.gather(*workers)
+            await self._fetched.put(None)
+            await writer
+        except asyncio.CancelledError:
+            # 被接手或进程关闭：未完成的用户保持 pending，由下一个 run 持有者继续
+            for task in (*workers, writer):
+                task.cancel()
+            await asyncio.gather(*workers, writer, return_exceptions=True)
+            if self._lost:
+                return None
+            raise
+        finally:
+            heartbeat.cancel()
+
+        await self.db.run(_complete_run, run_id, self.owner)
+        report = await self.db.run(build_report, run_id)
+        print(
+            f"[Fleet] run {run_id} 完成：成功 {report['succeeded']}，失败 {report['failed']}，"
+            f"变更 {report['changed']}，{report['users_per_minute']} 人/分钟"
+        )
+        return report
+
+    async def _heartbeat(self, workers: List["asyncio.Task[None]"]) -> None:
+        while True:
+            await asyncio.sleep(settings.FLEET_REFRESH_HEARTBEAT)
+            if not await self.db.run(_heartbeat, self.run_id, self.owner):
+                print(f"[Fleet] run {self.run_id} 已被其他进程接手，停止本进程的刷新")
+                self._lost = True
+                for task in workers:
+                    task.cancel()
+                return
+
+    async def _worker(self) -> None:
+        while self._queue:
+            user_id, username = self._queue.popleft()
+            delay = self._bucket.reserve(float("inf"))
+            if delay:
+                await asyncio.sleep(delay)
+            await self._fetch_user(user_id, username)
+
+    async def _fetch_user(self, user_id: int, username: str) -> None:
+        """登录并拉取一个用户的 kbList，成功后交给 _writer；重试用尽时直接记为失败"""
+        error: Optional[str] = None
+        attempts = 0
+        while attempts < settings.FLEET_REFRESH_MAX_ATTEMPTS:
+            attempts += 1
+            set_deadline(settings.FLEET_REFRESH_USER_TIMEOUT)
+            try:
+                sso_cookie = await self.renew(username, 60)
+                kb_list = await fetch_kblist(sso_cookie, semester_id=self.semester, strict_filter=True, username=username)
+            except UpstreamBusy as e:
+                # 上游限流 / 熔断：等到建议的时间再试，不算该用户的失败
+                error = e.detail
+                await asyncio.sleep(int(e.headers.get("Retry-After", "1")))
+                continue
+            except Exception as e:
+                error = e.detail if isinstance(e, HTTPException) else str(e)
+                break
+            await self._fetched.put((user_id, username, kb_list, attempts))
+            return
+
+        await self._fail_user(user_id, username, attempts, error)
+
+    async def _fail_user(self, user_id: int, username: str, attempts: int, error) -> None:
+        print(f"[Fleet] 用户 '{username}' 刷新失败: {error}")
+        await self.db.run(_finish_item, self.run_id, user_id, "failed", False, attempts, str(error))
+
+    async def _writer(self) -> None:
+        """攒批解析并写库；解析子进程有多个时同时处理相应数量的批次"""
+        limit = asyncio.Semaphore(max(1, self.parse_pool.workers) if self._pooled else 1)
+        tasks: List["asyncio.Task[None]"] = []
+        loop = asyncio.get_running_loop()
+        done = False
+        try:
+            while not done:
+                item = await self._fetched.get()
+                if item is None:
+                    break
+                batch = [item]
+                flush_at = loop.time() + settings.FLEET_REFRESH_BATCH_WAIT
+                while len(batch) < settings.FLEET_REFRESH_BATCH_SIZE:
+                    try:
+                        item = await asyncio.wait_for(self._fetched.get(), timeout=max(0.0, flush_at - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+                    if item is None:
+                        done = True
+                        break
+                    batch.append(item)
+                await limit.acquire()
+                task = asyncio.create_task(self._write_batch(batch))
+                task.add_done_callback(lambda _: limit.release())
+                tasks.append(task)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _plan_batch(self, chunk: PlanChunk) -> List[Union[SemesterPlan, Exception]]:
+        """整批解析；某个 kbList 无法解析时整批失败，改为逐个解析，只让出错的用户失败"""
+        try:
+            return await self.parse_pool.plan(chunk, pooled=self._pooled)
+        except Exception as e:
+            print(f"[Fleet] 批量解析失败，改为逐个解析: {e}")
+        plans: List[Union[SemesterPlan, Exception]] = []
+        for item in chunk:
+            try:
+                plans.extend(await self.parse_pool.plan([item], pooled=self._pooled))
+            except Exception as e:
+                plans.append(e)
+        return plans
+
+    async def _write_batch(self, batch: List[Tuple[int, str, List[Dict], int]]) -> None:
+        try:
+            stored = await self.db.run(get_sync_fingerprints_by_user, [b[0] for b in batch], self.semester)
+            plans = await self._plan_batch([(self.semester, kb_list, stored.get(user_id)) for user_id, _, kb_list, _ in batch])
+            jobs = [(b[0], {self.semester: plan}) for b, plan in zip(batch, plans) if not isinstance(plan, Exception)]
+            written = iter(await self.db.run(sync_users_to_db, jobs))
+        except Exception as e:
+            for user_id, username, _, attempts in batch:
+                await self._fail_user(user_id, username, attempts, e)
+            return
+
+        for (user_id, username, _, attempts), plan in zip(batch, plans):
+            result = plan if isinstance(plan, Exception) else next(written)
+            if isinstance(result, Exception):
+                await self._fail_user(user_id, username, attempts, result)
+                continue
+            result = result[self.semester]
+            changed = not result["unchanged"] and (result["added"] + result["changed"] + result["removed"]) > 0
+            await self.db.run(_finish_item, self.run_id, user_id, "succeeded", changed, attempts, None)
+
+def _is_due(last_started_at: Optional[int]) -> bool:
+    """到了每日刷新时段，且距上一次 run 开始已超过最小间隔"""
+    if datetime.now(LOCAL_TZ).hour != settings.FLEET_REFRESH_HOUR:
+        return False
+    return last_started_at is None or time.time() - last_started_at >= settings.FLEET_REFRESH_MIN_INTERVAL
+
+async def run_scheduler(db: AsyncDatabase, renew: RenewFn, parse_pool: Optional[ParsePool] = None) -> None:
+    """
+    进程内调度（由 lifespan 启动）：定期检查，接手中断的 run，或在每日刷新时段新建 run。
+    多 worker 部署时每个进程都会检查，同一学期同时只会有一个进程在执行。
+    """
+    while True:
+        try:
+            refresh = FleetRefresh(
+                db, renew,
+                concurrency=settings.FLEET_REFRESH_CONCURRENCY,
+                rate=settings.FLEET_REFRESH_RATE,
+                parse_pool=parse_pool,
+            )
+            allow_new = _is_due(await db.run(_last_started_at, refresh.semester))
+            run_id = await refresh.acquire_run(allow_new=allow_new)
+            if run_id is not None:
+                await refresh.run(run_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Fleet] 定时刷新出错: {e}")
+        await asyncio.sleep(settings.FLEET_REFRESH_CHECK_INTERVAL)
@@ -0,0 +1,276 @@
+import asyncio
+import httpx
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException
+
+from ..config import settings
+from ..utils import deadline
+
+class UpstreamUnavailable(HTTPException):
+    """
+    上游暂不可用时的快速失败。
+    继承 HTTPException：在路由里原样抛出即返回对应状态码，
+    调用链上宽泛的 except Exception 需要先把它放行。
+    """
+
+class UpstreamBusy(UpstreamUnavailable):
+    """限流、排队已满或熔断中：429/503 与 Retry-After"""
+
+    def __init__(self, status_code: int, host: str, retry_after: int, reason: str):
+        super().__init__(
+            status_code=status_code,
+            detail=f"上游 {host} 繁忙（{reason}），请 {retry_after} 秒后重试",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+class DeadlineExceeded(UpstreamUnavailable):
+    """本次请求的截止时间已到：504"""
+
+    def __init__(self, host: str):
+        super().__init__(status_code=504, detail=f"请求上游 {host} 超出本次请求的截止时间")
+
+class TokenBucket:
+    """令牌桶：rate 个/秒匀速补充，最多积攒 burst 个"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def reserve(self, max_delay: float) -> Optional[float]:
+        """
+        预定一个令牌，返回需要等待的秒数；等待会超过 max_delay 时不预定并返回 None。
+        令牌可以透支为负数，表示已被排在前面的请求预定。
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        delay = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+        if delay > max_delay:
+            return None
+        self._tokens -= 1
+        return delay
+
+class CircuitBreaker:
+    """
+    熔断器：连续 failure_threshold 次失败（连接/超时错误或 5xx 响应）后打开，cooldown 秒内直接拒绝；
+    冷却结束进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, host: str, failure_threshold: int, cooldown: float):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def before(self) -> None:
+        """发请求前调用；熔断中抛 UpstreamBusy(503)"""
+        if self.state == "open":
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.cooldown:
+                self.rejected += 1
+                raise UpstreamBusy(503, self.host, max(1, math.ceil(self.cooldown - elapsed)), "熔断中")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                self.rejected += 1
+                raise UpstreamBusy(503, self.host, 1, "熔断探测中")
+            self._probing = True
+
+    def success(self) -> None:
+        self.state = "closed"
+        self._failures = 0
+        self._probing = False
+
+    def failure(self) -> None:
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+                print(f"[Upstream] {self.host} 连续失败 {self._failures} 次，熔断 {self.cooldown:g} 秒")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self) -> None:
+        """请求未产生成败结论（被拒绝、被取消等）时调用，让出半开探测名额"""
+        self._probing = False
+
+    def stats(self) -> Dict[str, object]:
+        return {"state": self.state, "consecutive_failures": self._failures, "opened": self.opened, "rejected": self.rejected}
+
+class UpstreamCall:
+    """
+    slot 内的一次上游调用：调用方把响应交给 record()。
+    上游挂在网关后面时故障通常表现为 502/503/504 而不是连接错误，5xx 同样计入熔断。
+    """
+    __slots__ = ("status_code",)
+
+    def __init__(self):
+        self.status_code: Optional[int] = None
+
+    def record(self, resp: httpx.Response) -> httpx.Response:
+        self.status_code = resp.status_code
+        return resp
+
+    @property
+    def failed(self) -> bool:
+        return self.status_code is not None and self.status_code >= 500
+
+class HostGovernor:
+    """
+    单个上游主机的闸门：熔断器 + 并发上限（信号量）+ 令牌桶限速 + 有界等待队列。
+    熔断中、排队已满或等待超过 max_wait 时直接抛 UpstreamBusy，不再把请求压到上游；
+    请求本身受当前请求截止时间（utils.deadline）约束。
+    """
+
+    def __init__(
+        self,
+        host: str,
+        concurrency: int,
+        rate: float,
+        burst: int,
+        max_queue: int,
+        max_wait: float,
+        breaker: CircuitBreaker,
+    ):
+        self.host = host
+        self.breaker = breaker
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._sem = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket(rate, burst)
+        self._waiting = 0
+        self._active = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.rejected_rate = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _retry_after(self) -> int:
+        # 按当前排队长度和限速粗略估计何时能轮到
+        return max(1, math.ceil((self._waiting + 1) / self._bucket.rate))
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[UpstreamCall]:
+        budget = deadline.remaining()
+        if budget is not None and budget <= 0:
+            raise DeadlineExceeded(self.host)
+        self.breaker.before()
+        settled = False
+        call = UpstreamCall()
+        try:
+            async with self._admit():
+                try:
+                    # 整个上游调用不超过本次请求剩余的时间
+                    async with asyncio.timeout(deadline.remaining()):
+                        yield call
+                except TimeoutError:
+                    # 是我们自己的截止时间到了，不算上游故障
+                    raise DeadlineExceeded(self.host)
+                except httpx.TransportError:
+                    self.breaker.failure()
+                    settled = True
+                    raise
+                if call.failed:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                settled = True
+        finally:
+            if not settled:
+                self.breaker.release()
+
+    @asynccontextmanager
+    async def _admit(self) -> AsyncIterator[None]:
+        """排队、拿并发名额与令牌；等待时间同样受截止时间约束"""
+        max_wait = max(0.0, deadline.remaining(self.max_wait))
+        if self._waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise UpstreamBusy(503, self.host, self._retry_after(), "排队已满")
+
+        start = time.monotonic()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=max_wait)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise UpstreamBusy(503, self.host, self._retry_after(), "等待超时")
+        finally:
+            self._waiting -= 1
+
+        try:
+            remaining = max_wait - (time.monotonic() - start)
+            delay = self._bucket.reserve(max(0.0, remaining))
+            if delay is None:
+                self.rejected_rate += 1
+                raise UpstreamBusy(429, self.host, self._retry_after(), "请求过于频繁")
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            waited = time.monotonic() - start
+            self.admitted += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._active += 1
+            try:
+                yield
+            finally:
+                self._active -= 1
+        finally:
+            self._sem.release()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "breaker": self.breaker.stats(),
+            "queue_depth": self._waiting,
+            "in_flight": self._active,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "rejected_rate": self.rejected_rate,
+            "wait_avg_ms": round(self._wait_total / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000, 2),
+        }
+
+_governors: Dict[str, HostGovernor] = {}
+
+def _build(host: str) -> HostGovernor:
+    prefix = f"UPSTREAM_{host.upper()}_"
+    return HostGovernor(
+        host,
+        concurrency=getattr(settings, prefix + "CONCURRENCY"),
+        rate=getattr(settings, prefix + "RATE"),
+        burst=getattr(settings, prefix + "BURST"),
+        max_queue=settings.UPSTREAM_MAX_QUEUE,
+        max_wait=settings.UPSTREAM_MAX_WAIT,
+        breaker=CircuitBreaker(host, settings.UPSTREAM_BREAKER_FAILURES, settings.UPSTREAM_BREAKER_COOLDOWN),
+    )
+
+def governor(host: str) -> HostGovernor:
+    gov = _governors.get(host)
+    if gov is None:
+        gov = _governors[host] = _build(host)
+    return gov
+
+def upstream_slot(host: str):
+    """
+    async with upstream_slot("zdbk") as call: r = call.record(await ...) —— 向该上游发请求前必须先拿到名额，
+    响应交给 call.record 以便 5xx 计入熔断
+    """
+    return governor(host).slot()
+
+def governor_stats() -> Dict[str, Dict[str, object]]:
+    return {host: gov.stats() for host, gov in _governors.items()}
@@ -0,0 +1,82 @@
+import importlib.util
+from http.cookiejar import CookieJar
+from typing import Dict, Mapping, Optional
+
+import httpx
+
+from ..config import settings
+
+class _RejectAllCookies(CookieJar):
+    """
+    共享客户端上的 Cookie 罐：拒绝保存任何 Cookie。
+    客户端被所有用户复用，用户会话只能显式地随单个请求发送，不能留在客户端上。
+    响应自身的 resp.cookies 不受影响。
+    """
+
+    def set_cookie(self, cookie) -> None:
+        pass
+
+    def extract_cookies(self, response, request) -> None:
+        pass
+
+# 每个上游主机一个客户端：name -> 单次请求总超时秒数
+UPSTREAMS: Dict[str, float] = {
+    "cas": 10.0,     # zjuam.zju.edu.cn
+    "zdbk": 15.0,    # zdbk.zju.edu.cn
+    "wechat": 5.0,   # api.weixin.qq.com
+}
+
+def _http2_enabled() -> bool:
+    if not settings.HTTP_HTTP2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        print("[HTTP] 已配置 HTTP_HTTP2 但未安装 h2（pip install httpx[http2]），回退到 HTTP/1.1")
+        return False
+    return True
+
+def _build_client(total_timeout: float, http2: bool) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=http2,
+        follow_redirects=False,
+        cookies=_RejectAllCookies(),
+        timeout=httpx.Timeout(total_timeout, connect=settings.HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+def start_clients() -> None:
+    """为每个上游主机建立长连接客户端（由 lifespan 调用）"""
+    http2 = _http2_enabled()
+    for name, total_timeout in UPSTREAMS.items():
+        if name not in _clients:
+            _clients[name] = _build_client(total_timeout, http2)
+
+async def close_clients() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    取某个上游主机的共享客户端。
+    lifespan 之外（脚本等）首次使用时按需创建，由调用方进程退出时回收。
+    """
+    client = _clients.get(name)
+    if client is None:
+        if name not in UPSTREAMS:
+            raise KeyError(f"未知的上游: {name}")
+        client = _clients[name] = _build_client(UPSTREAMS[name], _http2_enabled())
+    return client
+
+def cookie_header(cookies: Mapping[str, str], headers: Optional[Mapping[str, str]] = None) -> Dict[str, str]:
+    """把本次请求的会话 Cookie 拼成显式的 Cookie 头，合并到 headers 中返回"""
+    merged = dict(headers or {})
+    if cookies:
+        merged["Cookie"] = "; ".join(f"{k}={v}" for k, v in cookies.items())
+    return merged
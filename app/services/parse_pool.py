@@ -0,0 +1,60 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .timetable_sync import SemesterPlan, plan_semester_syncs
+
+# 一次解析任务：[(学期, kbList, 上次同步的指纹)]，可以是一个用户的多个学期，也可以是一批用户；
+# 作为进程池的最小调度单位
+PlanChunk = Sequence[Tuple[str, List[Dict], Optional[str]]]
+
+def _plan_chunk(chunk: PlanChunk) -> List[SemesterPlan]:
+    """chunk 的同步计划（在子进程或本进程线程中执行），整批一次换算为课程安排"""
+    return plan_semester_syncs(chunk)
+
+class ParsePool:
+    """
+    kbList 解析（指纹 + 批量换算课程安排，见 plan_semester_syncs）的进程池。
+    解析是纯 CPU 的 Python 代码，放在线程里仍会与事件循环争抢 GIL；大批量同步（全量刷新）时
+    按批交给子进程解析，每批解析完立即交回调用方写库，本进程只负责收发与写入。
+    小批量（少于 min_batch 个用户）或 workers 为 0 时在本进程的线程中解析，省去进程间传输。
+    子进程在第一次需要时才启动，不使用进程池的进程不会多出子进程。
+    """
+
+    def __init__(self, workers: int = 0, min_batch: int = 1):
+        self.workers = workers
+        self.min_batch = min_batch
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def pooled(self, batch_size: int) -> bool:
+        """batch_size 个用户的批次是否交给子进程解析"""
+        return self.workers > 0 and batch_size >= self.min_batch
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn：父进程里有数据库线程池与事件循环，fork 出的子进程可能继承到被持有的锁
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            print(f"[ParsePool] 已启动 {self.workers} 个解析子进程")
+        return self._executor
+
+    async def plan(self, chunk: PlanChunk, pooled: bool = True) -> List[SemesterPlan]:
+        """解析 chunk 中的 kbList，返回与 chunk 一一对应的同步计划"""
+        if not pooled or self.workers <= 0:
+            return await asyncio.to_thread(_plan_chunk, chunk)
+        executor = self._get_executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, _plan_chunk, chunk)
+        except BrokenProcessPool:
+            # 子进程被杀（OOM 等）：丢弃整个进程池，下次使用时重建；本次改在本进程中解析
+            print("[ParsePool] 解析子进程异常退出，重建进程池")
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            return await asyncio.to_thread(_plan_chunk, chunk)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
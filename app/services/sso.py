@@ -1,81 +1,132 @@
+import asyncio
 import httpx
 import re
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from ..config import settings
+from .governor import upstream_slot
+from .http import cookie_header, get_client
 
 LOGIN_URL = "https://zjuam.zju.edu.cn/cas/login"
 PUBKEY_URL = "https://zjuam.zju.edu.cn/cas/v2/getPubKey"
 
 UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
 
-def rsa_encrypt_hex_no_padding(password: str, modulus_hex: str, exponent_hex: str) -> str:
-    """
-    仓库同款原始 RSA：utf8 -> hex -> int，pow(m, e, n) -> hex，左侧补零到 128 位
-    """
-    pwd_hex = password.encode("utf-8").hex()
-    m = int(modulus_hex, 16)
-    e = int(exponent_hex, 16)
-    p = int(pwd_hex, 16)
-    c = pow(p, e, m)  # 原始幂模，无填充
-    enc_hex = format(c, "x").zfill(128)  # 与 Dart 版 padLeft(128, '0') 对齐
-    return enc_hex
+class RsaPublicKey(NamedTuple):
+    modulus: int
+    exponent: int
 
-async def get_sso_cookie(username: str, password: str) -> str:
+    @classmethod
+    def from_hex(cls, modulus_hex: str, exponent_hex: str) -> "RsaPublicKey":
+        return cls(int(modulus_hex, 16), int(exponent_hex, 16))
+
+def rsa_encrypt_no_padding(password: str, key: RsaPublicKey) -> str:
     """
-    返回 iPlanetDirectoryPro 的值（服务端内部保存）
+    仓库同款原始 RSA：utf8 -> int，pow(m, e, n) -> hex，左侧补零到 128 位
     """
+    p = int.from_bytes(password.encode("utf-8"), "big")
+    c = pow(p, key.exponent, key.modulus)  # 原始幂模，无填充
+    return format(c, "x").zfill(128)  # 与 Dart 版 padLeft(128, '0') 对齐
+
+def rsa_encrypt_hex_no_padding(password: str, modulus_hex: str, exponent_hex: str) -> str:
+    return rsa_encrypt_no_padding(password, RsaPublicKey.from_hex(modulus_hex, exponent_hex))
+
+# CAS 公钥很少变化：解析后的整数缓存 CAS_PUBKEY_TTL 秒，进程内共享
+_pubkey_cache: Optional[Tuple[RsaPublicKey, float]] = None
+
+async def _fetch_pubkey(headers: Dict[str, str]) -> Tuple[RsaPublicKey, httpx.Response]:
+    global _pubkey_cache
+    async with upstream_slot("cas") as call:
+        r = call.record(await get_client("cas").get(PUBKEY_URL, headers=headers))
+    pub = r.json()
+    modulus = pub.get("modulus")
+    exponent = pub.get("exponent")
+    if not modulus or not exponent:
+        raise Exception("无法获取 RSA 公钥")
+    key = RsaPublicKey.from_hex(modulus, exponent)
+    _pubkey_cache = (key, time.monotonic() + settings.CAS_PUBKEY_TTL)
+    return key, r
+
+async def _get_pubkey(headers: Dict[str, str]) -> Tuple[RsaPublicKey, Optional[httpx.Response]]:
+    if _pubkey_cache and _pubkey_cache[1] > time.monotonic():
+        return _pubkey_cache[0], None
+    return await _fetch_pubkey(headers)
+
+def _collect_cookies(jar: Dict[str, str], resp: Optional[httpx.Response]) -> None:
+    """把响应设置的 Cookie 记入本次登录流程自己的 Cookie 表"""
+    if resp is None:
+        return
+    for c in resp.cookies.jar:
+        jar[c.name] = c.value
+
+async def _login_once(username: str, password: str, fresh_pubkey: bool) -> Optional[str]:
     headers = {"User-Agent": UA, "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"}
-    async with httpx.AsyncClient(timeout=10, follow_redirects=False, headers=headers) as client:
-        # 1) 拿 execution
-        r1 = await client.get(LOGIN_URL)
-        m = re.search(r'name="execution"\s+value="(.*?)"', r1.text)
-        if not m:
-            raise Exception("无法获取 execution")
-        execution = m.group(1)
-
-        # 2) 取公钥
-        r2 = await client.get(PUBKEY_URL)
-        pub = r2.json()
-        modulus = pub.get("modulus")
-        exponent = pub.get("exponent")
-        if not modulus or not exponent:
-            raise Exception("无法获取 RSA 公钥")
-
-        # 3) 原始 RSA 加密（无填充）
-        pwd_enc_hex = rsa_encrypt_hex_no_padding(password, modulus, exponent)
-
-        # 4) 提交登录（表单）
-        form = {
-            "username": username,
-            "password": pwd_enc_hex,
-            "execution": execution,
-            "_eventId": "submit",
-            "rememberMe": "true",
-        }
-        r3 = await client.post(
+    client = get_client("cas")
+    # 共享客户端不保存 Cookie，登录流程中的 CAS 会话 Cookie 在这里显式传递
+    jar: Dict[str, str] = {}
+
+    async def get_login_page() -> httpx.Response:
+        async with upstream_slot("cas") as call:
+            return call.record(await client.get(LOGIN_URL, headers=headers))
+
+    if fresh_pubkey:
+        # 重试路径：按原始顺序，带着登录页下发的会话 Cookie 重新取公钥
+        r1 = await get_login_page()
+        _collect_cookies(jar, r1)
+        key, r2 = await _fetch_pubkey(cookie_header(jar, headers))
+        _collect_cookies(jar, r2)
+    else:
+        # 1) 拿 execution 与 2) 取公钥互不依赖，并发进行；公钥优先用缓存。
+        # 公钥请求不带登录页的会话，它下发的 Cookie（如新的 JSESSIONID）会顶掉 execution 所属的会话，不能合并
+        r1, (key, _) = await asyncio.gather(get_login_page(), _get_pubkey(headers))
+        _collect_cookies(jar, r1)
+
+    m = re.search(r'name="execution"\s+value="(.*?)"', r1.text)
+    if not m:
+        raise Exception("无法获取 execution")
+    execution = m.group(1)
+
+    # 3) 原始 RSA 加密（无填充）
+    pwd_enc_hex = rsa_encrypt_no_padding(password, key)
+
+    # 4) 提交登录（表单）
+    form = {
+        "username": username,
+        "password": pwd_enc_hex,
+        "execution": execution,
+        "_eventId": "submit",
+        "rememberMe": "true",
+    }
+    async with upstream_slot("cas") as call:
+        r3 = call.record(await client.post(
             LOGIN_URL,
             data=form,
-            headers={
+            headers=cookie_header(jar, {
                 "User-Agent": UA,
                 "Content-Type": "application/x-www-form-urlencoded",
                 "Origin": "https://zjuam.zju.edu.cn",
                 "Referer": LOGIN_URL,
-            },
-        )
-
-        # 有的实现把 cookie 写在响应里，有的会更新到 client.cookies
-        # 两个地方都找一下
-        def find_cookie(jar) -> str | None:
-            for c in jar:
-                if c.name == "iPlanetDirectoryPro":
-                    return c.value
-            return None
-
-        cookie_val = find_cookie(r3.cookies.jar) if hasattr(r3.cookies, "jar") else None
-        if not cookie_val:
-            cookie_val = find_cookie(client.cookies.jar)
-
-        if not cookie_val:
-            # 辅助诊断：部分情况下会返回 302，并把 cookie 写在下一跳；也可尝试跟随一次重定向
-            # 如果仍拿不到，多半是账号/密码错误或学校引入了额外验证（验证码/二次认证）
-            raise Exception("登录失败或未返回 iPlanetDirectoryPro")
-
-        return cookie_val
\ No newline at end of file
+            }),
+        ))
+
+    for c in r3.cookies.jar:
+        if c.name == "iPlanetDirectoryPro":
+            return c.value
+    return None
+
+async def get_sso_cookie(username: str, password: str) -> str:
+    """
+    返回 iPlanetDirectoryPro 的值（服务端内部保存）
+    """
+    cookie_val = await _login_once(username, password, fresh_pubkey=False)
+    if not cookie_val:
+        # 公钥可能已轮换，或与登录页会话绑定：不用缓存、按顺序重试一次
+        cookie_val = await _login_once(username, password, fresh_pubkey=True)
+
+    if not cookie_val:
+        # 辅助诊断：部分情况下会返回 302，并把 cookie 写在下一跳；也可尝试跟随一次重定向
+        # 如果仍拿不到，多半是账号/密码错误或学校引入了额外验证（验证码/二次认证）
+        raise Exception("登录失败或未返回 iPlanetDirectoryPro")
+
+    return cookie_val
@@ -0,0 +1,137 @@
+import asyncio
+import heapq
+import math
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from ..storage.session_store import sso_ttl
+
+# renew(username, min_ttl)：已有 Cookie 剩余有效期超过 min_ttl 秒时应直接复用，否则重新登录
+RenewFn = Callable[[str, int], Awaitable[str]]
+
+class SsoRefresher:
+    """
+    SSO Cookie 后台续期。
+    按过期时间维护一个小顶堆，对最近活跃的用户在过期前 margin（再随机提前 0~jitter）秒
+    调用 renew 重新登录，并发数受 concurrency 限制；长时间不活跃的用户不再续期，
+    等下次请求时按需登录。
+    """
+
+    def __init__(
+        self,
+        renew: RenewFn,
+        margin: int = 300,
+        jitter: float = 60.0,
+        concurrency: int = 4,
+        active_window: int = 7200,
+    ):
+        self.renew = renew
+        self.margin = margin
+        self.jitter = jitter
+        self.active_window = active_window
+        self._sem = asyncio.Semaphore(concurrency)
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}          # 每个用户当前有效的计划时间（堆中其余条目视为过期）
+        self._last_active: Dict[str, float] = {}
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self._wakeup = asyncio.Event()
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped_inactive = 0
+
+    async def touch(self, username: str) -> None:
+        """记录一次用户请求；尚未排期的用户顺带加入续期计划"""
+        self._last_active[username] = time.time()
+        if username not in self._due:
+            await self.track(username)
+
+    async def track(self, username: str) -> None:
+        """按会话存储中的剩余有效期（重新）安排该用户的续期时间"""
+        remaining = await sso_ttl(username)
+        if remaining is None:
+            return
+        due = time.time() + remaining - self.margin - random.uniform(0, self.jitter)
+        self._due[username] = due
+        heapq.heappush(self._heap, (due, username))
+        if self._heap[0][1] == username:
+            self._wakeup.set()
+
+    async def run(self) -> None:
+        while True:
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            self._wakeup.clear()
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                due, username = heapq.heappop(self._heap)
+                if self._due.get(username) != due:
+                    continue
+                del self._due[username]
+                if now - self._last_active.get(username, 0) > self.active_window:
+                    self._last_active.pop(username, None)
+                    self.skipped_inactive += 1
+                    continue
+                await self._sem.acquire()
+                task = asyncio.create_task(self._refresh(username))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, username: str) -> None:
+        try:
+            # 本进程的排期不会早于 margin + jitter；剩余有效期比这还长，说明其他 worker 已续过
+            await self.renew(username, math.ceil(self.margin + self.jitter))
+            self.refreshed += 1
+            await self.track(username)
+        except Exception as e:
+            # 失败不重试：下次请求时由按需续期兜底
+            self.failed += 1
+            print(f"[SSO] 用户 '{username}' 后台续期失败: {e}")
+        finally:
+            self._sem.release()
+
+    async def stop(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "scheduled": len(self._due),
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "skipped_inactive": self.skipped_inactive,
+        }
+
+_refresher: Optional[SsoRefresher] = None
+
+def start_refresher(renew: RenewFn, **kwargs) -> "asyncio.Task[None]":
+    """创建进程内唯一的续期器并启动后台任务（由 lifespan 调用）"""
+    global _refresher
+    _refresher = SsoRefresher(renew, **kwargs)
+    return asyncio.create_task(_refresher.run())
+
+async def stop_refresher(task: "asyncio.Task[None]") -> None:
+    global _refresher
+    task.cancel()
+    if _refresher is not None:
+        await _refresher.stop()
+        _refresher = None
+
+async def touch_session(username: str) -> None:
+    """请求路径上调用；续期器未启用时为空操作"""
+    if _refresher is not None:
+        await _refresher.touch(username)
+
+async def track_session(username: str) -> None:
+    """登录/续期得到新 Cookie 后调用，按新的过期时间重新排期"""
+    if _refresher is not None:
+        await _refresher.track(username)
+
+def refresher_stats() -> Optional[Dict[str, int]]:
+    return _refresher.stats() if _refresher is not None else None
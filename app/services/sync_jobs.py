@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from ..config import settings
+from ..storage.async_db import AsyncDatabase
+from ..utils.deadline import set_deadline
+from .timetable import fetch_kblist
+from .timetable_cache import store_kblist
+from .timetable_sync import sync_kblist_to_db
+
+# cookie_provider(username) -> 有效的 SSO Cookie（由 main.py 注入，避免服务层依赖 api 层）
+CookieProvider = Callable[[str], Awaitable[str]]
+
+class JobQueueFull(Exception):
+    pass
+
+# 心跳未超时的任务队列进程（未完成任务只有挂在这些进程的内存队列里才会被执行）
+_LIVE_OWNERS = "SELECT owner FROM sync_job_owners WHERE heartbeat_at >= ?"
+
+def _create_or_attach(conn: sqlite3.Connection, user_id: int, semester: str, owner: str,
+                      stale_before: int, live_after: int) -> Tuple[str, bool]:
+    """
+    创建任务（记为 owner 所有）；该用户该学期已有未完成任务时返回已有任务（attached=True）。
+    已有任务早于 stale_before 仍未完成，或所属进程的心跳已超时（早于 live_after），
+    视为不会再被执行，标记失败后新建。
+    """
+    now = int(time.time())
+    row = conn.execute(
+        f"""SELECT id, created_at, owner IN ({_LIVE_OWNERS}) AS live FROM sync_jobs
+            WHERE user_id = ? AND semester = ? AND status IN ('queued', 'running')""",
+        (live_after, user_id, semester),
+    ).fetchone()
+    if row and row["created_at"] >= stale_before and row["live"]:
+        return row["id"], True
+    if row:
+        conn.execute(
+            "UPDATE sync_jobs SET status = 'failed', stage = 'done', error = ?, finished_at = ? WHERE id = ?",
+            ("任务所在进程已退出或超时未完成，已被新的提交取代", now, row["id"]),
+        )
+
+    job_id = uuid.uuid4().hex
+    try:
+        conn.execute(
+            """INSERT INTO sync_jobs(id, user_id, semester, status, stage, created_at, owner)
+               VALUES (?, ?, ?, 'queued', 'queued', ?, ?)""",
+            (job_id, user_id, semester, now, owner),
+        )
+    except sqlite3.IntegrityError:
+        # 另一个 worker 刚刚抢先创建了同一任务
+        conn.rollback()
+        row = conn.execute(
+            "SELECT id FROM sync_jobs WHERE user_id = ? AND semester = ? AND status IN ('queued', 'running')",
+            (user_id, semester),
+        ).fetchone()
+        return row["id"], True
+    conn.commit()
+    return job_id, False
+
+def _update_job(conn: sqlite3.Connection, job_id: str, **fields) -> None:
+    columns = ", ".join(f"{k} = ?" for k in fields)
+    conn.execute(f"UPDATE sync_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+    conn.commit()
+
+def _get_job(conn: sqlite3.Connection, job_id: str, user_id: int) -> Optional[Dict]:
+    row = conn.execute(
+        """SELECT id, semester, status, stage, result, error, created_at, started_at, finished_at
+           FROM sync_jobs WHERE id = ? AND user_id = ?""",
+        (job_id, user_id),
+    ).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def _heartbeat(conn: sqlite3.Connection, owner: str) -> None:
+    conn.execute(
+        """INSERT INTO sync_job_owners(owner, heartbeat_at) VALUES (?, ?)
+           ON CONFLICT(owner) DO UPDATE SET heartbeat_at = excluded.heartbeat_at""",
+        (owner, int(time.time())),
+    )
+    conn.commit()
+
+def _release_owner(conn: sqlite3.Connection, owner: str) -> None:
+    """进程正常退出：内存队列里未执行完的任务随之丢失，标记失败并注销"""
+    conn.execute(
+        """UPDATE sync_jobs SET status = 'failed', stage = 'done', error = '服务重启，任务中断', finished_at = ?
+           WHERE owner = ? AND status IN ('queued', 'running')""",
+        (int(time.time()), owner),
+    )
+    conn.execute("DELETE FROM sync_job_owners WHERE owner = ?", (owner,))
+    conn.commit()
+
+def _expire_jobs(conn: sqlite3.Connection, stale_before: int, live_after: int, retain_after: int) -> None:
+    """
+    启动时清理：不属于任何存活进程（心跳未超时）的未完成任务都已随进程退出丢失，
+    连同早于 stale_before 仍未完成的任务一起标记失败；过旧的已完成任务与已退出进程的心跳记录删除
+    """
+    conn.execute(
+        f"""UPDATE sync_jobs SET status = 'failed', stage = 'done', error = '服务重启，任务中断', finished_at = ?
+            WHERE status IN ('queued', 'running')
+              AND (owner IS NULL OR owner NOT IN ({_LIVE_OWNERS}) OR created_at < ?)""",
+        (int(time.time()), live_after, stale_before),
+    )
+    conn.execute("DELETE FROM sync_job_owners WHERE heartbeat_at < ?", (live_after,))
+    conn.execute(
+        "DELETE FROM sync_jobs WHERE status NOT IN ('queued', 'running') AND created_at < ?",
+        (retain_after,),
+    )
+    conn.commit()
+
+class SyncJobQueue:
+    """
+    进程内的课表同步任务队列：任务记录持久化在 sync_jobs 表，
+    由固定数量的 asyncio worker 依次执行（拉取 -> 增量写库），客户端轮询任务状态。
+    任务记录所属进程（owner），进程定期续心跳；其他进程只会挂到心跳存活的进程持有的任务上。
+    """
+
+    def __init__(self, db: AsyncDatabase, cookie_provider: CookieProvider, workers: int = 2, max_pending: int = 100):
+        self.db = db
+        self.cookie_provider = cookie_provider
+        self.workers = workers
+        # 主机名:pid 之外再加随机后缀：容器重启后 pid 往往相同，不能把上一个进程的任务当成自己的
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: "asyncio.Queue[Tuple[str, int, str, str]]" = asyncio.Queue(maxsize=max_pending)
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    async def start(self) -> None:
+        now = int(time.time())
+        await self.db.run(_heartbeat, self.owner)
+        await self.db.run(_expire_jobs, now - settings.SYNC_JOB_STALE_SECONDS,
+                          now - settings.SYNC_JOB_OWNER_TIMEOUT, now - settings.SYNC_JOB_RETENTION)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.db.run(_release_owner, self.owner)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(settings.SYNC_JOB_HEARTBEAT)
+            try:
+                await self.db.run(_heartbeat, self.owner)
+            except sqlite3.Error as e:
+                print(f"[Sync] 任务队列心跳失败: {e}")
+
+    async def submit(self, user_id: int, username: str, semester: str) -> Tuple[str, bool]:
+        """提交同步任务，返回 (job_id, attached)；attached 表示挂到了已有的未完成任务上"""
+        if self._queue.full():
+            raise JobQueueFull()
+        now = int(time.time())
+        job_id, attached = await self.db.run(_create_or_attach, user_id, semester, self.owner,
+                                             now - settings.SYNC_JOB_STALE_SECONDS, now - settings.SYNC_JOB_OWNER_TIMEOUT)
+        if attached:
+            return job_id, True
+        try:
+            self._queue.put_nowait((job_id, user_id, username, semester))
+        except asyncio.QueueFull:
+            await self.db.run(_update_job, job_id, status="failed", stage="done",
+                              error="任务队列已满", finished_at=int(time.time()))
+            raise JobQueueFull()
+        return job_id, False
+
+    async def get(self, job_id: str, user_id: int) -> Optional[Dict]:
+        return await self.db.run(_get_job, job_id, user_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(*job)
+            except Exception as e:
+                # 连记录失败都没写进去（数据库被锁、连接池超时等）：尽量再标记一次，worker 继续处理后续任务
+                print(f"[Sync] 任务 {job[0]} 状态写入失败: {e}")
+                try:
+                    await self.db.run(_update_job, job[0], status="failed", stage="done",
+                                      error=str(e), finished_at=int(time.time()))
+                except Exception as e2:
+                    print(f"[Sync] 无法将任务 {job[0]} 标记为失败: {e2}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str, user_id: int, username: str, semester: str) -> None:
+        # 后台任务不受 HTTP 请求超时约束，但整体仍有上限
+        set_deadline(settings.SYNC_JOB_TIMEOUT)
+        try:
+            await self.db.run(_update_job, job_id, status="running", stage="fetching", started_at=int(time.time()))
+            sso_cookie = await self.cookie_provider(username)
+            kb_list = await fetch_kblist(sso_cookie, semester_id=semester, strict_filter=True, username=username)
+            await store_kblist(username, semester, True, kb_list)
+
+            await self.db.run(_update_job, job_id, stage="writing")
+            result = await self.db.run(sync_kblist_to_db, user_id, semester, kb_list)
+            await self.db.run(_update_job, job_id, status="succeeded", stage="done",
+                              result=json.dumps(result), finished_at=int(time.time()))
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"[Sync] 任务 {job_id}（{username} {semester}）失败: {error}")
+            await self.db.run(_update_job, job_id, status="failed", stage="done",
+                              error=str(error), finished_at=int(time.time()))
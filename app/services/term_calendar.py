@@ -0,0 +1,86 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from ..config import settings
+from ..utils.datetimes import to_epoch
+
+# 查表覆盖的周数：教学周最多 16 周，冬/夏学期的日期按 +8 周计算，留足余量
+MAX_WEEKS = 30
+
+# (starts_at, ends_at, starts_at_ts, ends_at_ts)：一次上课的起止时刻，
+# 与 storage.db.expand_schedule 按周展开 course_schedules 时给出的四个时间字段相同
+Slot = Tuple[str, str, int, int]
+
+class TermCalendar(NamedTuple):
+    """
+    单个学期的只读日历表，由 TERM_CONFIGS 构建一次后复用。
+    day_* 按天索引 (week - 1) * 7 + (weekday - 1)；period_* 按节次索引 period - 1，
+    时间戳为当天 0 点的 epoch 加上节次的秒偏移（与 utils.datetimes.to_epoch 口径一致）。
+    """
+    term_id: str
+    start_monday: date
+    day_isos: Tuple[str, ...]
+    day_epochs: Tuple[int, ...]
+    period_start_isos: Tuple[str, ...]
+    period_end_isos: Tuple[str, ...]
+    period_start_offsets: Tuple[int, ...]
+    period_end_offsets: Tuple[int, ...]
+
+    def _day(self, week: int, weekday: int) -> Tuple[str, int]:
+        index = (week - 1) * 7 + (weekday - 1)
+        if 0 <= index < len(self.day_isos):
+            return self.day_isos[index], self.day_epochs[index]
+        # 超出表的范围（配置异常的周次）时按原公式现算
+        day = self.start_monday + timedelta(days=index)
+        return day.isoformat(), to_epoch(datetime.combine(day, datetime.min.time()))
+
+    def period_range(self, period_start: int, period_count: int) -> Tuple[str, str, int, int]:
+        """
+        (开始时刻 ISO, 结束时刻 ISO, 开始秒偏移, 结束秒偏移)。
+        第 period_start 节开始，第 period_start + period_count - 1 节结束（作息表取自 get_term_periods）。
+        """
+        first = period_start - 1
+        last = period_start + period_count - 2
+        return (
+            self.period_start_isos[first], self.period_end_isos[last],
+            self.period_start_offsets[first], self.period_end_offsets[last],
+        )
+
+    def slot(self, week: int, weekday: int, period_start: int, period_count: int) -> Slot:
+        """第 week 周星期 weekday 第 period_start 节起、连续 period_count 节的起止时刻（ISO 与 epoch）"""
+        start_iso, end_iso, start_off, end_off = self.period_range(period_start, period_count)
+        day_iso, day_epoch = self._day(week, weekday)
+        return f"{day_iso}T{start_iso}", f"{day_iso}T{end_iso}", day_epoch + start_off, day_epoch + end_off
+
+def build_term_calendar(term_id: str) -> TermCalendar:
+    start_monday = settings.get_term_start_monday(term_id)
+    periods = settings.get_term_periods(term_id)
+    days = [start_monday + timedelta(days=i) for i in range(MAX_WEEKS * 7)]
+    midnight = datetime.min.time()
+
+    def offset(t) -> int:
+        return t.hour * 3600 + t.minute * 60 + t.second
+
+    return TermCalendar(
+        term_id=term_id,
+        start_monday=start_monday,
+        day_isos=tuple(d.isoformat() for d in days),
+        day_epochs=tuple(to_epoch(datetime.combine(d, midnight)) for d in days),
+        period_start_isos=tuple(start.isoformat() for start, _ in periods),
+        period_end_isos=tuple(end.isoformat() for _, end in periods),
+        period_start_offsets=tuple(offset(start) for start, _ in periods),
+        period_end_offsets=tuple(offset(end) for _, end in periods),
+    )
+
+_calendars: Optional[Dict[str, TermCalendar]] = None
+
+def get_term_calendar(term_id: Optional[str]) -> TermCalendar:
+    """取学期日历表；首次调用时为 TERM_CONFIGS 中的全部学期一次性构建。未知学期抛 ValueError"""
+    global _calendars
+    if _calendars is None:
+        _calendars = {t: build_term_calendar(t) for t in settings.TERM_CONFIGS}
+    t = term_id or settings.CURRENT_TERM
+    cal = _calendars.get(t)
+    if cal is None:
+        raise ValueError(f"Unknown term_id: {t}")
+    return cal
@@ -1,15 +1,42 @@
+import asyncio
+import hashlib
 import httpx
 import json
 import re
-from typing import Dict, List, Tuple, Optional
-from datetime import datetime, timedelta, date
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Union
 from app.config import settings
-from .zdbk import login_with_sso_get_jw_cookies, ZdbkLoginError
+from .governor import upstream_slot
+from .term_calendar import get_term_calendar
+from ..utils.weekmask import MAX_MASK_WEEK, WEEK_SECONDS, weeks_to_mask
+from .http import cookie_header, get_client
+from .zdbk import (
+    ZdbkLoginError,
+    cache_jw_session,
+    get_cached_jw_session,
+    invalidate_jw_session,
+    is_login_redirect,
+    open_jw_session,
+)
 import html
 
+try:
+    import orjson
+except ImportError:  # 可选依赖：pip install orjson，未安装时用标准库 json
+    orjson = None
+
 class TimetableFetchError(Exception):
     pass
 
+# kcb 解析用到的模式，模块加载时编译一次
+_XKKH_SEMESTER_RE = re.compile(r"^\((\d{4}-\d{4}-[12])\)")
+_BRACES_RE = re.compile(r"\{(.*?)\}")
+_WEEKS_SPEC_RE = re.compile(r"(第[\d\-，,]+周)")
+_PERIOD_COUNT_RE = re.compile(r"(\d+)节")
+_DATE_RANGE_RE = re.compile(r"(\d{4}年\d{2}月\d{2}日\(\d{2}:\d{2}-\d{2}:\d{2}\))")
+_ZWF_SUFFIX_RE = re.compile(r"(zwf)+$")
+_WEEK_SEP_RE = re.compile(r"[，,]")
+
 def parse_semester_id(semester_id: str) -> Tuple[str, str]:
     parts = semester_id.split("-")
     if len(parts) < 3:
@@ -39,73 +66,172 @@ def xqm_from_xxq(xxq: str) -> str:
 def semester_from_xkkh(xkkh: str) -> str:
     if not xkkh:
         return ""
-    m = re.match(r"^\((\d{4}-\d{4}-[12])\)", xkkh)
+    m = _XKKH_SEMESTER_RE.match(xkkh)
     return m.group(1) if m else ""
 
-async def fetch_kblist(sso_cookie: str, semester_id: str, strict_filter: bool = True) -> List[Dict]:
+# 旧的提取方式，只作兜底：依赖 kbList 紧跟着 "xh" 键，且条目内不能出现 ],"xh"
+_KBLIST_FALLBACK_RE = re.compile(r'(?<="kbList":)\[(.*?)\](?=,"xh")')
+_KBLIST_KEY_RE = re.compile(r'"kbList"\s*:\s*(?=\[)')
+_json_decoder = json.JSONDecoder()
+
+def _json_loads(raw: str):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def _decode_kblist_at_key(raw: str) -> Optional[List[Dict]]:
+    """定位 "kbList": 后只解码这一个数组（raw_decode 在数组结束处停下，不构建响应里的其他字段）"""
+    m = _KBLIST_KEY_RE.search(raw)
+    if not m:
+        return None
     try:
-        jsessionid, route = await login_with_sso_get_jw_cookies(sso_cookie)
-    except ZdbkLoginError as e:
-        raise TimetableFetchError(f"教务登录失败: {e}")
+        kb_list, _ = _json_decoder.raw_decode(raw, m.end())
+    except ValueError:
+        return None
+    return kb_list
 
-    xnm, xqm = parse_semester_id(semester_id)
+def extract_kblist(raw: str) -> Optional[List[Dict]]:
+    """
+    从课表查询的响应体中取出 kbList，找不到时返回 None。
+    - 响应不超过 KBLIST_FULL_PARSE_MAX_CHARS：整体按 JSON 解析（安装了 orjson 时用 orjson），取顶层 kbList；
+    - 更大的响应，或整体解析失败：定位 "kbList": 并从该处只解码这个数组；
+    - 仍失败（响应被截断等）时退回旧的正则匹配。
+    与键的顺序、空白和条目内容无关。
+    """
+    if len(raw) <= settings.KBLIST_FULL_PARSE_MAX_CHARS:
+        try:
+            data = _json_loads(raw)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and isinstance(data.get("kbList"), list):
+            return data["kbList"]
+
+    kb_list = _decode_kblist_at_key(raw)
+    if isinstance(kb_list, list):
+        return kb_list
+
+    m = _KBLIST_FALLBACK_RE.search(raw)
+    if not m:
+        return None
+    try:
+        return json.loads(m.group(0))
+    except ValueError:
+        return None
+
+async def _post_kblist(jsessionid: str, route: str, xnm: str, xqm: str) -> httpx.Response:
     cookies = {"JSESSIONID": jsessionid, "route": route}
-    headers = {
+    headers = cookie_header(cookies, {
         "Content-Type": "application/x-www-form-urlencoded; charset=utf-8",
         "Referer": "https://zdbk.zju.edu.cn/jwglxt/xtgl/index_initMenu.html",
         "Origin": "https://zdbk.zju.edu.cn",
         "User-Agent": "Mozilla/5.0",
-    }
+    })
     url = "https://zdbk.zju.edu.cn/jwglxt/kbcx/xskbcx_cxXsKb.html"
     body = f"xnm={xnm}&xqm={xqm}"
 
-    async with httpx.AsyncClient(timeout=15, follow_redirects=False) as client:
-        resp = await client.post(url, content=body, cookies=cookies, headers=headers)
-        raw = resp.text
-
-        m = re.search(r'(?<="kbList":)\[(.*?)\](?=,"xh")', raw)
-        if not m:
-            print("[TT] kbList not found. status:", resp.status_code)
-            print("[TT] snippet:", raw[:800].replace("\n", " "))
-            raise TimetableFetchError("无法解析课表（kbList 未找到）")
-
-        kb_list = json.loads(m.group(0))
-
-        if not strict_filter:
-            return kb_list
-
-        filtered = []
-        for e in kb_list:
-            entry_sem_id = semester_from_xkkh(e.get("xkkh", ""))
-            if entry_sem_id and entry_sem_id != semester_id:
-                continue
-            entry_xqm = xqm_from_xxq(e.get("xxq", ""))
-            if entry_xqm and entry_xqm != xqm:
-                continue
-            filtered.append(e)
-        return filtered
-
-def compute_date_for_weekday(start_monday: date, week: int, weekday: int) -> date:
-    delta_days = (week - 1) * 7 + (weekday - 1)
-    return start_monday + timedelta(days=delta_days)
-
-def compute_datetime(semester: str, week: int, weekday: int, period_start: int, period_count: int) -> Tuple[datetime, datetime]:
+    async with upstream_slot("zdbk") as call:
+        return call.record(await get_client("zdbk").post(url, content=body, headers=headers))
+
+async def fetch_kblist(
+    sso_cookie: str,
+    semester_id: str,
+    strict_filter: bool = True,
+    username: Optional[str] = None,
+) -> List[Dict]:
     """
-    根据学期（从 settings.TERM_CONFIGS 取）、周、星期、节次计算具体起止时间。
-    依赖：
-      - settings.get_term_start_monday(semester)
-      - settings.get_term_periods(semester)
+    拉取 kbList。给出 username 时复用缓存的教务会话，只需一次请求；
+    缓存会话已失效（返回登录跳转）时透明地重新登录一次。
     """
-    start_monday = settings.get_term_start_monday(semester)
-    periods = settings.get_term_periods(semester)
-    class_date = compute_date_for_weekday(start_monday, week, weekday)
-    # 第 period_start 节的开始时间
-    start_t = periods[period_start - 1][0]
-    # 连续 period_count 节的结束时间，以最后一节的结束 time 为准
-    end_t = periods[period_start + period_count - 2][1]
-    return datetime.combine(class_date, start_t), datetime.combine(class_date, end_t)
+    xnm, xqm = parse_semester_id(semester_id)
 
-def parse_kcb_fields(kcb: str) -> dict:
+    session = await get_cached_jw_session(username) if username else None
+    from_cache = session is not None
+    try:
+        if session is None:
+            session = await open_jw_session(sso_cookie, username)
+        resp = await _post_kblist(*session, xnm, xqm)
+        if from_cache and is_login_redirect(resp):
+            print(f"[TT] 用户 '{username}' 的教务会话已失效，重新登录")
+            await invalidate_jw_session(username)
+            session = await open_jw_session(sso_cookie, username)
+            resp = await _post_kblist(*session, xnm, xqm)
+    except ZdbkLoginError as e:
+        raise TimetableFetchError(f"教务登录失败: {e}")
+
+    raw = resp.text
+
+    kb_list = extract_kblist(raw)
+    if kb_list is None:
+        print("[TT] kbList not found. status:", resp.status_code)
+        print("[TT] snippet:", raw[:800].replace("\n", " "))
+        raise TimetableFetchError("无法解析课表（kbList 未找到）")
+
+    if username:
+        # 会话可用，顺延缓存有效期
+        await cache_jw_session(username, *session)
+
+    if not strict_filter:
+        return kb_list
+
+    filtered = []
+    for e in kb_list:
+        entry_sem_id = semester_from_xkkh(e.get("xkkh", ""))
+        if entry_sem_id and entry_sem_id != semester_id:
+            continue
+        entry_xqm = xqm_from_xxq(e.get("xxq", ""))
+        if entry_xqm and entry_xqm != xqm:
+            continue
+        filtered.append(e)
+    return filtered
+
+async def fetch_kblists(
+    sso_cookie: str,
+    semester_ids: List[str],
+    username: str,
+    concurrency: int = 3,
+) -> Dict[str, Union[List[Dict], Exception]]:
+    """
+    拉取多个学期的 kbList（按学期过滤）：只登录一次教务系统，之后按有界并发复用同一会话。
+    返回 {学期: kbList 或该学期的异常}，单个学期失败不影响其他学期。
+    """
+    if await get_cached_jw_session(username) is None:
+        try:
+            await open_jw_session(sso_cookie, username)
+        except ZdbkLoginError as e:
+            raise TimetableFetchError(f"教务登录失败: {e}")
+
+    limit = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(semester_id: str) -> List[Dict]:
+        async with limit:
+            return await fetch_kblist(sso_cookie, semester_id=semester_id, strict_filter=True, username=username)
+
+    results = await asyncio.gather(*(fetch_one(s) for s in semester_ids), return_exceptions=True)
+    return dict(zip(semester_ids, results))
+
+# 解析/展开逻辑或存储结构有变化（会导致同样的 kbList 产出不同记录）时递增，使旧指纹失效
+# 2：课程安排改为按周次位图存储（迁移 v7）
+PARSER_VERSION = 2
+
+def kblist_fingerprint(kb_list: List[Dict], semester: str) -> str:
+    """
+    计算 kbList 的指纹，用于判断同步是否可以直接跳过。
+    除 kbList 本身外还纳入学期起始日与作息表，配置变更后会重新同步。
+    """
+    payload = {
+        "v": PARSER_VERSION,
+        "term": settings.TERM_CONFIGS.get(semester),
+        "default_periods": settings.DEFAULT_PERIODS,
+        "kbList": kb_list,
+    }
+    # date/time 等非 JSON 类型按 str 序列化
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+@lru_cache(maxsize=settings.KCB_PARSE_CACHE_SIZE)
+def _parse_kcb_cached(kcb: str) -> Dict:
+    """
+    按原始 kcb 文本缓存解析结果：同一教学班所有学生的 kcb 完全相同，跨用户、跨请求复用。
+    返回的 dict 由缓存共享，调用方不能修改（对外用 parse_kcb_fields 拿副本）。
+    """
     text = html.unescape(kcb.replace("<br>", "\n"))
     lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
     course_name = lines[0] if lines else ""
@@ -119,13 +245,13 @@ def parse_kcb_fields(kcb: str) -> dict:
 
     if len(lines) >= 2:
         term_text = lines[1]
-        m = re.search(r"\{(.*?)\}", term_text)
+        m = _BRACES_RE.search(term_text)
         if m:
             inside = m.group(1)
-            mw = re.search(r"(第[\d\-，,]+周)", inside)
+            mw = _WEEKS_SPEC_RE.search(inside)
             if mw:
                 weeks_spec = mw.group(1)
-            mc = re.search(r"(\d+)节", inside)
+            mc = _PERIOD_COUNT_RE.search(inside)
             if mc:
                 period_count = int(mc.group(1))
             if "单周" in inside:
@@ -137,13 +263,13 @@ def parse_kcb_fields(kcb: str) -> dict:
         teachers = lines[2]
     if len(lines) >= 4:
         classroom_line = lines[3]
-        md = re.search(r"(\d{4}年\d{2}月\d{2}日\(\d{2}:\d{2}-\d{2}:\d{2}\))", classroom_line)
+        md = _DATE_RANGE_RE.search(classroom_line)
         if md:
             extra_date_range = md.group(1)
             classroom = classroom_line[:md.start()].strip()
         else:
             classroom = classroom_line.strip()
-        classroom = re.sub(r"(zwf)+$", "", classroom).strip()
+        classroom = _ZWF_SUFFIX_RE.sub("", classroom).strip()
 
     return {
         "course_name": course_name,
@@ -156,12 +282,16 @@ def parse_kcb_fields(kcb: str) -> dict:
         "extra_date_range": extra_date_range,
     }
 
-def normalize_weeks(weeks_spec: str, week_flag: Optional[str]) -> List[int]:
+def parse_kcb_fields(kcb: str) -> dict:
+    return dict(_parse_kcb_cached(kcb))
+
+@lru_cache(maxsize=settings.KCB_PARSE_CACHE_SIZE)
+def _normalize_weeks_cached(weeks_spec: str, week_flag: Optional[str]) -> Tuple[int, ...]:
     if not weeks_spec:
-        return []
+        return ()
     s = weeks_spec.replace("第", "").replace("周", "")
     weeks: List[int] = []
-    for part in re.split(r"[，,]", s):
+    for part in _WEEK_SEP_RE.split(s):
         part = part.strip()
         if not part:
             continue
@@ -175,7 +305,25 @@ def normalize_weeks(weeks_spec: str, week_flag: Optional[str]) -> List[int]:
         weeks = [w for w in weeks if w % 2 == 0]
     if week_flag == "单周":
         weeks = [w for w in weeks if w % 2 == 1]
-    return weeks
+    return tuple(weeks)
+
+def normalize_weeks(weeks_spec: str, week_flag: Optional[str]) -> List[int]:
+    return list(_normalize_weeks_cached(weeks_spec, week_flag))
+
+def kcb_cache_stats() -> Dict[str, Dict[str, object]]:
+    """kcb 解析与周次展开缓存的命中情况（每个进程各自一份）"""
+    stats = {}
+    for name, fn in (("kcb", _parse_kcb_cached), ("weeks", _normalize_weeks_cached)):
+        info = fn.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+            "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0,
+        }
+    return stats
 
 def seasons_from_xxq(xxq: str) -> List[str]:
     """
@@ -195,23 +343,19 @@ def seasons_from_xxq(xxq: str) -> List[str]:
             return [s]
     return []
 
-def parse_kblist_to_occurrences(kb_list: List[Dict]) -> List[Dict]:
+def iter_kblist_entries(kb_list: Iterable[Dict]) -> Iterator[Dict]:
     """
+    将 kbList 逐条规整为“课程安排”（尚未按周/季节展开）。
     针对当前数据格式：
     - weekday: xqj
     - period_start: djj
     - period_count: 优先 kcb 中的 'N节'，否则回退 skcd
-    - season: 来自 xxq（秋冬→两条记录；秋/冬→单条；春夏同理）
+    - seasons: 来自 xxq（秋冬→两个季节；秋/冬→单个；春夏同理）
     """
-    occurrences = []
     for item in kb_list:
         semester = semester_from_xkkh(item.get("xkkh"))
         kcb = item.get("kcb", "") or ""
-        fields = parse_kcb_fields(kcb)
-        course_name = fields["course_name"]
-        teachers = fields["teachers"]
-        classroom = fields["classroom"]
-        weeks_spec = fields["weeks_spec"]
+        fields = _parse_kcb_cached(kcb)
         week_flag = fields["week_flag"]
         period_count = fields["period_count"]
 
@@ -226,38 +370,64 @@ def parse_kblist_to_occurrences(kb_list: List[Dict]) -> List[Dict]:
         except Exception:
             period_start = 1
 
-        weekday = int(item.get("xqj") or 1)
-        course_code = item.get("xkkh", "")
-        single_week = (week_flag == "单周")
-        double_week = (week_flag == "双周")
-        note = None
-
-        weeks = normalize_weeks(weeks_spec, week_flag)
-        season_list = seasons_from_xxq(item.get("xxq", ""))
-
-        # 若 xxq 无法判定季节，可根据需求选择：跳过或赋默认季节
-        if not season_list:
-            season_list = []  # 保持为空可选择不入库，或设定默认季节
-
-        for w in weeks:
-            for season in season_list:
-                week_for_date = w + 8 if season in ("冬", "夏") else w
-                starts_at, ends_at = compute_datetime(semester, week_for_date, weekday, period_start, period_count)
-                occurrences.append({
-                    "course_code": course_code,
-                    "course_name": course_name,
-                    "teacher": teachers,
-                    "classroom": classroom,
-                    "week": w,
-                    "weekday": weekday,
-                    "period_start": period_start,
-                    "period_count": period_count,
-                    "starts_at": starts_at.isoformat(),
-                    "ends_at": ends_at.isoformat(),
-                    "single_week": single_week,
-                    "double_week": double_week,
-                    "season": season,
-                    "semester": semester,
-                    "note": note
-                })
-    return occurrences
\ No newline at end of file
+        # 若 xxq 无法判定季节，seasons 为空，该条目不会展开出任何记录
+        yield {
+            "course_code": item.get("xkkh", ""),
+            "course_name": fields["course_name"],
+            "teacher": fields["teachers"],
+            "classroom": fields["classroom"],
+            "weekday": int(item.get("xqj") or 1),
+            "period_start": period_start,
+            "period_count": period_count,
+            "weeks": normalize_weeks(fields["weeks_spec"], week_flag),
+            "seasons": seasons_from_xxq(item.get("xxq", "")),
+            "single_week": week_flag == "单周",
+            "double_week": week_flag == "双周",
+            "semester": semester,
+            "note": None,
+        }
+
+def entry_schedules(entry: Dict) -> Iterator[Dict]:
+    """
+    把一条课程安排按季节拆成周期规则（course_schedules 的一行），周次存为位图，不逐周展开。
+    base_*_ts 为第 1 周（冬/夏已按 +8 周）的起止时间戳，第 w 周 = base + (w - 1) * WEEK_SECONDS；
+    first_ts / last_ts 为第一次上课的开始与最后一次上课的结束，用于按时间范围筛选。
+    """
+    # 超出位图范围的周次无法存储（实际教学周不超过 20）
+    weeks = [w for w in entry["weeks"] if 1 <= w <= MAX_MASK_WEEK]
+    if not weeks or not entry["seasons"]:
+        return
+    calendar = get_term_calendar(entry["semester"])
+    mask = weeks_to_mask(weeks)
+    first, last = min(weeks), max(weeks)
+    for season in entry["seasons"]:
+        _, _, base_starts_ts, base_ends_ts = calendar.slot(
+            9 if season in ("冬", "夏") else 1, entry["weekday"], entry["period_start"], entry["period_count"]
+        )
+        yield {
+            "course_code": entry["course_code"],
+            "course_name": entry["course_name"],
+            "teacher": entry["teacher"],
+            "classroom": entry["classroom"],
+            "weekday": entry["weekday"],
+            "period_start": entry["period_start"],
+            "period_count": entry["period_count"],
+            "single_week": entry["single_week"],
+            "double_week": entry["double_week"],
+            "season": season,
+            "semester": entry["semester"],
+            "note": entry["note"],
+            "weeks_mask": mask,
+            "base_starts_ts": base_starts_ts,
+            "base_ends_ts": base_ends_ts,
+            "first_ts": base_starts_ts + (first - 1) * WEEK_SECONDS,
+            "last_ts": base_ends_ts + (last - 1) * WEEK_SECONDS,
+        }
+
+def iter_kblist_schedules(kb_list: Iterable[Dict]) -> Iterator[Dict]:
+    """流式解析：逐条产出课程安排的周期规则（写库用；读取时按周展开见 storage.db.expand_schedule）"""
+    for entry in iter_kblist_entries(kb_list):
+        yield from entry_schedules(entry)
+
+def parse_kblist_to_schedules(kb_list: List[Dict]) -> List[Dict]:
+    return list(iter_kblist_schedules(kb_list))
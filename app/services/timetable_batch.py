@@ -0,0 +1,116 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from ..utils.weekmask import MAX_MASK_WEEK, WEEK_SECONDS, weeks_to_mask
+from .term_calendar import TermCalendar, get_term_calendar
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖：pip install numpy，未安装时用结果完全相同的纯 Python 实现
+    np = None
+
+# 日期按 +8 周计算的季节（冬、夏为学期后半段）
+LATE_SEASONS = ("冬", "夏")
+DAY_SECONDS = 86400
+LATE_DAYS = 8 * 7
+
+# 课程安排中原样带入每条规则的字段
+_COPIED_FIELDS = ("course_code", "course_name", "teacher", "classroom", "weekday", "period_start",
+                  "period_count", "single_week", "double_week", "semester", "note")
+
+class _EntryColumns(NamedTuple):
+    """参与计算的课程安排（至少有一个有效周次和一个季节），按列存放"""
+    fields: Sequence[Dict]      # 每条课程安排原样带入规则的字段
+    seasons: Sequence[List[str]]
+    owner: Sequence[int]        # 所属 kbList 的下标
+    n_weeks: Sequence[int]
+    base_epoch: Sequence[int]   # 学期第一周周一 0 点
+    weekday0: Sequence[int]     # weekday - 1
+    start_offset: Sequence[int]
+    end_offset: Sequence[int]
+    weeks: List[int]            # 全部课程安排的有效周次依次拼接
+
+# 每个 (课程安排, 季节) 一行：(课程安排下标, 季节, weeks_mask, base_starts_ts, base_ends_ts, first_ts, last_ts)
+_Rule = Tuple[int, str, int, int, int, int, int]
+
+def _rules_python(cols: _EntryColumns) -> List[_Rule]:
+    rules: List[_Rule] = []
+    pos = 0
+    for k, n in enumerate(cols.n_weeks):
+        weeks = cols.weeks[pos:pos + n]
+        pos += n
+        mask, first, last = weeks_to_mask(weeks), min(weeks), max(weeks)
+        for season in cols.seasons[k]:
+            day = cols.base_epoch[k] + ((LATE_DAYS if season in LATE_SEASONS else 0) + cols.weekday0[k]) * DAY_SECONDS
+            starts, ends = day + cols.start_offset[k], day + cols.end_offset[k]
+            rules.append((k, season, mask, starts, ends,
+                          starts + (first - 1) * WEEK_SECONDS, ends + (last - 1) * WEEK_SECONDS))
+    return rules
+
+def _rules_numpy(cols: _EntryColumns) -> List[_Rule]:
+    if not cols.fields:
+        return []
+    n_weeks = np.asarray(cols.n_weeks, dtype=np.int64)
+    bounds = np.cumsum(n_weeks) - n_weeks
+    weeks = np.asarray(cols.weeks, dtype=np.int64)
+    # 每个课程安排至少一个周次，reduceat 的各段都非空
+    masks = np.bitwise_or.reduceat(np.left_shift(np.int64(1), weeks - 1), bounds)
+    first = np.minimum.reduceat(weeks, bounds)
+    last = np.maximum.reduceat(weeks, bounds)
+
+    # 按季节展开为规则行
+    seasons = [s for entry_seasons in cols.seasons for s in entry_seasons]
+    idx = np.repeat(np.arange(len(cols.fields), dtype=np.int64),
+                    np.fromiter(map(len, cols.seasons), dtype=np.int64, count=len(cols.seasons)))
+    late = np.fromiter((s in LATE_SEASONS for s in seasons), dtype=np.int64, count=len(seasons))
+    day = (np.asarray(cols.base_epoch, dtype=np.int64)[idx]
+           + (LATE_DAYS * late + np.asarray(cols.weekday0, dtype=np.int64)[idx]) * DAY_SECONDS)
+    starts = day + np.asarray(cols.start_offset, dtype=np.int64)[idx]
+    ends = day + np.asarray(cols.end_offset, dtype=np.int64)[idx]
+    first_ts = starts + (first[idx] - 1) * WEEK_SECONDS
+    last_ts = ends + (last[idx] - 1) * WEEK_SECONDS
+    return list(zip(idx.tolist(), seasons, masks[idx].tolist(), starts.tolist(), ends.tolist(),
+                    first_ts.tolist(), last_ts.tolist()))
+
+def build_schedules_batch(entry_lists: Sequence[Sequence[Dict]], use_numpy: Optional[bool] = None) -> List[List[Dict]]:
+    """
+    把多个 kbList 规整后的课程安排（iter_kblist_entries 的输出）一次换算为 course_schedules 的周期规则：
+    周次位图、第 1 周（冬/夏 +8 周）起止时间戳与首末次上课时间。
+    安装了 NumPy 时整批向量化计算（use_numpy=False 可强制使用纯 Python），两种实现结果完全相同，
+    也与逐条 entry_schedules 的结果一致。返回与 entry_lists 一一对应的课程安排列表。
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    elif use_numpy and np is None:
+        raise RuntimeError("未安装 numpy")
+
+    rows: List[Tuple] = []
+    weeks_all: List[int] = []
+    calendars: Dict[str, TermCalendar] = {}
+    for i, entry_list in enumerate(entry_lists):
+        for entry in entry_list:
+            # 超出位图范围的周次无法存储；没有周次或季节的课程安排不产生规则
+            weeks = [w for w in entry["weeks"] if 1 <= w <= MAX_MASK_WEEK]
+            if not weeks or not entry["seasons"]:
+                continue
+            semester = entry["semester"]
+            calendar = calendars.get(semester)
+            if calendar is None:
+                calendar = calendars[semester] = get_term_calendar(semester)
+            _, _, start_off, end_off = calendar.period_range(entry["period_start"], entry["period_count"])
+            weeks_all.extend(weeks)
+            rows.append(({f: entry[f] for f in _COPIED_FIELDS}, entry["seasons"], i, len(weeks),
+                         calendar.day_epochs[0], entry["weekday"] - 1, start_off, end_off))
+    cols = _EntryColumns(*(zip(*rows) if rows else [()] * 8), weeks_all)
+
+    results: List[List[Dict]] = [[] for _ in entry_lists]
+    for k, season, mask, starts, ends, first_ts, last_ts in (_rules_numpy if use_numpy else _rules_python)(cols):
+        results[cols.owner[k]].append({
+            **cols.fields[k],
+            "season": season,
+            "weeks_mask": mask,
+            "base_starts_ts": starts,
+            "base_ends_ts": ends,
+            "first_ts": first_ts,
+            "last_ts": last_ts,
+        })
+    return results
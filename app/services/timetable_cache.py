@@ -0,0 +1,99 @@
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from ..config import settings
+from ..storage.session_store import TIMETABLE_CACHE_STORE, get_store
+from ..utils.singleflight import SingleFlight
+from .governor import UpstreamUnavailable
+from .timetable import TimetableFetchError
+
+# kbList 缓存放在独立的存储（TIMETABLE_CACHE_DB_PATH / TIMETABLE_CACHE_MAX_ENTRIES），多 worker 共享；
+# 整个 kbList 体积大，与 SSO / 教务会话共用一个 LRU 上限会把在用的会话挤出去。条目保留 STALE_TTL，新鲜期为 TTL
+KB_NS = "kb"
+
+FetchFn = Callable[[], Awaitable[List[Dict]]]
+
+# 上游不可用（含闸门拒绝、熔断、超出截止时间）时可以回退到旧数据的错误类型
+UPSTREAM_ERRORS = (TimetableFetchError, httpx.HTTPError, UpstreamUnavailable)
+
+_flights = SingleFlight()
+_revalidations: Set["asyncio.Task[None]"] = set()
+_stats: Dict[str, int] = {"hit": 0, "miss": 0, "stale": 0, "revalidate_failed": 0}
+
+def _key(username: str, semester: str, strict: bool) -> str:
+    return f"{username}|{semester}|{int(strict)}"
+
+async def _load(key: str) -> Optional[Tuple[List[Dict], float]]:
+    raw = await get_store(TIMETABLE_CACHE_STORE).aget(KB_NS, key)
+    if not raw:
+        return None
+    entry = json.loads(raw)
+    return entry["kbList"], entry["fetched_at"]
+
+async def store_kblist(username: str, semester: str, strict: bool, kb_list: List[Dict]) -> None:
+    """写入缓存（其他路径拿到了新鲜的 kbList 时也可以顺带调用）"""
+    raw = json.dumps({"kbList": kb_list, "fetched_at": time.time()}, ensure_ascii=False, separators=(",", ":"))
+    await get_store(TIMETABLE_CACHE_STORE).aset(KB_NS, _key(username, semester, strict), raw, settings.TIMETABLE_CACHE_STALE_TTL)
+
+def _fetch_and_store(key: str, username: str, semester: str, strict: bool, fetch: FetchFn) -> Awaitable[List[Dict]]:
+    async def run() -> List[Dict]:
+        kb_list = await fetch()
+        await store_kblist(username, semester, strict, kb_list)
+        return kb_list
+
+    # 同一 (用户, 学期, strict) 的并发未命中只拉取一次
+    return _flights.do(key, run)
+
+def _revalidate(key: str, username: str, semester: str, strict: bool, fetch: FetchFn) -> None:
+    async def run() -> None:
+        try:
+            await _fetch_and_store(key, username, semester, strict, fetch)
+        except Exception as e:
+            _stats["revalidate_failed"] += 1
+            print(f"[TT] 后台刷新课表缓存失败 {key}: {e}")
+
+    task = asyncio.create_task(run())
+    _revalidations.add(task)
+    task.add_done_callback(_revalidations.discard)
+
+async def get_kblist_cached(
+    username: str,
+    semester: str,
+    strict: bool,
+    fetch: FetchFn,
+    refresh: bool = False,
+) -> Tuple[List[Dict], str]:
+    """
+    读取 kbList，返回 (kbList, 缓存状态 hit / miss / stale)。
+    - 新鲜（TIMETABLE_CACHE_TTL 内）：直接返回；
+    - 过期但仍保留：立即返回旧数据，并在后台刷新；
+    - 未命中或 refresh=True：拉取上游，若上游出错且有旧数据则回退到旧数据。
+    """
+    key = _key(username, semester, strict)
+    cached = await _load(key)
+
+    if cached and not refresh:
+        kb_list, fetched_at = cached
+        if time.time() - fetched_at < settings.TIMETABLE_CACHE_TTL:
+            _stats["hit"] += 1
+            return kb_list, "hit"
+        _stats["stale"] += 1
+        _revalidate(key, username, semester, strict, fetch)
+        return kb_list, "stale"
+
+    _stats["miss"] += 1
+    try:
+        return await _fetch_and_store(key, username, semester, strict, fetch), "miss"
+    except UPSTREAM_ERRORS as e:
+        if not cached:
+            raise
+        print(f"[TT] 拉取课表失败，返回缓存的旧数据 {key}: {e}")
+        _stats["stale"] += 1
+        return cached[0], "stale"
+
+def cache_stats() -> Dict[str, int]:
+    return {**_stats, **{f"flight_{k}": v for k, v in _flights.stats().items()}}
@@ -0,0 +1,101 @@
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from .timetable import iter_kblist_entries, kblist_fingerprint, iter_kblist_schedules, parse_kblist_to_schedules
+from .timetable_batch import build_schedules_batch
+from ..storage.db import (
+    apply_semester_diff,
+    apply_semester_diff_in_tx,
+    cleanup_orphan_courses,
+    count_schedules_by_semester,
+    get_sync_fingerprint,
+    transaction,
+)
+
+# 一个学期的同步计划：(kbList 指纹, 解析出的课程安排；指纹未变时为 None)
+SemesterPlan = Tuple[str, Optional[List[Dict]]]
+
+def _unchanged_result(conn: sqlite3.Connection, user_id: int, semester: str) -> Dict:
+    return {
+        "synced": count_schedules_by_semester(conn, user_id, semester),
+        "added": 0,
+        "changed": 0,
+        "removed": 0,
+        "unchanged": True,
+    }
+
+def _diff_result(stats: Dict[str, int]) -> Dict:
+    return {
+        "synced": stats["total"],
+        "added": stats["added"],
+        "changed": stats["changed"],
+        "removed": stats["removed"],
+        "unchanged": False,
+    }
+
+def sync_kblist_to_db(conn: sqlite3.Connection, user_id: int, semester: str, kb_list: List[Dict]) -> Dict:
+    """
+    将一个学期的 kbList 增量写入数据库。
+    kbList 指纹与上次同步一致时直接返回，不解析也不产生任何写入；
+    否则按行比对，只应用新增 / 变更 / 删除。
+    """
+    fingerprint = kblist_fingerprint(kb_list, semester)
+    if get_sync_fingerprint(conn, user_id, semester) == fingerprint:
+        return _unchanged_result(conn, user_id, semester)
+
+    stats = apply_semester_diff(conn, user_id, semester, iter_kblist_schedules(kb_list), fingerprint)
+    return _diff_result(stats)
+
+def plan_semester_sync(kb_list: List[Dict], semester: str, stored_fingerprint: Optional[str]) -> SemesterPlan:
+    """计算指纹并在需要时解析（纯 CPU，不访问数据库，可在线程中并行执行）"""
+    fingerprint = kblist_fingerprint(kb_list, semester)
+    if stored_fingerprint == fingerprint:
+        return fingerprint, None
+    return fingerprint, parse_kblist_to_schedules(kb_list)
+
+def plan_semester_syncs(chunk: Sequence[Tuple[str, List[Dict], Optional[str]]]) -> List[SemesterPlan]:
+    """
+    批量版 plan_semester_sync：chunk 为 [(学期, kbList, 上次同步的指纹)]，可以来自多个用户。
+    指纹有变化的 kbList 规整后一起交给 build_schedules_batch 一次换算，返回与 chunk 一一对应的同步计划。
+    """
+    fingerprints = [kblist_fingerprint(kb_list, semester) for semester, kb_list, _ in chunk]
+    changed = [i for i, ((_, _, stored), fp) in enumerate(zip(chunk, fingerprints)) if stored != fp]
+    built = build_schedules_batch([list(iter_kblist_entries(chunk[i][1])) for i in changed])
+    plans: List[SemesterPlan] = [(fp, None) for fp in fingerprints]
+    for i, schedules in zip(changed, built):
+        plans[i] = (fingerprints[i], schedules)
+    return plans
+
+def sync_semesters_to_db(conn: sqlite3.Connection, user_id: int, plans: Dict[str, SemesterPlan]) -> Dict[str, Dict]:
+    """
+    在同一个事务中应用多个学期的同步计划，任一学期写入失败则全部回滚。
+    孤儿课程在全部学期写完后统一清理一次。返回 {学期: 与 sync_kblist_to_db 相同格式的结果}。
+    """
+    results: Dict[str, Dict] = {}
+    any_removed = False
+    with transaction(conn):
+        for semester, (fingerprint, schedules) in plans.items():
+            if schedules is None:
+                results[semester] = _unchanged_result(conn, user_id, semester)
+                continue
+            stats = apply_semester_diff_in_tx(conn, user_id, semester, schedules, fingerprint, cleanup=False)
+            any_removed = any_removed or stats["removed"] > 0
+            results[semester] = _diff_result(stats)
+        if any_removed:
+            cleanup_orphan_courses(conn, user_id)
+    return results
+
+def sync_users_to_db(
+    conn: sqlite3.Connection, jobs: Sequence[Tuple[int, Dict[str, SemesterPlan]]]
+) -> List[Union[Dict[str, Dict], Exception]]:
+    """
+    批量写入多个用户的同步计划（全量刷新用）：每个用户各自一个事务（sync_semesters_to_db），
+    一个用户写入失败不影响其他用户。返回与 jobs 一一对应的结果或异常。
+    """
+    results: List[Union[Dict[str, Dict], Exception]] = []
+    for user_id, plans in jobs:
+        try:
+            results.append(sync_semesters_to_db(conn, user_id, plans))
+        except Exception as e:
+            results.append(e)
+    return results
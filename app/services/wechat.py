@@ -1,6 +1,7 @@
 import httpx
 from fastapi import HTTPException
 from ..config import settings
+from .http import get_client
 
 async def get_openid_from_code(code: str) -> str:
     """
@@ -13,13 +14,12 @@ async def get_openid_from_code(code: str) -> str:
         "js_code": code,
         "grant_type": "authorization_code",
     }
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(url, params=params)
-            resp.raise_for_status()
-            data = resp.json()
-        except (httpx.RequestError, httpx.HTTPStatusError) as e:
-            raise HTTPException(status_code=500, detail=f"请求微信服务器失败: {e}")
+    try:
+        resp = await get_client("wechat").get(url, params=params)
+        resp.raise_for_status()
+        data = resp.json()
+    except (httpx.RequestError, httpx.HTTPStatusError) as e:
+        raise HTTPException(status_code=500, detail=f"请求微信服务器失败: {e}")
 
     if "errcode" in data and data["errcode"] != 0:
         raise HTTPException(status_code=400, detail=f"微信登录凭证无效: {data.get('errmsg')}")
@@ -1,5 +1,12 @@
 import httpx
-from typing import Tuple
+import json
+from typing import Optional, Tuple
+
+from ..config import settings
+from ..storage.session_store import get_store
+from ..utils.singleflight import SingleFlight
+from .governor import upstream_slot
+from .http import cookie_header, get_client
 
 class ZdbkLoginError(Exception):
     pass
@@ -24,34 +31,73 @@ async def login_with_sso_get_jw_cookies(sso_cookie: str) -> Tuple[str, str]:
         "iPlanetDirectoryPro": sso_cookie
     }
 
-    async with httpx.AsyncClient(timeout=12, follow_redirects=False, headers=headers) as client:
-        # 第一步：访问 CAS 带 service 的登录入口
-        r1 = await client.get(CAS_LOGIN_WITH_SERVICE, cookies=cookies)
-        loc = r1.headers.get("location")
-        if not loc:
-            # 打印辅助信息便于排查
-            snippet = (r1.text or "")[:200].replace("\n", " ")
-            print("[ZDBK] CAS no location, status:", r1.status_code, "| body:", snippet)
-            raise ZdbkLoginError("CAS 跳转未返回 location（可能 SSO 无效或已过期）")
-        if loc.startswith("http://"):
-            loc = loc.replace("http://", "https://", 1)
-
-        # 第二步：请求跳转地址（教务域），从响应 cookies 获取 JSESSIONID(/jwglxt) 与 route
-        r2 = await client.get(loc, cookies=cookies, follow_redirects=False)
-
-        jsessionid = None
-        route = None
-        for c in r2.cookies.jar:
-            if c.name == "JSESSIONID" and c.path == "/jwglxt":
-                jsessionid = c.value
-            if c.name == "route":
-                route = c.value
-
-        if not jsessionid:
-            print("[ZDBK] set-cookie:", r2.headers.get("set-cookie"))
-            raise ZdbkLoginError("无法获取 JSESSIONID（/jwglxt）")
-        if not route:
-            print("[ZDBK] set-cookie:", r2.headers.get("set-cookie"))
-            raise ZdbkLoginError("无法获取 route")
-
-        return jsessionid, route
\ No newline at end of file
+    # 第一步：访问 CAS 带 service 的登录入口
+    async with upstream_slot("cas") as call:
+        r1 = call.record(await get_client("cas").get(CAS_LOGIN_WITH_SERVICE, headers=cookie_header(cookies, headers)))
+    loc = r1.headers.get("location")
+    if not loc:
+        # 打印辅助信息便于排查
+        snippet = (r1.text or "")[:200].replace("\n", " ")
+        print("[ZDBK] CAS no location, status:", r1.status_code, "| body:", snippet)
+        raise ZdbkLoginError("CAS 跳转未返回 location（可能 SSO 无效或已过期）")
+    if loc.startswith("http://"):
+        loc = loc.replace("http://", "https://", 1)
+
+    # 第二步：请求跳转地址（教务域），从响应 cookies 获取 JSESSIONID(/jwglxt) 与 route
+    async with upstream_slot("zdbk") as call:
+        r2 = call.record(await get_client("zdbk").get(loc, headers=cookie_header(cookies, headers)))
+
+    jsessionid = None
+    route = None
+    for c in r2.cookies.jar:
+        if c.name == "JSESSIONID" and c.path == "/jwglxt":
+            jsessionid = c.value
+        if c.name == "route":
+            route = c.value
+
+    if not jsessionid:
+        print("[ZDBK] set-cookie:", r2.headers.get("set-cookie"))
+        raise ZdbkLoginError("无法获取 JSESSIONID（/jwglxt）")
+    if not route:
+        print("[ZDBK] set-cookie:", r2.headers.get("set-cookie"))
+        raise ZdbkLoginError("无法获取 route")
+
+    return jsessionid, route
+
+# 教务会话（JSESSIONID + route）与 SSO 共用会话存储，按用户名缓存
+JW_NS = "jw"
+
+async def get_cached_jw_session(username: str) -> Optional[Tuple[str, str]]:
+    raw = await get_store().aget(JW_NS, username)
+    if not raw:
+        return None
+    jsessionid, route = json.loads(raw)
+    return jsessionid, route
+
+async def cache_jw_session(username: str, jsessionid: str, route: str) -> None:
+    """写入/续期缓存；每次成功使用后调用，TTL 随之滑动"""
+    await get_store().aset(JW_NS, username, json.dumps([jsessionid, route]), settings.JW_SESSION_TTL)
+
+async def invalidate_jw_session(username: str) -> None:
+    await get_store().adelete(JW_NS, username)
+
+# 同一用户并发的教务登录（如多学期并发拉取时会话恰好失效）合并为一次
+_jw_logins = SingleFlight()
+
+async def open_jw_session(sso_cookie: str, username: Optional[str] = None) -> Tuple[str, str]:
+    """重新登录教务系统；给出 username 时写入缓存"""
+    if not username:
+        return await login_with_sso_get_jw_cookies(sso_cookie)
+
+    async def login() -> Tuple[str, str]:
+        jsessionid, route = await login_with_sso_get_jw_cookies(sso_cookie)
+        await cache_jw_session(username, jsessionid, route)
+        return jsessionid, route
+
+    return await _jw_logins.do(username, login)
+
+def is_login_redirect(resp: httpx.Response) -> bool:
+    """教务会话失效时接口返回 302 到登录页，或直接返回登录页 HTML"""
+    if resp.is_redirect:
+        return True
+    return "login_slogin" in resp.text[:4096]
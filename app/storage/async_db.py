@@ -0,0 +1,59 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, TypeVar
+
+from .db import ConnectionPool, transaction
+
+T = TypeVar("T")
+
+class AsyncDatabase:
+    """
+    SQLite 异步访问层。
+    所有数据库操作都提交到有界线程池执行（线程数默认与连接池大小一致），
+    事件循环只 await 结果，慢查询不会阻塞同一 worker 里正在进行的上游请求。
+    借连接、执行、归还都在同一个工作线程内完成。
+    """
+
+    def __init__(self, pool: ConnectionPool, max_workers: Optional[int] = None):
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or pool.size,
+            thread_name_prefix="sqlite",
+        )
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """在数据库线程中执行 fn(conn, *args, **kwargs)，fn 内可执行任意多条语句"""
+        def task() -> T:
+            with self.pool.connection() as conn:
+                return fn(conn, *args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, task)
+
+    async def transaction(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """同 run，但 fn 在 BEGIN IMMEDIATE 事务中执行，正常返回即提交，异常回滚"""
+        def in_tx(conn: sqlite3.Connection) -> T:
+            with transaction(conn):
+                return fn(conn, *args, **kwargs)
+
+        return await self.run(in_tx)
+
+    async def fetchone(self, sql: str, params: Sequence = ()) -> Optional[sqlite3.Row]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: Sequence = ()) -> List[sqlite3.Row]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        """执行单条写语句并提交，返回受影响行数"""
+        def write(conn: sqlite3.Connection) -> int:
+            cur = conn.execute(sql, params)
+            conn.commit()
+            return cur.rowcount
+
+        return await self.run(write)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.pool.close()
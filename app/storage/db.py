@@ -1,123 +1,352 @@
+import queue
 import sqlite3
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict
-
-SCHEMA_SQL = """
-PRAGMA foreign_keys = ON;
-
-CREATE TABLE IF NOT EXISTS users (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  username TEXT NOT NULL UNIQUE,
-  password_encrypted TEXT NOT NULL,
-  wechat_openid TEXT UNIQUE 
-);
-
-CREATE TABLE IF NOT EXISTS courses (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  user_id INTEGER NOT NULL,
-  course_code TEXT NOT NULL,
-  name TEXT NOT NULL,
-  teacher TEXT NOT NULL,
-  department TEXT,
-  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-);
-CREATE UNIQUE INDEX IF NOT EXISTS idx_courses_code_teacher ON courses (user_id, course_code, teacher);
-
-CREATE TABLE IF NOT EXISTS occurrences (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  course_id INTEGER NOT NULL,
-  week INTEGER NOT NULL,
-  weekday INTEGER NOT NULL,
-  period_start INTEGER NOT NULL,
-  period_count INTEGER NOT NULL,
-  classroom TEXT NOT NULL,
-  starts_at TEXT NOT NULL,
-  ends_at TEXT NOT NULL,
-  single_week INTEGER DEFAULT 0,
-  double_week INTEGER DEFAULT 0,
-  season TEXT NOT NULL,  -- 新增季节标签：春/夏/秋/冬
-  semester TEXT, -- 学期标识，例如 2024-2025-1
-  note TEXT,
-  FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
-);
-CREATE INDEX IF NOT EXISTS idx_occurrences_time ON occurrences (starts_at, ends_at);
-CREATE INDEX IF NOT EXISTS idx_occurrences_week_day ON occurrences (week, weekday);
-CREATE INDEX IF NOT EXISTS idx_occurrences_season ON occurrences (season);
-CREATE INDEX IF NOT EXISTS idx_occurrences_semester ON occurrences (semester);
-
-CREATE TABLE IF NOT EXISTS events (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  user_id INTEGER NOT NULL,
-  title TEXT NOT NULL,
-  start_time TEXT NOT NULL,
-  end_time TEXT NOT NULL,
-  location TEXT,
-  description TEXT,
-  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-);
-CREATE INDEX IF NOT EXISTS idx_events_time ON events (start_time, end_time);
-
-CREATE VIEW IF NOT EXISTS v_calendar_events AS
-SELECT
-  o.id,
-  o.starts_at,
-  o.ends_at,
-  o.week,
-  o.weekday,
-  o.period_start,
-  o.period_count,
-  o.classroom,
-  o.season,
-  o.semester,
-  o.single_week,
-  o.double_week,
-  o.note,
-  c.name       AS course_name,
-  c.course_code,
-  c.teacher,
-  c.department
-FROM occurrences o
-JOIN courses c ON o.course_id = c.id;
-"""
-
-def get_conn(db_path: str) -> sqlite3.Connection:
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..utils.datetimes import format_iso, from_epoch
+from ..utils.weekmask import MAX_MASK_WEEK, WEEK_SECONDS, iter_mask_weeks, occurrence_id, week_range_mask
+
+class PoolTimeout(Exception):
+    pass
+
+def get_conn(
+    db_path: str,
+    busy_timeout_ms: int = 5000,
+    cache_size_kb: int = 8192,
+    cached_statements: int = 256,
+) -> sqlite3.Connection:
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn = sqlite3.connect(
+        db_path,
+        check_same_thread=False,
+        timeout=busy_timeout_ms / 1000,
+        cached_statements=cached_statements,
+    )
     conn.row_factory = sqlite3.Row
+    # WAL：读写互不阻塞；synchronous=NORMAL 在 WAL 下已足够安全
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)};")
+    # 负数表示按 KiB 计的缓存大小
+    conn.execute(f"PRAGMA cache_size = -{int(cache_size_kb)};")
     conn.execute("PRAGMA foreign_keys = ON;")
     return conn
 
-def init_schema(conn: sqlite3.Connection):
-    conn.executescript(SCHEMA_SQL)
+class ConnectionPool:
+    """
+    固定大小的 SQLite 连接池。
+    连接在启动时一次性建立并长期复用（由 FastAPI lifespan 管理），
+    路由通过依赖借出连接，请求结束后归还；归还时会回滚未提交的事务。
+    """
 
-def upsert_course(conn: sqlite3.Connection, user_id: int, course_code: str, name: str, teacher: str, department=None) -> int:
-    conn.execute(
-        "INSERT OR IGNORE INTO courses(user_id, course_code, name, teacher, department) VALUES (?, ?, ?, ?, ?)",
-        (user_id, course_code, name, teacher, department)
+    def __init__(self, db_path: str, size: int = 8, timeout: float = 10.0, **conn_kwargs):
+        if size < 1:
+            raise ValueError("连接池大小必须 >= 1")
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._all: List[sqlite3.Connection] = []
+        # LIFO：优先复用最近归还的连接，其页缓存更“热”
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            conn = get_conn(db_path, **conn_kwargs)
+            self._all.append(conn)
+            self._idle.put(conn)
+        self._closed = False
+
+    def acquire(self, timeout: Optional[float] = None) -> sqlite3.Connection:
+        if self._closed:
+            raise PoolTimeout("连接池已关闭")
+        try:
+            return self._idle.get(timeout=self.timeout if timeout is None else timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"等待数据库连接超时（池大小 {self.size}）")
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if self._closed:
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        self._closed = True
+        for conn in self._all:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._all.clear()
+
+# user_id 是冗余列（与 courses.user_id 一致），便于按用户走索引，放在参数末尾
+INSERT_SCHEDULE_SQL = """INSERT INTO course_schedules
+           (course_id, semester, season, weekday, period_start, period_count, classroom, single_week, double_week, note,
+            weeks_mask, base_starts_ts, base_ends_ts, first_ts, last_ts, user_id)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+SCHEDULE_COLUMNS = """course_id, semester, season, weekday, period_start, period_count, classroom, single_week, double_week, note,
+               weeks_mask, base_starts_ts, base_ends_ts, first_ts, last_ts"""
+
+def _schedule_row(course_id: int, sch: Dict) -> Tuple:
+    # 列顺序与 SCHEDULE_COLUMNS 一致
+    return (course_id, sch.get("semester"), sch["season"], sch["weekday"], sch["period_start"], sch["period_count"], sch["classroom"],
+            int(sch.get("single_week", 0)), int(sch.get("double_week", 0)), sch.get("note"),
+            sch["weeks_mask"], sch["base_starts_ts"], sch["base_ends_ts"], sch["first_ts"], sch["last_ts"])
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """显式写事务：BEGIN IMMEDIATE 提前拿到写锁，正常结束提交，异常回滚"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+def resolve_course_ids(conn: sqlite3.Connection, user_id: int, courses: Iterable[Tuple[str, str, str]]) -> Dict[Tuple[str, str], int]:
+    """
+    批量解析课程 id：courses 为 (course_code, name, teacher)。
+    一次 executemany 插入缺失课程，再一次 SELECT 取回该用户全部课程，
+    返回 {(course_code, teacher): course_id}。
+    """
+    # 课程名变化时顺带更新，名称未变的行不产生写入
+    conn.executemany(
+        """INSERT INTO courses(user_id, course_code, name, teacher) VALUES (?, ?, ?, ?)
+           ON CONFLICT(user_id, course_code, teacher) DO UPDATE SET name = excluded.name
+           WHERE courses.name != excluded.name""",
+        ((user_id, code, name, teacher) for code, name, teacher in courses)
     )
+    cur = conn.execute("SELECT id, course_code, teacher FROM courses WHERE user_id = ?", (user_id,))
+    return {(r["course_code"], r["teacher"]): r["id"] for r in cur}
+
+def _schedule_courses(schedules: Iterable[Dict]) -> List[Tuple[str, str, str]]:
+    courses: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
+    for sch in schedules:
+        courses.setdefault((sch["course_code"], sch["teacher"]), (sch["course_code"], sch["course_name"], sch["teacher"]))
+    return list(courses.values())
+
+def cleanup_orphan_courses(conn: sqlite3.Connection, user_id: Optional[int] = None):
+    if user_id is None:
+        conn.execute("DELETE FROM courses WHERE id NOT IN (SELECT DISTINCT course_id FROM course_schedules)")
+        return
+    # 只清理指定用户的课程，避免全表扫描
+    conn.execute("""
+        DELETE FROM courses
+        WHERE user_id = ? AND NOT EXISTS (
+            SELECT 1 FROM course_schedules s WHERE s.course_id = courses.id
+        )
+    """, (user_id,))
+
+def get_sync_fingerprint(conn: sqlite3.Connection, user_id: int, semester: str) -> Optional[str]:
     cur = conn.execute(
-        "SELECT id FROM courses WHERE user_id=? AND course_code=? AND teacher=?",
-        (user_id, course_code, teacher)
+        "SELECT fingerprint FROM timetable_sync_state WHERE user_id = ? AND semester = ?",
+        (user_id, semester)
     )
     row = cur.fetchone()
-    return int(row["id"])
+    return row["fingerprint"] if row else None
 
-def insert_occurrence(conn: sqlite3.Connection, occ: Dict):
+def set_sync_fingerprint(conn: sqlite3.Connection, user_id: int, semester: str, fingerprint: str) -> None:
     conn.execute(
-        """INSERT INTO occurrences
-           (course_id, week, weekday, period_start, period_count, classroom, starts_at, ends_at, single_week, double_week, season, semester, note)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-        (occ["course_id"], occ["week"], occ["weekday"], occ["period_start"], occ["period_count"], occ["classroom"],
-         occ["starts_at"], occ["ends_at"], int(occ.get("single_week", 0)), int(occ.get("double_week", 0)), occ["season"], occ.get("semester"), occ.get("note"))
+        """INSERT INTO timetable_sync_state(user_id, semester, fingerprint, synced_at) VALUES (?, ?, ?, ?)
+           ON CONFLICT(user_id, semester) DO UPDATE SET fingerprint = excluded.fingerprint, synced_at = excluded.synced_at""",
+        (user_id, semester, fingerprint, int(time.time()))
     )
 
-def delete_occurrences_by_semester(conn: sqlite3.Connection, user_id: int, semester: str):
-    conn.execute("""
-        DELETE FROM occurrences
-        WHERE semester = ? AND course_id IN (
-            SELECT id FROM courses WHERE user_id = ?
+def get_sync_fingerprints(conn: sqlite3.Connection, user_id: int, semesters: Iterable[str]) -> Dict[str, str]:
+    semesters = list(semesters)
+    if not semesters:
+        return {}
+    cur = conn.execute(
+        f"SELECT semester, fingerprint FROM timetable_sync_state WHERE user_id = ? AND semester IN ({','.join('?' * len(semesters))})",
+        [user_id, *semesters]
+    )
+    return {r["semester"]: r["fingerprint"] for r in cur}
+
+def get_sync_fingerprints_by_user(conn: sqlite3.Connection, user_ids: Iterable[int], semester: str) -> Dict[int, str]:
+    """多个用户同一学期的同步指纹（全量刷新按批读取）"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    cur = conn.execute(
+        f"SELECT user_id, fingerprint FROM timetable_sync_state WHERE semester = ? AND user_id IN ({','.join('?' * len(user_ids))})",
+        [semester, *user_ids]
+    )
+    return {r["user_id"]: r["fingerprint"] for r in cur}
+
+def count_schedules_by_semester(conn: sqlite3.Connection, user_id: int, semester: str) -> int:
+    cur = conn.execute("SELECT COUNT(*) FROM course_schedules WHERE user_id = ? AND semester = ?", (user_id, semester))
+    return int(cur.fetchone()[0])
+
+# 一条课程安排的自然键（同一学期内）：课程、季节、星期、起始节
+def _schedule_key(row: Tuple) -> Tuple:
+    # row 与 _schedule_row 的列顺序一致
+    return (row[0], row[2], row[3], row[4])
+
+def apply_semester_diff(
+    conn: sqlite3.Connection,
+    user_id: int,
+    semester: str,
+    schedules: Iterable[Dict],
+    fingerprint: str,
+) -> Dict[str, int]:
+    """
+    增量同步一个学期：与库中已有课程安排按自然键比对，只执行必要的 INSERT / UPDATE / DELETE，
+    已存在且内容未变的行保持原 id 不动（展开出的上课记录 id 随之不变）。全部写入与指纹更新在同一个事务内完成。
+    返回 {"added", "changed", "removed", "total"}（均按课程安排计）。
+    """
+    # 先在事务外解析完，缩短持有写锁的时间
+    new_schedules = list(schedules)
+    with transaction(conn):
+        return apply_semester_diff_in_tx(conn, user_id, semester, new_schedules, fingerprint)
+
+def apply_semester_diff_in_tx(
+    conn: sqlite3.Connection,
+    user_id: int,
+    semester: str,
+    schedules: Iterable[Dict],
+    fingerprint: str,
+    cleanup: bool = True,
+) -> Dict[str, int]:
+    """
+    同 apply_semester_diff，但在调用方已开启的事务中执行（用于多个学期合并为一个事务）。
+    cleanup=False 时不清理孤儿课程，由调用方在全部学期写完后统一清理。
+    """
+    new_schedules = list(schedules)
+    course_ids = resolve_course_ids(conn, user_id, _schedule_courses(new_schedules))
+
+    # 已有课程安排：自然键 -> [(id, 行内容)]，用列表兼容同一时段有多条课程安排的情况（如 1-8 周与 10-16 周分开排）
+    existing: Dict[Tuple, List[Tuple[int, Tuple]]] = {}
+    cur = conn.execute(f"""
+        SELECT id, {SCHEDULE_COLUMNS}
+        FROM course_schedules
+        WHERE user_id = ? AND semester = ?
+    """, (user_id, semester))
+    for r in cur:
+        row = tuple(r)[1:]
+        existing.setdefault(_schedule_key(row), []).append((r["id"], row))
+
+    inserts: List[Tuple] = []
+    updates: List[Tuple] = []
+    for sch in new_schedules:
+        row = _schedule_row(course_ids[(sch["course_code"], sch["teacher"])], sch)
+        candidates = existing.get(_schedule_key(row))
+        if not candidates:
+            inserts.append(row)
+            continue
+        # 优先匹配内容完全相同的旧行
+        idx = next((i for i, (_, old) in enumerate(candidates) if old == row), 0)
+        schedule_id, old = candidates.pop(idx)
+        if old != row:
+            updates.append(row + (schedule_id,))
+    removed = [(schedule_id,) for rows in existing.values() for schedule_id, _ in rows]
+
+    if removed:
+        conn.executemany("DELETE FROM course_schedules WHERE id = ?", removed)
+    if updates:
+        conn.executemany(
+            """UPDATE course_schedules SET
+               course_id = ?, semester = ?, season = ?, weekday = ?, period_start = ?, period_count = ?, classroom = ?,
+               single_week = ?, double_week = ?, note = ?, weeks_mask = ?, base_starts_ts = ?, base_ends_ts = ?,
+               first_ts = ?, last_ts = ?
+               WHERE id = ?""",
+            updates
         )
-    """, (semester, user_id))
+    if inserts:
+        conn.executemany(INSERT_SCHEDULE_SQL, (row + (user_id,) for row in inserts))
+    if removed and cleanup:
+        cleanup_orphan_courses(conn, user_id)
+    set_sync_fingerprint(conn, user_id, semester, fingerprint)
+
+    return {"added": len(inserts), "changed": len(updates), "removed": len(removed), "total": len(new_schedules)}
+
+# 读取时按周展开：课程安排行 + 课程字段
+_SELECT_SCHEDULES = f"""SELECT s.id, s.user_id, {SCHEDULE_COLUMNS},
+               c.name AS course_name, c.teacher, c.course_code
+           FROM course_schedules s JOIN courses c ON s.course_id = c.id"""
+
+def expand_schedule(row: Dict, mask: Optional[int] = None) -> Iterator[Dict]:
+    """
+    把一行课程安排展开为各周的上课记录（字段与原 occurrences 行 + 课程名 / 教师 / 课程代码一致），
+    mask 给出时只展开其中的周。id 为 occurrence_id(课程安排 id, 周)。
+    """
+    weeks_mask = row["weeks_mask"] if mask is None else row["weeks_mask"] & mask
+    for week in iter_mask_weeks(weeks_mask):
+        offset = (week - 1) * WEEK_SECONDS
+        starts_at_ts = row["base_starts_ts"] + offset
+        ends_at_ts = row["base_ends_ts"] + offset
+        yield {
+            "id": occurrence_id(row["id"], week),
+            "schedule_id": row["id"],
+            "user_id": row["user_id"],
+            "course_id": row["course_id"],
+            "week": week,
+            "weekday": row["weekday"],
+            "period_start": row["period_start"],
+            "period_count": row["period_count"],
+            "classroom": row["classroom"],
+            "starts_at": format_iso(from_epoch(starts_at_ts)),
+            "ends_at": format_iso(from_epoch(ends_at_ts)),
+            "single_week": row["single_week"],
+            "double_week": row["double_week"],
+            "season": row["season"],
+            "semester": row["semester"],
+            "note": row["note"],
+            "starts_at_ts": starts_at_ts,
+            "ends_at_ts": ends_at_ts,
+            "course_name": row["course_name"],
+            "teacher": row["teacher"],
+            "course_code": row["course_code"],
+        }
+
+def _range_weeks_mask(row: Dict, start_ts: int, end_ts: int) -> int:
+    # 开始不早于 start_ts 且结束不晚于 end_ts 的周：ceil((start_ts - base_starts) / 周) + 1 ~ floor((end_ts - base_ends) / 周) + 1
+    first = -(-(start_ts - row["base_starts_ts"]) // WEEK_SECONDS) + 1
+    last = (end_ts - row["base_ends_ts"]) // WEEK_SECONDS + 1
+    return week_range_mask(first, last)
+
+def query_occurrences_in_range(
+    conn: sqlite3.Connection, user_id: int, start_ts: int, end_ts: int, season: Optional[str] = None
+) -> List[Dict]:
+    """时间范围内（开始 >= start_ts 且结束 <= end_ts）的上课记录，按开始时间排序；课程安排先按 first_ts / last_ts 在索引上筛选再展开"""
+    sql = _SELECT_SCHEDULES + " WHERE s.user_id = ? AND s.last_ts >= ? AND s.first_ts <= ?"
+    params: List = [user_id, start_ts, end_ts]
+    if season:
+        sql += " AND s.season = ?"
+        params.append(season)
+    occurrences = [
+        occ for r in conn.execute(sql, params)
+        for occ in expand_schedule(r, _range_weeks_mask(r, start_ts, end_ts))
+    ]
+    occurrences.sort(key=lambda o: (o["starts_at_ts"], o["id"]))
+    return occurrences
 
-def cleanup_orphan_courses(conn: sqlite3.Connection):
-    conn.execute("DELETE FROM courses WHERE id NOT IN (SELECT DISTINCT course_id FROM occurrences)")
\ No newline at end of file
+def query_occurrences_in_week(
+    conn: sqlite3.Connection, user_id: int, week: int, season: Optional[str] = None, weekday: Optional[int] = None
+) -> List[Dict]:
+    """第 week 周的上课记录，按星期、起始节排序"""
+    if not 1 <= week <= MAX_MASK_WEEK:
+        return []
+    sql = _SELECT_SCHEDULES + " WHERE s.user_id = ? AND (s.weeks_mask >> ?) & 1"
+    params: List = [user_id, week - 1]
+    if season:
+        sql += " AND s.season = ?"
+        params.append(season)
+    if weekday:
+        sql += " AND s.weekday = ?"
+        params.append(weekday)
+    sql += " ORDER BY s.weekday, s.period_start, s.id"
+    week_mask = 1 << (week - 1)
+    return [occ for r in conn.execute(sql, params) for occ in expand_schedule(r, week_mask)]
@@ -0,0 +1,360 @@
+import sqlite3
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+
+from ..utils.datetimes import format_iso, parse_client_datetime, to_epoch
+from ..utils.weekmask import MAX_MASK_WEEK, OCCURRENCE_ID_STRIDE, WEEK_SECONDS
+
+class SchemaVersionError(Exception):
+    pass
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    # SQL 脚本，或接收连接的函数（函数内只能用 conn.execute，不能用 executescript）
+    apply: Union[str, Callable[[sqlite3.Connection], None]]
+
+def _add_epoch_columns(conn: sqlite3.Connection) -> None:
+    """
+    occurrences/events 增加 epoch 秒列，范围查询改用整数比较。
+    occurrences 的时间由程序生成，格式固定，直接用 SQL 回填；
+    events 来自客户端输入，格式不一，逐行规范化文本并计算时间戳（无法解析的保留原样，时间戳为 NULL）。
+    """
+    conn.execute("ALTER TABLE occurrences ADD COLUMN starts_at_ts INTEGER")
+    conn.execute("ALTER TABLE occurrences ADD COLUMN ends_at_ts INTEGER")
+    conn.execute("""
+        UPDATE occurrences SET
+          starts_at_ts = CAST(strftime('%s', starts_at) AS INTEGER),
+          ends_at_ts = CAST(strftime('%s', ends_at) AS INTEGER)
+    """)
+
+    conn.execute("ALTER TABLE events ADD COLUMN start_ts INTEGER")
+    conn.execute("ALTER TABLE events ADD COLUMN end_ts INTEGER")
+    updates = []
+    for event_id, start_time, end_time in conn.execute("SELECT id, start_time, end_time FROM events").fetchall():
+        try:
+            start_dt = parse_client_datetime(start_time)
+            end_dt = parse_client_datetime(end_time)
+        except (TypeError, ValueError):
+            continue
+        updates.append((format_iso(start_dt), format_iso(end_dt), to_epoch(start_dt), to_epoch(end_dt), event_id))
+    conn.executemany(
+        "UPDATE events SET start_time = ?, end_time = ?, start_ts = ?, end_ts = ? WHERE id = ?",
+        updates
+    )
+
+    conn.execute("DROP INDEX IF EXISTS idx_occurrences_user_time")
+    conn.execute("DROP INDEX IF EXISTS idx_events_user_time")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_occurrences_user_ts ON occurrences (user_id, starts_at_ts, ends_at_ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_user_ts ON events (user_id, start_ts, end_ts)")
+
+def _to_course_schedules(conn: sqlite3.Connection) -> None:
+    """
+    occurrences（每周一行）改为 course_schedules（每个课程安排 × 季节一行，周次存为位图）。
+    旧数据按 (课程, 学期, 季节, 星期, 节次, 教室, 单双周, 备注, 第 1 周起止时间) 分组回填，
+    展开后与原有记录逐条一致；v_calendar_events 改为从 course_schedules 按周展开，字段不变。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS course_schedules (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+          course_id INTEGER NOT NULL REFERENCES courses(id) ON DELETE CASCADE,
+          semester TEXT,
+          season TEXT NOT NULL,
+          weekday INTEGER NOT NULL,
+          period_start INTEGER NOT NULL,
+          period_count INTEGER NOT NULL,
+          classroom TEXT NOT NULL,
+          single_week INTEGER DEFAULT 0,
+          double_week INTEGER DEFAULT 0,
+          note TEXT,
+          weeks_mask INTEGER NOT NULL,      -- 第 w 周对应第 w - 1 位
+          base_starts_ts INTEGER NOT NULL,  -- 第 1 周（冬/夏已按 +8 周）的起止 epoch 秒，第 w 周 = base + (w - 1) * 604800
+          base_ends_ts INTEGER NOT NULL,
+          first_ts INTEGER NOT NULL,        -- 第一次上课开始 / 最后一次上课结束，按时间范围筛选用
+          last_ts INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_course_schedules_user_term ON course_schedules (user_id, semester, season)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_course_schedules_user_ts ON course_schedules (user_id, last_ts, first_ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_course_schedules_course ON course_schedules (course_id)")
+
+    groups: Dict[tuple, List[int]] = {}
+    cur = conn.execute("""
+        SELECT user_id, course_id, semester, season, weekday, period_start, period_count, classroom,
+               COALESCE(single_week, 0), COALESCE(double_week, 0), note, week, starts_at_ts, ends_at_ts
+        FROM occurrences
+        WHERE user_id IS NOT NULL AND starts_at_ts IS NOT NULL AND ends_at_ts IS NOT NULL
+        ORDER BY id
+    """)
+    for r in cur:
+        week, starts_at_ts, ends_at_ts = r[11], r[12], r[13]
+        if not 1 <= week <= MAX_MASK_WEEK:
+            continue
+        offset = (week - 1) * WEEK_SECONDS
+        key = tuple(r[:11]) + (starts_at_ts - offset, ends_at_ts - offset)
+        g = groups.get(key)
+        if g is None:
+            groups[key] = [1 << (week - 1), starts_at_ts, ends_at_ts]
+        else:
+            g[0] |= 1 << (week - 1)
+            g[1] = min(g[1], starts_at_ts)
+            g[2] = max(g[2], ends_at_ts)
+    conn.executemany(
+        """INSERT INTO course_schedules
+           (user_id, course_id, semester, season, weekday, period_start, period_count, classroom, single_week, double_week, note,
+            base_starts_ts, base_ends_ts, weeks_mask, first_ts, last_ts)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (key + tuple(g) for key, g in groups.items())
+    )
+
+    conn.execute("DROP VIEW IF EXISTS v_calendar_events")
+    conn.execute("DROP TABLE occurrences")
+    conn.execute(f"""
+        CREATE VIEW IF NOT EXISTS v_calendar_events AS
+        WITH RECURSIVE weeks(week) AS (SELECT 1 UNION ALL SELECT week + 1 FROM weeks WHERE week < {MAX_MASK_WEEK})
+        SELECT
+          s.id * {OCCURRENCE_ID_STRIDE} + w.week AS id,
+          strftime('%Y-%m-%dT%H:%M:%S', s.base_starts_ts + (w.week - 1) * {WEEK_SECONDS}, 'unixepoch') AS starts_at,
+          strftime('%Y-%m-%dT%H:%M:%S', s.base_ends_ts + (w.week - 1) * {WEEK_SECONDS}, 'unixepoch') AS ends_at,
+          w.week,
+          s.weekday,
+          s.period_start,
+          s.period_count,
+          s.classroom,
+          s.season,
+          s.semester,
+          s.single_week,
+          s.double_week,
+          s.note,
+          c.name       AS course_name,
+          c.course_code,
+          c.teacher,
+          c.department
+        FROM course_schedules s
+        JOIN weeks w ON (s.weeks_mask >> (w.week - 1)) & 1
+        JOIN courses c ON s.course_id = c.id
+    """)
+
+# 迁移列表：版本号从 1 开始连续递增。已发布的迁移不能修改，只能追加新的迁移。
+MIGRATIONS: List[Migration] = [
+    Migration(1, "初始表结构", """
+CREATE TABLE IF NOT EXISTS users (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username TEXT NOT NULL UNIQUE,
+  password_encrypted TEXT NOT NULL,
+  wechat_openid TEXT UNIQUE 
+);
+
+CREATE TABLE IF NOT EXISTS courses (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER NOT NULL,
+  course_code TEXT NOT NULL,
+  name TEXT NOT NULL,
+  teacher TEXT NOT NULL,
+  department TEXT,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_courses_code_teacher ON courses (user_id, course_code, teacher);
+
+CREATE TABLE IF NOT EXISTS occurrences (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  course_id INTEGER NOT NULL,
+  week INTEGER NOT NULL,
+  weekday INTEGER NOT NULL,
+  period_start INTEGER NOT NULL,
+  period_count INTEGER NOT NULL,
+  classroom TEXT NOT NULL,
+  starts_at TEXT NOT NULL,
+  ends_at TEXT NOT NULL,
+  single_week INTEGER DEFAULT 0,
+  double_week INTEGER DEFAULT 0,
+  season TEXT NOT NULL,  -- 新增季节标签：春/夏/秋/冬
+  semester TEXT, -- 学期标识，例如 2024-2025-1
+  note TEXT,
+  FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_occurrences_time ON occurrences (starts_at, ends_at);
+CREATE INDEX IF NOT EXISTS idx_occurrences_week_day ON occurrences (week, weekday);
+CREATE INDEX IF NOT EXISTS idx_occurrences_season ON occurrences (season);
+CREATE INDEX IF NOT EXISTS idx_occurrences_semester ON occurrences (semester);
+
+CREATE TABLE IF NOT EXISTS events (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER NOT NULL,
+  title TEXT NOT NULL,
+  start_time TEXT NOT NULL,
+  end_time TEXT NOT NULL,
+  location TEXT,
+  description TEXT,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_events_time ON events (start_time, end_time);
+
+CREATE VIEW IF NOT EXISTS v_calendar_events AS
+SELECT
+  o.id,
+  o.starts_at,
+  o.ends_at,
+  o.week,
+  o.weekday,
+  o.period_start,
+  o.period_count,
+  o.classroom,
+  o.season,
+  o.semester,
+  o.single_week,
+  o.double_week,
+  o.note,
+  c.name       AS course_name,
+  c.course_code,
+  c.teacher,
+  c.department
+FROM occurrences o
+JOIN courses c ON o.course_id = c.id;
+"""),
+    Migration(2, "课表同步指纹", """
+CREATE TABLE IF NOT EXISTS timetable_sync_state (
+  user_id INTEGER NOT NULL,
+  semester TEXT NOT NULL,
+  fingerprint TEXT NOT NULL,  -- 上次同步时 kbList（及学期配置）的哈希
+  synced_at INTEGER NOT NULL, -- epoch 秒
+  PRIMARY KEY (user_id, semester),
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+"""),
+    Migration(3, "occurrences 冗余 user_id 与按用户的复合索引", """
+ALTER TABLE occurrences ADD COLUMN user_id INTEGER REFERENCES users(id) ON DELETE CASCADE;
+UPDATE occurrences SET user_id = (SELECT c.user_id FROM courses c WHERE c.id = occurrences.course_id);
+
+-- 旧索引覆盖全体用户，按用户查询时需扫描大段索引再丢弃其他用户的行
+DROP INDEX IF EXISTS idx_occurrences_time;
+DROP INDEX IF EXISTS idx_occurrences_week_day;
+DROP INDEX IF EXISTS idx_occurrences_season;
+DROP INDEX IF EXISTS idx_occurrences_semester;
+DROP INDEX IF EXISTS idx_events_time;
+
+CREATE INDEX IF NOT EXISTS idx_occurrences_user_time ON occurrences (user_id, starts_at, ends_at);
+CREATE INDEX IF NOT EXISTS idx_occurrences_user_term_week ON occurrences (user_id, semester, season, week);
+-- 外键级联删除与孤立课程清理按 course_id 查找
+CREATE INDEX IF NOT EXISTS idx_occurrences_course ON occurrences (course_id);
+CREATE INDEX IF NOT EXISTS idx_events_user_time ON events (user_id, start_time, end_time);
+"""),
+    Migration(4, "整数时间戳列（epoch 秒）", _add_epoch_columns),
+    Migration(5, "后台课表同步任务", """
+CREATE TABLE IF NOT EXISTS sync_jobs (
+  id TEXT PRIMARY KEY,
+  user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  semester TEXT NOT NULL,
+  status TEXT NOT NULL,        -- queued / running / succeeded / failed
+  stage TEXT NOT NULL,         -- queued / fetching / writing / done
+  result TEXT,                 -- 成功时的同步结果（JSON）
+  error TEXT,
+  created_at INTEGER NOT NULL,
+  started_at INTEGER,
+  finished_at INTEGER
+);
+-- 同一用户同一学期最多一个未完成的任务；重复提交据此挂到已有任务上（多 worker 同样生效）
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sync_jobs_active ON sync_jobs (user_id, semester)
+  WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_sync_jobs_created ON sync_jobs (created_at);
+"""),
+    Migration(6, "全量定时刷新课表", """
+ALTER TABLE users ADD COLUMN last_active_at INTEGER;   -- 最近一次已认证请求（epoch 秒，节流写入）
+
+CREATE TABLE IF NOT EXISTS fleet_refresh_runs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  semester TEXT NOT NULL,
+  status TEXT NOT NULL,          -- running / completed
+  owner TEXT,                    -- 正在执行的进程（主机名:pid）
+  started_at INTEGER NOT NULL,
+  heartbeat_at INTEGER NOT NULL, -- 心跳超时的 run 可被其他进程接手继续
+  finished_at INTEGER
+);
+-- 同一学期同时只有一个进行中的 run
+CREATE UNIQUE INDEX IF NOT EXISTS idx_fleet_runs_active ON fleet_refresh_runs (semester) WHERE status = 'running';
+
+CREATE TABLE IF NOT EXISTS fleet_refresh_items (
+  run_id INTEGER NOT NULL REFERENCES fleet_refresh_runs(id) ON DELETE CASCADE,
+  user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  status TEXT NOT NULL,          -- pending / succeeded / failed
+  changed INTEGER NOT NULL DEFAULT 0,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  error TEXT,
+  finished_at INTEGER,
+  PRIMARY KEY (run_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_fleet_items_status ON fleet_refresh_items (run_id, status);
+"""),
+    Migration(7, "课程安排按周期规则存储（周次位图）", _to_course_schedules),
+    Migration(8, "同步任务记录所属进程", """
+ALTER TABLE sync_jobs ADD COLUMN owner TEXT;   -- 把任务放进内存队列的进程（SyncJobQueue.owner）
+
+-- 运行中的 SyncJobQueue 定期续心跳；心跳超时的进程持有的未完成任务不会再被执行
+CREATE TABLE IF NOT EXISTS sync_job_owners (
+  owner TEXT PRIMARY KEY,
+  heartbeat_at INTEGER NOT NULL
+);
+"""),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+def _split_statements(sql: str) -> List[str]:
+    """按完整语句切分 SQL 脚本，以便在同一个显式事务内逐条执行"""
+    statements: List[str] = []
+    buf = ""
+    for line in sql.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            if buf.strip():
+                statements.append(buf.strip())
+            buf = ""
+    if buf.strip():
+        statements.append(buf.strip())
+    return statements
+
+def migrate(conn: sqlite3.Connection, target: Optional[int] = None) -> int:
+    """
+    将数据库升级到 target 版本（默认最新），返回升级后的版本号。
+    版本号记录在 PRAGMA user_version 中；每个迁移在独立的 BEGIN IMMEDIATE 事务里执行，
+    多个 worker 同时启动时只会有一个真正执行迁移。
+    数据库版本高于代码已知的最新版本时抛出 SchemaVersionError，拒绝启动。
+    """
+    target = LATEST_VERSION if target is None else target
+    current = get_schema_version(conn)
+    if current > LATEST_VERSION:
+        raise SchemaVersionError(
+            f"数据库 schema 版本 {current} 高于代码支持的最新版本 {LATEST_VERSION}，请升级代码后再启动"
+        )
+
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # 由这里显式控制事务
+    try:
+        for m in MIGRATIONS:
+            if m.version <= current or m.version > target:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 拿到写锁后再确认一次，避免与其他进程重复执行
+                current = get_schema_version(conn)
+                if m.version <= current:
+                    conn.execute("ROLLBACK")
+                    continue
+                if isinstance(m.apply, str):
+                    for stmt in _split_statements(m.apply):
+                        conn.execute(stmt)
+                else:
+                    m.apply(conn)
+                conn.execute(f"PRAGMA user_version = {m.version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            current = m.version
+            print(f"[DB] 已应用迁移 v{m.version}: {m.description}")
+    finally:
+        conn.isolation_level = isolation_level
+    return current
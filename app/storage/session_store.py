@@ -1,25 +1,283 @@
-from dataclasses import dataclass
-from typing import Dict, Optional
+import abc
+import asyncio
+import sqlite3
+import threading
 import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from ..config import settings
+from .db import get_conn
 
 @dataclass
 class Entry:
     value: str
     exp: int  # epoch seconds
 
-_store: Dict[str, Entry] = {}
+class SessionStore(abc.ABC):
+    """
+    会话存储接口：按 (namespace, key) 保存带过期时间的字符串。
+    过期条目读取时视为不存在，由后台清理任务（sweep）统一删除；
+    条目总数超过 max_entries 时按最近访问时间淘汰（LRU）。
+    """
+
+    @abc.abstractmethod
+    def get(self, ns: str, key: str) -> Optional[str]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, ns: str, key: str, value: str, ttl_seconds: int) -> None:
+        ...
+
+    @abc.abstractmethod
+    def delete(self, ns: str, key: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def ttl(self, ns: str, key: str) -> Optional[int]:
+        """剩余有效秒数；不存在或已过期返回 None（不更新访问时间）"""
+
+    @abc.abstractmethod
+    def sweep(self) -> int:
+        """删除所有过期条目并执行容量上限，返回删除的条目数"""
+
+    def close(self) -> None:
+        pass
+
+    # 异步接口（请求路径使用）：默认在线程池中执行，磁盘 I/O 不阻塞事件循环
+    async def aget(self, ns: str, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.get, ns, key)
+
+    async def aset(self, ns: str, key: str, value: str, ttl_seconds: int) -> None:
+        await asyncio.to_thread(self.set, ns, key, value, ttl_seconds)
+
+    async def adelete(self, ns: str, key: str) -> None:
+        await asyncio.to_thread(self.delete, ns, key)
+
+    async def attl(self, ns: str, key: str) -> Optional[int]:
+        return await asyncio.to_thread(self.ttl, ns, key)
+
+class MemorySessionStore(SessionStore):
+    """进程内存储：仅适用于单 worker 部署，多 worker 时每个进程各有一份"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Tuple[str, str], Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        with self._lock:
+            e = self._data.get((ns, key))
+            if not e:
+                return None
+            if e.exp < time.time():
+                del self._data[(ns, key)]
+                return None
+            self._data.move_to_end((ns, key))
+            return e.value
+
+    def set(self, ns: str, key: str, value: str, ttl_seconds: int) -> None:
+        with self._lock:
+            self._data[(ns, key)] = Entry(value, int(time.time()) + ttl_seconds)
+            self._data.move_to_end((ns, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, ns: str, key: str) -> None:
+        with self._lock:
+            self._data.pop((ns, key), None)
+
+    def ttl(self, ns: str, key: str) -> Optional[int]:
+        with self._lock:
+            e = self._data.get((ns, key))
+        if not e:
+            return None
+        remaining = e.exp - int(time.time())
+        return remaining if remaining >= 0 else None
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [k for k, e in self._data.items() if e.exp < now]
+            for k in expired:
+                del self._data[k]
+        return len(expired)
+
+    # 纯内存操作，直接在事件循环中执行，省去线程切换
+    async def aget(self, ns: str, key: str) -> Optional[str]:
+        return self.get(ns, key)
+
+    async def aset(self, ns: str, key: str, value: str, ttl_seconds: int) -> None:
+        self.set(ns, key, value, ttl_seconds)
+
+    async def adelete(self, ns: str, key: str) -> None:
+        self.delete(ns, key)
+
+    async def attl(self, ns: str, key: str) -> Optional[int]:
+        return self.ttl(ns, key)
+
+class SqliteSessionStore(SessionStore):
+    """
+    基于独立 SQLite 文件的共享存储：同一台机器上的多个 uvicorn worker 共用一份会话，
+    用户落到任意 worker 都能复用已有的 SSO Cookie，不必重新登录统一认证。
+    """
+
+    # last_access 只在超过该间隔后才回写，避免每次读取都产生一次写事务
+    TOUCH_INTERVAL = 60
+    # 每写入这么多次检查一次容量上限
+    TRIM_EVERY = 64
+
+    def __init__(self, db_path: str, max_entries: int = 10000, busy_timeout_ms: int = 5000):
+        self.max_entries = max_entries
+        self._conn = get_conn(db_path, busy_timeout_ms=busy_timeout_ms, cache_size_kb=2048, cached_statements=32)
+        # 自动提交：每条语句各自成事务，不在进程间长时间持有写锁
+        self._conn.isolation_level = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn.executescript("""
+        CREATE TABLE IF NOT EXISTS sessions (
+          ns TEXT NOT NULL,
+          key TEXT NOT NULL,
+          value TEXT NOT NULL,
+          expires_at INTEGER NOT NULL,
+          last_access INTEGER NOT NULL,
+          PRIMARY KEY (ns, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at);
+        CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions(last_access);
+        """)
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        now = int(time.time())
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, last_access FROM sessions WHERE ns = ? AND key = ?",
+                (ns, key),
+            ).fetchone()
+            if not row or row["expires_at"] < now:
+                return None
+            if now - row["last_access"] >= self.TOUCH_INTERVAL:
+                self._conn.execute(
+                    "UPDATE sessions SET last_access = ? WHERE ns = ? AND key = ?",
+                    (now, ns, key),
+                )
+            return row["value"]
+
+    def set(self, ns: str, key: str, value: str, ttl_seconds: int) -> None:
+        now = int(time.time())
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO sessions(ns, key, value, expires_at, last_access) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(ns, key) DO UPDATE SET
+                     value = excluded.value, expires_at = excluded.expires_at, last_access = excluded.last_access""",
+                (ns, key, value, now + ttl_seconds, now),
+            )
+            self._writes += 1
+            if self._writes % self.TRIM_EVERY == 0:
+                self._trim()
+
+    def delete(self, ns: str, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE ns = ? AND key = ?", (ns, key))
+
+    def ttl(self, ns: str, key: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at FROM sessions WHERE ns = ? AND key = ?", (ns, key)
+            ).fetchone()
+        if not row:
+            return None
+        remaining = row["expires_at"] - int(time.time())
+        return remaining if remaining >= 0 else None
+
+    def sweep(self) -> int:
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM sessions WHERE expires_at < ?", (int(time.time()),)
+            ).rowcount
+            return removed + self._trim()
+
+    def _trim(self) -> int:
+        """超出容量时删除最久未访问的条目（调用方需持有锁）"""
+        total = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        excess = total - self.max_entries
+        if excess <= 0:
+            return 0
+        return self._conn.execute(
+            """DELETE FROM sessions WHERE (ns, key) IN (
+                 SELECT ns, key FROM sessions ORDER BY last_access LIMIT ?)""",
+            (excess,),
+        ).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# 各存储实例的 (SQLite 文件, 容量上限)：每个实例单独按 LRU 淘汰，互不挤占
+SESSION_STORE = "session"
+TIMETABLE_CACHE_STORE = "timetable_cache"
+
+def _store_config(name: str) -> Tuple[str, int]:
+    if name == SESSION_STORE:
+        return settings.SESSION_DB_PATH, settings.SESSION_MAX_ENTRIES
+    if name == TIMETABLE_CACHE_STORE:
+        return settings.TIMETABLE_CACHE_DB_PATH, settings.TIMETABLE_CACHE_MAX_ENTRIES
+    raise ValueError(f"未知的存储: {name}")
+
+def create_store(name: str = SESSION_STORE) -> SessionStore:
+    """按配置创建存储后端"""
+    db_path, max_entries = _store_config(name)
+    backend = settings.SESSION_BACKEND
+    if backend == "memory":
+        return MemorySessionStore(max_entries=max_entries)
+    if backend == "sqlite":
+        return SqliteSessionStore(db_path, max_entries=max_entries, busy_timeout_ms=settings.DB_BUSY_TIMEOUT_MS)
+    raise ValueError(f"未知的 SESSION_BACKEND: {backend}")
+
+_stores: Dict[str, SessionStore] = {}
+_store_lock = threading.Lock()
+
+def get_store(name: str = SESSION_STORE) -> SessionStore:
+    """当前进程使用的存储（默认为会话存储）；首次访问时按配置创建"""
+    store = _stores.get(name)
+    if store is None:
+        with _store_lock:
+            store = _stores.get(name)
+            if store is None:
+                store = _stores[name] = create_store(name)
+    return store
+
+def close_store() -> None:
+    """关闭当前进程打开的全部存储"""
+    with _store_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+async def run_sweeper(interval_seconds: float) -> None:
+    """后台定期清理过期会话（由 lifespan 启动，关闭时取消）"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            removed = 0
+            for store in list(_stores.values()):
+                removed += await asyncio.to_thread(store.sweep)
+            if removed:
+                print(f"[Session] 已清理 {removed} 条过期/超额会话")
+        except sqlite3.Error as e:
+            print(f"[Session] 清理会话失败: {e}")
+
+SSO_NS = "sso"
+
+async def set_sso(username: str, cookie: str, ttl_seconds: int = 3300) -> None:
+    await get_store().aset(SSO_NS, username, cookie, ttl_seconds)
 
-def set_sso(username: str, cookie: str, ttl_seconds: int = 3300) -> None:
-    _store[username] = Entry(cookie, int(time.time()) + ttl_seconds)
+async def get_sso(username: str) -> Optional[str]:
+    return await get_store().aget(SSO_NS, username)
 
-def get_sso(username: str) -> Optional[str]:
-    e = _store.get(username)
-    if not e:
-        return None
-    if e.exp < time.time():
-        _store.pop(username, None)
-        return None
-    return e.value
+async def clear_sso(username: str) -> None:
+    await get_store().adelete(SSO_NS, username)
 
-def clear_sso(username: str) -> None:
-    _store.pop(username, None)
\ No newline at end of file
+async def sso_ttl(username: str) -> Optional[int]:
+    return await get_store().attl(SSO_NS, username)
@@ -0,0 +1,48 @@
+import calendar
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Union
+
+# 库中时间统一为“北京时间墙上时间”（无时区的 ISO 文本）；
+# 带时区的输入先换算到 UTC+8 再去掉时区信息
+LOCAL_TZ = timezone(timedelta(hours=8))
+
+def to_epoch(dt: datetime) -> int:
+    """
+    无时区的墙上时间 -> 整数秒。按 UTC 解释，
+    与 SQLite 的 strftime('%s', ...) 一致，便于迁移回填与 SQL 比较。
+    """
+    return calendar.timegm(dt.timetuple())
+
+def from_epoch(ts: int) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(seconds=ts)
+
+def iso_to_epoch(s: str) -> int:
+    return to_epoch(datetime.fromisoformat(s))
+
+def format_iso(dt: datetime) -> str:
+    """规范格式：YYYY-MM-DDTHH:MM:SS"""
+    return dt.isoformat(timespec="seconds")
+
+def parse_client_datetime(value: Union[str, date, datetime], end_of_day: bool = False) -> datetime:
+    """
+    解析客户端传入的时间，返回无时区、精确到秒的 datetime。
+    接受：YYYY-MM-DD、YYYY-MM-DDTHH:MM[:SS[.ffffff]]、空格分隔、末尾 Z 或 ±HH:MM 偏移。
+    仅有日期时，end_of_day=True 取当天 23:59:59，否则取 00:00:00。
+    无法解析时抛出 ValueError。
+    """
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, date):
+        dt = datetime.combine(value, time(23, 59, 59) if end_of_day else time(0, 0, 0))
+    else:
+        s = value.strip()
+        if not s:
+            raise ValueError("时间不能为空")
+        if s.endswith(("Z", "z")):
+            s = s[:-1] + "+00:00"
+        dt = datetime.fromisoformat(s)
+        if len(s) == 10 and end_of_day:  # 只有日期
+            dt = datetime.combine(dt.date(), time(23, 59, 59))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(LOCAL_TZ).replace(tzinfo=None)
+    return dt.replace(microsecond=0)
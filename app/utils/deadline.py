@@ -0,0 +1,18 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# 当前请求的截止时刻（time.monotonic()）；由路由级依赖设置，未设置时为 None
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+def set_deadline(seconds: float) -> None:
+    """为当前请求（当前任务上下文）设置从现在起 seconds 秒的截止时刻"""
+    _deadline.set(time.monotonic() + seconds)
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """距截止时刻的剩余秒数（可能为负）；未设置截止时刻时返回 default"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    left = deadline - time.monotonic()
+    return left if default is None else min(default, left)
@@ -0,0 +1,32 @@
+from typing import Iterable, Iterator
+
+# 周次位图：第 w 周对应第 w - 1 位。SQLite 整数为 64 位有符号数，最多表示到第 63 周
+MAX_MASK_WEEK = 63
+WEEK_SECONDS = 7 * 86400
+
+# 展开出的上课记录没有独立的行，id 由课程安排 id 与周次合成：schedule_id * 64 + week
+OCCURRENCE_ID_STRIDE = 64
+
+def weeks_to_mask(weeks: Iterable[int]) -> int:
+    mask = 0
+    for w in weeks:
+        mask |= 1 << (w - 1)
+    return mask
+
+def iter_mask_weeks(mask: int) -> Iterator[int]:
+    """按从小到大的顺序产出位图中的周次"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length()
+        mask ^= low
+
+def week_range_mask(first: int, last: int) -> int:
+    """第 first ~ last 周（含两端）的位图；first > last 时为 0"""
+    first = max(first, 1)
+    last = min(last, MAX_MASK_WEEK)
+    if first > last:
+        return 0
+    return ((1 << last) - 1) & ~((1 << (first - 1)) - 1)
+
+def occurrence_id(schedule_id: int, week: int) -> int:
+    return schedule_id * OCCURRENCE_ID_STRIDE + week
@@ -0,0 +1,97 @@
+"""
+kbList 提取：旧的非贪婪正则 vs 整体 JSON 解析（标准库 / orjson）vs 定位后只解码 kbList 数组。
+
+先用几种变形的响应检查正确性（键顺序变化、条目内出现 ],"xh"、带空白的格式化输出），
+再在不同大小的合成响应上比较每次提取的耗时。
+
+用法：
+    python -m benchmarks.bench_kblist_extract --rounds 200
+"""
+import argparse
+import json
+import re
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from app.services import timetable
+from app.services.timetable import _decode_kblist_at_key, extract_kblist
+from benchmarks.fixtures import make_kbcx_response
+
+LEGACY_RE = r'(?<="kbList":)\[(.*?)\](?=,"xh")'
+
+def legacy(raw: str):
+    m = re.search(LEGACY_RE, raw)
+    return json.loads(m.group(0)) if m else None
+
+def full_stdlib(raw: str):
+    return json.loads(raw).get("kbList")
+
+def full_orjson(raw: str):
+    return timetable.orjson.loads(raw).get("kbList")
+
+def dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def variants() -> Dict[str, tuple]:
+    base = make_kbcx_response(30, seed=1)
+    reordered = {"xh": base["xh"], **{k: v for k, v in base.items() if k != "xh"}}
+    tricky = json.loads(dumps(base))
+    # 条目里的数组字段后面紧跟 "xh" 键：旧正则会在这里提前截断
+    tricky["kbList"][3]["zcdList"] = [1, 2, 3]
+    tricky["kbList"][3]["xh"] = "3200100000"
+    tricky["kbList"][3] = {k: tricky["kbList"][3][k] for k in ["kcb", "zcdList", "xh"] + list(tricky["kbList"][3])[:-2] if k in tricky["kbList"][3]}
+    return {
+        "标准": (dumps(base), base["kbList"]),
+        "键顺序变化": (dumps(reordered), base["kbList"]),
+        '条目含 ],"xh"': (dumps(tricky), tricky["kbList"]),
+        "格式化输出": (json.dumps(base, ensure_ascii=False, indent=2), base["kbList"]),
+        "响应被截断": (dumps(base)[:-40], base["kbList"]),
+    }
+
+def check(methods: Dict[str, Callable]) -> None:
+    print("正确性（✓ 结果与原 kbList 一致，✗ 不一致或失败）")
+    for name, (raw, expected) in variants().items():
+        row = []
+        for mname, fn in methods.items():
+            try:
+                ok = fn(raw) == expected
+            except Exception:
+                ok = False
+            row.append(f"{mname}={'✓' if ok else '✗'}")
+        print(f"  {name:<10} " + "  ".join(row))
+
+def bench(fn: Callable, raw: str, rounds: int) -> List[float]:
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn(raw)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="kbList 提取方式的正确性与耗时对比")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    methods: Dict[str, Callable] = {"regex": legacy, "json": full_stdlib}
+    if timetable.orjson is not None:
+        methods["orjson"] = full_orjson
+    methods["at_key"] = _decode_kblist_at_key
+    methods["extract"] = extract_kblist
+    check(methods)
+
+    # (条目数, 其余字段 KB)：普通学生、课多的学生、带大量附加字段的响应
+    sizes = [(30, 40), (80, 200), (200, 2000), (500, 8000)]
+    print("\n耗时（毫秒，p50 / p99）")
+    for n_items, extra_kb in sizes:
+        raw = dumps(make_kbcx_response(n_items, seed=7, extra_kb=extra_kb))
+        rounds = max(10, args.rounds * 40 // max(40, extra_kb))
+        cols = []
+        for mname, fn in methods.items():
+            s = sorted(bench(fn, raw, rounds))
+            cols.append(f"{mname} {statistics.median(s):.3f}/{s[int(len(s) * 0.99) - 1]:.3f}")
+        print(f"  {n_items:>3} 条 / {len(raw) // 1024:>5} KB:  " + "  ".join(cols))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+kcb 解析微基准：模拟全量刷新时的语料——大量学生选了同一批教学班，kcb 文本大量重复。
+
+对比三种方式逐条规整 kbList（iter_kblist_entries，不含按周展开）的总耗时：
+  - legacy：改造前的实现（每次调用 re 模块按字符串查找模式，无缓存）
+  - compiled：预编译模式，不使用缓存
+  - cached：预编译模式 + 按 kcb 文本的 LRU（从空缓存开始）
+并检查三者结果一致。
+
+用法：
+    python -m benchmarks.bench_kcb_parse --users 2000 --sections 600 --per-user 30
+"""
+import argparse
+import html
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+from app.services import timetable
+from benchmarks.fixtures import make_kblist
+
+TERM = "2025-2026-1"
+
+def legacy_parse_kcb_fields(kcb: str) -> dict:
+    text = html.unescape(kcb.replace("<br>", "\n"))
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    course_name = lines[0] if lines else ""
+    term_text = ""
+    weeks_spec = ""
+    period_count: Optional[int] = None
+    week_flag: Optional[str] = None
+    teachers = ""
+    classroom = ""
+    extra_date_range = None
+    if len(lines) >= 2:
+        term_text = lines[1]
+        m = re.search(r"\{(.*?)\}", term_text)
+        if m:
+            inside = m.group(1)
+            mw = re.search(r"(第[\d\-，,]+周)", inside)
+            if mw:
+                weeks_spec = mw.group(1)
+            mc = re.search(r"(\d+)节", inside)
+            if mc:
+                period_count = int(mc.group(1))
+            if "单周" in inside:
+                week_flag = "单周"
+            elif "双周" in inside:
+                week_flag = "双周"
+    if len(lines) >= 3:
+        teachers = lines[2]
+    if len(lines) >= 4:
+        classroom_line = lines[3]
+        md = re.search(r"(\d{4}年\d{2}月\d{2}日\(\d{2}:\d{2}-\d{2}:\d{2}\))", classroom_line)
+        if md:
+            extra_date_range = md.group(1)
+            classroom = classroom_line[:md.start()].strip()
+        else:
+            classroom = classroom_line.strip()
+        classroom = re.sub(r"(zwf)+$", "", classroom).strip()
+    return {"course_name": course_name, "term_text": term_text, "weeks_spec": weeks_spec, "period_count": period_count,
+            "week_flag": week_flag, "teachers": teachers, "classroom": classroom, "extra_date_range": extra_date_range}
+
+def legacy_normalize_weeks(weeks_spec: str, week_flag: Optional[str]) -> List[int]:
+    if not weeks_spec:
+        return []
+    s = weeks_spec.replace("第", "").replace("周", "")
+    weeks: List[int] = []
+    for part in re.split(r"[，,]", s):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            a, b = part.split("-")
+            weeks.extend(range(int(a), int(b) + 1))
+        else:
+            weeks.append(int(part))
+    weeks = sorted(set(weeks))
+    if week_flag == "双周":
+        weeks = [w for w in weeks if w % 2 == 0]
+    if week_flag == "单周":
+        weeks = [w for w in weeks if w % 2 == 1]
+    return weeks
+
+def make_corpus(users: int, sections: int, per_user: int) -> List[List[Dict]]:
+    """每个教学班一条 kbList 条目；每个学生从中选 per_user 个（热门教学班被更多人选）"""
+    pool = make_kblist(sections, seed=42, term=TERM)
+    rnd = random.Random(7)
+    weights = [1 / (i + 1) ** 0.8 for i in range(sections)]
+    corpus = []
+    for _ in range(users):
+        picked = {id(e): e for e in rnd.choices(pool, weights=weights, k=per_user)}
+        corpus.append([dict(e) for e in picked.values()])
+    return corpus
+
+def run(corpus, parse, weeks) -> tuple:
+    orig = (timetable._parse_kcb_cached, timetable.normalize_weeks)
+    timetable._parse_kcb_cached, timetable.normalize_weeks = parse, weeks
+    try:
+        t0 = time.perf_counter()
+        out = [list(timetable.iter_kblist_entries(kb)) for kb in corpus]
+        return time.perf_counter() - t0, out
+    finally:
+        timetable._parse_kcb_cached, timetable.normalize_weeks = orig
+
+def main():
+    parser = argparse.ArgumentParser(description="kcb 解析：无缓存 vs 预编译 vs 预编译 + LRU")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--sections", type=int, default=600)
+    parser.add_argument("--per-user", type=int, default=30)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.users, args.sections, args.per_user)
+    items = sum(len(kb) for kb in corpus)
+    distinct = len({e["kcb"] for kb in corpus for e in kb})
+    print(f"语料：{args.users} 名学生，{items} 条 kbList 条目，其中不同的 kcb 文本 {distinct} 种")
+
+    compiled_weeks = lambda spec, flag: list(timetable._normalize_weeks_cached.__wrapped__(spec, flag))
+    variants = {
+        "legacy": (legacy_parse_kcb_fields, legacy_normalize_weeks),
+        "compiled": (timetable._parse_kcb_cached.__wrapped__, compiled_weeks),
+        "cached": (timetable._parse_kcb_cached, timetable.normalize_weeks),
+    }
+    timetable._parse_kcb_cached.cache_clear()
+    timetable._normalize_weeks_cached.cache_clear()
+
+    results = {}
+    for name, (parse, weeks) in variants.items():
+        elapsed, results[name] = run(corpus, parse, weeks)
+        print(f"  {name:<9} {elapsed * 1000:8.1f} ms   {items / elapsed / 1000:7.1f} 千条/秒")
+    same = results["legacy"] == results["compiled"] == results["cached"]
+    print(f"结果一致: {same}")
+    print(f"缓存: {timetable.kcb_cache_stats()}")
+
+if __name__ == "__main__":
+    main()
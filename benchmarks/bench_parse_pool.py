@@ -0,0 +1,74 @@
+"""
+解析阶段对事件循环的影响：大批量解析 kbList 时，在本进程线程中解析（改造前）vs 交给解析子进程（ParsePool）。
+
+模拟全量刷新：同时有 --concurrency 个用户在解析，共 --users 个用户；
+另有一个每 10ms 唤醒一次的协程代表 Web 请求，测得的额外延迟即事件循环被 GIL 争抢拖慢的时间。
+
+用法：
+    python -m benchmarks.bench_parse_pool --users 2000 --concurrency 8 --workers 4
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+from app.services.parse_pool import ParsePool
+from benchmarks.fixtures import make_kblist
+
+TERM = "2025-2026-1"
+TICK = 0.01
+
+async def ticker(stop: asyncio.Event, samples: List[float]):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(TICK)
+        samples.append((time.perf_counter() - t0 - TICK) * 1000)
+
+async def run_mode(pool: ParsePool, pooled: bool, kb_variants, users: int, concurrency: int):
+    queue = list(range(users))
+    parsed = [0]
+
+    async def worker():
+        while queue:
+            u = queue.pop()
+            plans = await pool.plan([(TERM, kb_variants[u % len(kb_variants)], None)], pooled=pooled)
+            parsed[0] += len(plans[0][1])
+
+    stop = asyncio.Event()
+    samples: List[float] = []
+    tick = asyncio.create_task(ticker(stop, samples))
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await tick
+    samples.sort()
+    return elapsed, parsed[0], samples
+
+def pct(samples: List[float], p: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0.0
+
+async def main_async(args):
+    kb_variants = [make_kblist(args.per_user, seed, TERM) for seed in range(200)]
+    pool = ParsePool(args.workers, min_batch=1)
+    try:
+        # 预热：启动子进程，不计入
+        await asyncio.gather(*(pool.plan([(TERM, kb_variants[i], None)]) for i in range(args.workers * 2)))
+        for label, pooled in (("本进程线程", False), (f"解析子进程 ×{args.workers}", True)):
+            elapsed, parsed, samples = await run_mode(pool, pooled, kb_variants, args.users, args.concurrency)
+            print(f"{label:<14} {elapsed:6.2f} s  {args.users / elapsed:7.0f} 人/秒  {parsed} 条记录  "
+                  f"事件循环延迟 p50 {pct(samples, 0.5):6.2f} ms  p99 {pct(samples, 0.99):6.2f} ms  max {samples[-1] if samples else 0:6.2f} ms")
+    finally:
+        pool.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="kbList 解析：本进程线程 vs 解析子进程")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--per-user", type=int, default=30, help="每名学生的 kbList 条目数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时解析的用户数")
+    parser.add_argument("--workers", type=int, default=4, help="解析子进程数")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
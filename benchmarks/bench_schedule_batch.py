@@ -0,0 +1,94 @@
+"""
+课程安排换算：全量刷新时逐用户 parse_kblist_to_schedules（改造前）vs 按批 build_schedules_batch。
+
+按批换算与全量刷新相同，每 --batch-size 个用户一批，分纯 Python 与 NumPy 两种实现（未安装 numpy 时跳过后者）。
+每种规模先逐用户比对结果完全一致，再计时两项：
+- 完整解析：kbList -> 课程安排（含 iter_kblist_entries 的规整，两种方式相同）
+- 仅换算：规整后的课程安排 -> course_schedules 的周期规则（批量化实际替换的部分）
+
+用法：
+    python -m benchmarks.bench_schedule_batch --users 1000 10000
+"""
+import argparse
+import gc
+import time
+
+from app.config import settings
+from app.services.timetable import entry_schedules, iter_kblist_entries, parse_kblist_to_schedules
+from app.services.timetable_batch import build_schedules_batch, np
+from benchmarks.fixtures import make_kblist
+
+TERM = "2025-2026-1"
+
+def chunks(items, size: int):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def best_of(rounds: int, fn, *args) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="课程安排换算：逐用户 vs 按批（纯 Python / NumPy）")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--per-user", type=int, default=30, help="每名学生的 kbList 条目数")
+    parser.add_argument("--batch-size", type=int, default=settings.FLEET_REFRESH_BATCH_SIZE)
+    parser.add_argument("--rounds", type=int, default=3, help="每种实现重复次数，取最快一次")
+    args = parser.parse_args()
+
+    def parse_per_user(kb_lists):
+        return [parse_kblist_to_schedules(kb_list) for kb_list in kb_lists]
+
+    def convert_per_user(entry_lists):
+        return [[s for entry in entries for s in entry_schedules(entry)] for entries in entry_lists]
+
+    def parse_batched(use_numpy: bool):
+        def run(kb_lists):
+            out = []
+            for chunk in chunks(kb_lists, args.batch_size):
+                out.extend(build_schedules_batch([list(iter_kblist_entries(kb)) for kb in chunk], use_numpy=use_numpy))
+            return out
+        return run
+
+    def convert_batched(use_numpy: bool):
+        def run(entry_lists):
+            out = []
+            for chunk in chunks(entry_lists, args.batch_size):
+                out.extend(build_schedules_batch(chunk, use_numpy=use_numpy))
+            return out
+        return run
+
+    modes = [("逐用户", parse_per_user, convert_per_user),
+             ("按批 纯 Python", parse_batched(False), convert_batched(False))]
+    if np is not None:
+        modes.append(("按批 NumPy", parse_batched(True), convert_batched(True)))
+    else:
+        print("未安装 numpy，跳过按批 NumPy")
+
+    for users in args.users:
+        kb_lists = [make_kblist(args.per_user, seed, TERM) for seed in range(users)]
+        entry_lists = [list(iter_kblist_entries(kb_list)) for kb_list in kb_lists]
+        expected = parse_per_user(kb_lists)
+        for label, parse, convert in modes[1:]:
+            if parse(kb_lists) != expected or convert(entry_lists) != expected:
+                raise SystemExit(f"{label} 的结果与逐用户换算不一致")
+        rows = sum(len(s) for s in expected)
+        # 合成数据移出 GC 跟踪：否则每次回收都要扫描上万名学生的数据，而实际刷新时一批只有几十人
+        del expected
+        gc.collect()
+        gc.freeze()
+        print(f"{users} 名学生，{rows} 条课程安排，每批 {args.batch_size} 人（结果一致）")
+        base_parse = base_convert = None
+        for label, parse, convert in modes:
+            t_parse = best_of(args.rounds, parse, kb_lists)
+            t_convert = best_of(args.rounds, convert, entry_lists)
+            base_parse, base_convert = base_parse or t_parse, base_convert or t_convert
+            print(f"  {label:<14} 完整解析 {t_parse * 1000:8.1f} ms（×{base_parse / t_parse:.2f}）  "
+                  f"仅换算 {t_convert * 1000:8.1f} ms（×{base_convert / t_convert:.2f}）")
+        gc.unfreeze()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+课表存储体积：每周一行的 occurrences（迁移 v6）vs 周次位图的 course_schedules（迁移 v7）。
+
+同一批学生的课表分别写入两种结构，比较行数、写入耗时与 VACUUM 后的数据库大小；
+随后把 v6 的库迁移到 v7，检查回填出的课程安排与直接同步写入的一致。
+
+用法：
+    python -m benchmarks.bench_schedule_storage --users 2000
+"""
+import argparse
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from app.services.term_calendar import get_term_calendar
+from app.services.timetable import iter_kblist_entries, iter_kblist_schedules, kblist_fingerprint
+from app.storage.db import apply_semester_diff, get_conn, resolve_course_ids
+from app.storage.migrations import migrate
+from benchmarks.fixtures import make_kblist
+
+TERM = "2025-2026-1"
+
+def add_users(conn: sqlite3.Connection, users: int):
+    conn.executemany("INSERT INTO users(id, username, password_encrypted) VALUES (?, ?, 'x')",
+                     ((u, f"u{u}") for u in range(1, users + 1)))
+    conn.commit()
+
+def legacy_occurrences(kb_list) -> list:
+    # 迁移 v6 时的展开方式：每周每个季节一条上课记录（冬/夏的日期按 +8 周）
+    occs = []
+    for e in iter_kblist_entries(kb_list):
+        if not e["weeks"] or not e["seasons"]:
+            continue
+        calendar = get_term_calendar(e["semester"])
+        for season in e["seasons"]:
+            offset = 8 if season in ("冬", "夏") else 0
+            for w in e["weeks"]:
+                starts_at, ends_at, starts_at_ts, ends_at_ts = calendar.slot(
+                    w + offset, e["weekday"], e["period_start"], e["period_count"])
+                occs.append(dict(e, week=w, season=season, starts_at=starts_at, ends_at=ends_at,
+                                 starts_at_ts=starts_at_ts, ends_at_ts=ends_at_ts))
+    return occs
+
+def write_occurrences(conn: sqlite3.Connection, kb_lists) -> int:
+    # 迁移 v6 时的写法：每周每个季节一行
+    rows = 0
+    for uid, kb_list in kb_lists:
+        occs = legacy_occurrences(kb_list)
+        ids = resolve_course_ids(conn, uid, {(o["course_code"], o["course_name"], o["teacher"]) for o in occs})
+        conn.executemany(
+            """INSERT INTO occurrences(course_id, week, weekday, period_start, period_count, classroom, starts_at, ends_at,
+                                       single_week, double_week, season, semester, note, starts_at_ts, ends_at_ts, user_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [(ids[(o["course_code"], o["teacher"])], o["week"], o["weekday"], o["period_start"], o["period_count"], o["classroom"],
+              o["starts_at"], o["ends_at"], int(o["single_week"]), int(o["double_week"]), o["season"], o["semester"], o["note"],
+              o["starts_at_ts"], o["ends_at_ts"], uid) for o in occs],
+        )
+        conn.commit()
+        rows += len(occs)
+    return rows
+
+def write_schedules(conn: sqlite3.Connection, kb_lists) -> int:
+    # 与 /timetable/sync 相同的写入路径（首次同步时全部为新增）
+    return sum(
+        apply_semester_diff(conn, uid, TERM, iter_kblist_schedules(kb_list), kblist_fingerprint(kb_list, TERM))["total"]
+        for uid, kb_list in kb_lists
+    )
+
+def db_size(conn: sqlite3.Connection) -> int:
+    conn.execute("VACUUM")
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+def table_size(conn: sqlite3.Connection, table: str) -> int:
+    """表及其索引占用的字节数（需要 SQLite 编译时启用 dbstat，不可用时返回 0）"""
+    try:
+        row = conn.execute(
+            """SELECT SUM(d.pgsize) FROM dbstat d JOIN sqlite_master m ON d.name = m.name
+               WHERE m.tbl_name = ?""", (table,)).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+def dump_schedules(conn: sqlite3.Connection):
+    return sorted(tuple(r) for r in conn.execute(
+        """SELECT s.user_id, c.course_code, s.season, s.weekday, s.period_start, s.period_count, s.classroom,
+                  s.single_week, s.double_week, s.weeks_mask, s.base_starts_ts, s.base_ends_ts, s.first_ts, s.last_ts
+           FROM course_schedules s JOIN courses c ON s.course_id = c.id"""))
+
+def main():
+    parser = argparse.ArgumentParser(description="occurrences vs course_schedules 存储体积")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--per-user", type=int, default=30, help="每名学生的 kbList 条目数")
+    args = parser.parse_args()
+
+    kb_lists = [(u, make_kblist(args.per_user, u % 200, TERM)) for u in range(1, args.users + 1)]
+    with tempfile.TemporaryDirectory() as tmp:
+        old = get_conn(str(Path(tmp) / "v6.db"))
+        migrate(old, target=6)
+        add_users(old, args.users)
+        t0 = time.perf_counter()
+        old_rows = write_occurrences(old, kb_lists)
+        t_old = time.perf_counter() - t0
+        old_size = db_size(old)
+        old_table = table_size(old, "occurrences")
+
+        new = get_conn(str(Path(tmp) / "v7.db"))
+        migrate(new)
+        add_users(new, args.users)
+        t0 = time.perf_counter()
+        new_rows = write_schedules(new, kb_lists)
+        t_new = time.perf_counter() - t0
+        new_size = db_size(new)
+        new_table = table_size(new, "course_schedules")
+
+        t0 = time.perf_counter()
+        migrate(old)
+        t_migrate = time.perf_counter() - t0
+        same = dump_schedules(old) == dump_schedules(new)
+        old.close()
+        new.close()
+
+    print(f"\n{args.users} 名学生 × {args.per_user} 条 kbList")
+    print(f"  occurrences      {old_rows:9d} 行  写入 {t_old * 1000:8.1f} ms  表 + 索引 {old_table / 1024 / 1024:7.2f} MiB  整库 {old_size / 1024 / 1024:7.2f} MiB")
+    print(f"  course_schedules {new_rows:9d} 行  写入 {t_new * 1000:8.1f} ms  表 + 索引 {new_table / 1024 / 1024:7.2f} MiB  整库 {new_size / 1024 / 1024:7.2f} MiB")
+    if new_table:
+        print(f"  表 + 索引 {old_table / new_table:.1f}×")
+    # 整库还包含两种结构共用的 courses / users 表
+    print(f"  行数 {old_rows / new_rows:.1f}×，整库 {old_size / new_size:.1f}×，写入耗时 {t_old / t_new:.1f}×")
+    print(f"  v6 -> v7 迁移 {t_migrate * 1000:.1f} ms，回填结果与直接写入一致: {same}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+上课记录展开：逐条 TermCalendar.slot（每周每季节查一次日历）vs 周期规则按周展开（course_schedules 的读取路径）。
+
+每名学生两个学期（一学年）的 kbList 先规整为课程安排，只计时按 周 × 季节 展开这一步：
+后者先由 entry_schedules 换算为周期规则，再用 expand_schedule 按周次位图逐周加上 WEEK_SECONDS。
+检查两种方式产出的时间字段完全一致。
+
+用法：
+    python -m benchmarks.bench_term_calendar --users 2000
+"""
+import argparse
+import time
+from typing import Dict, Iterator, List
+
+from app.services.term_calendar import get_term_calendar
+from app.services.timetable import entry_schedules, iter_kblist_entries
+from app.storage.db import expand_schedule
+from benchmarks.fixtures import make_kblist
+
+TERMS = ("2025-2026-1", "2025-2026-2")
+
+def slot_expand(entry: Dict) -> Iterator[tuple]:
+    # 与 rule_expand 相同的展开顺序（季节优先，其次周）
+    calendar = get_term_calendar(entry["semester"])
+    for season in entry["seasons"]:
+        offset = 8 if season in ("冬", "夏") else 0
+        for w in sorted(set(entry["weeks"])):
+            yield calendar.slot(w + offset, entry["weekday"], entry["period_start"], entry["period_count"])
+
+def rule_expand(entry: Dict) -> Iterator[tuple]:
+    # 读取时的行还带有 id / user_id / course_id，这里补上占位值，只取时间字段
+    for schedule in entry_schedules(entry):
+        for occ in expand_schedule(dict(schedule, id=0, user_id=0, course_id=0)):
+            yield occ["starts_at"], occ["ends_at"], occ["starts_at_ts"], occ["ends_at_ts"]
+
+def timed(fn, entries: List[Dict]) -> tuple:
+    t0 = time.perf_counter()
+    out = [row for e in entries for row in fn(e)]
+    return time.perf_counter() - t0, out
+
+def main():
+    parser = argparse.ArgumentParser(description="逐条查日历 vs 周期规则按周展开")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--per-term", type=int, default=30, help="每学期 kbList 条目数")
+    args = parser.parse_args()
+
+    # 课程安排与用户无关的部分相同，这里按用户生成不同的 kbList，共用前 50 种以控制生成时间
+    variants = [
+        [e for term in TERMS for e in iter_kblist_entries(make_kblist(args.per_term, seed, term))]
+        for seed in range(50)
+    ]
+    entries = [e for u in range(args.users) for e in variants[u % len(variants)]]
+    get_term_calendar(TERMS[0])  # 日历表在首次使用时构建，不计入
+
+    t_old, old = timed(slot_expand, entries)
+    t_new, new = timed(rule_expand, entries)
+    print(f"{args.users} 名学生 × 一学年，共 {len(old)} 条上课记录")
+    print(f"  逐条 slot              {t_old * 1000:9.1f} ms   {len(old) / t_old / 1e6:5.2f} M 条/秒")
+    print(f"  周期规则按周展开       {t_new * 1000:9.1f} ms   {len(new) / t_new / 1e6:5.2f} M 条/秒")
+    print(f"  每名学生平均（时间字段） {t_old / args.users * 1000:.3f} ms -> {t_new / args.users * 1000:.3f} ms")
+    print(f"结果一致: {old == new}")
+
+if __name__ == "__main__":
+    main()
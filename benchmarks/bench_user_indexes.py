@@ -0,0 +1,128 @@
+"""
+按用户查询的索引基准：对比迁移 v2（只有全局索引、通过 JOIN courses 过滤用户）
+与迁移 v3（occurrences 冗余 user_id + 按用户的复合索引）的查询计划与延迟。
+
+用法：
+    python -m benchmarks.bench_user_indexes --users 10000 --per-user 200
+"""
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from app.storage.db import get_conn
+from app.storage.migrations import migrate
+
+TERM = "2025-2026-1"
+TERM_START = date(2025, 9, 15)
+SLOTS = [("08:00", "09:35"), ("10:00", "11:35"), ("13:25", "15:00"), ("15:05", "16:45"), ("18:50", "20:25")]
+
+QUERIES_BEFORE = {
+    "calendar": (
+        """SELECT o.*, c.name as course_name, c.teacher, c.course_code
+           FROM occurrences o JOIN courses c ON o.course_id = c.id
+           WHERE c.user_id = ? AND o.starts_at >= ? AND o.ends_at <= ? ORDER BY o.starts_at""",
+        lambda uid: (uid, "2025-10-13T00:00:00", "2025-10-19T23:59:59"),
+    ),
+    "by_week": (
+        """SELECT o.*, c.name as course_name, c.teacher, c.course_code
+           FROM occurrences o JOIN courses c ON o.course_id = c.id
+           WHERE c.user_id = ? AND o.week = ? AND o.season = ? ORDER BY o.weekday, o.period_start""",
+        lambda uid: (uid, 5, "秋"),
+    ),
+    "template": (
+        """SELECT o.weekday, o.period_start, c.name, GROUP_CONCAT(DISTINCT o.week)
+           FROM occurrences o JOIN courses c ON o.course_id = c.id
+           WHERE c.user_id = ? AND o.semester = ? AND o.season = ?
+           GROUP BY c.id, o.weekday, o.period_start ORDER BY o.weekday, o.period_start""",
+        lambda uid: (uid, TERM, "秋"),
+    ),
+    "events": (
+        """SELECT * FROM events WHERE user_id = ? AND start_time >= ? AND end_time <= ? ORDER BY start_time""",
+        lambda uid: (uid, "2025-10-01T00:00:00", "2025-10-31T23:59:59"),
+    ),
+}
+
+QUERIES_AFTER = {
+    name: (sql.replace("c.user_id = ?", "o.user_id = ?"), params)
+    for name, (sql, params) in QUERIES_BEFORE.items()
+}
+
+def populate(conn: sqlite3.Connection, with_user_id: bool, users: int, per_user: int, events_per_user: int, seed: int):
+    rnd = random.Random(seed)
+    conn.executemany(
+        "INSERT INTO users(id, username, password_encrypted) VALUES (?, ?, 'x')",
+        ((uid, f"u{uid}") for uid in range(1, users + 1)),
+    )
+    course_id = 0
+    occ_rows = []
+    course_rows = []
+    event_rows = []
+    for uid in range(1, users + 1):
+        n_courses = max(1, per_user // 16)
+        for _ in range(n_courses):
+            course_id += 1
+            course_rows.append((course_id, uid, f"({TERM})-{rnd.randint(100000, 999999)}-{course_id}", f"课程{course_id % 500}", "教师"))
+            weekday = rnd.randint(1, 7)
+            slot = rnd.randrange(len(SLOTS))
+            for week in range(1, 17):
+                season = "秋" if week <= 8 else "冬"
+                day = TERM_START + timedelta(days=(week - 1) * 7 + weekday - 1)
+                s, e = SLOTS[slot]
+                row = (course_id, week if week <= 8 else week - 8, weekday, slot * 2 + 1, 2, "教室",
+                       f"{day.isoformat()}T{s}:00", f"{day.isoformat()}T{e}:00", season, TERM)
+                occ_rows.append(row + ((uid,) if with_user_id else ()))
+        for _ in range(events_per_user):
+            start = datetime(2025, 9, 1) + timedelta(minutes=rnd.randrange(0, 120 * 24 * 60, 30))
+            event_rows.append((uid, "事件", start.isoformat(), (start + timedelta(hours=1)).isoformat()))
+    conn.executemany("INSERT INTO courses(id, user_id, course_code, name, teacher) VALUES (?, ?, ?, ?, ?)", course_rows)
+    cols = "course_id, week, weekday, period_start, period_count, classroom, starts_at, ends_at, season, semester"
+    if with_user_id:
+        conn.executemany(f"INSERT INTO occurrences({cols}, user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", occ_rows)
+    else:
+        conn.executemany(f"INSERT INTO occurrences({cols}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", occ_rows)
+    conn.executemany("INSERT INTO events(user_id, title, start_time, end_time) VALUES (?, ?, ?, ?)", event_rows)
+    conn.commit()
+    conn.execute("ANALYZE")
+    return len(occ_rows)
+
+def run_queries(conn: sqlite3.Connection, queries, users: int, samples: int, seed: int):
+    rnd = random.Random(seed)
+    sample_users = [rnd.randint(1, users) for _ in range(samples)]
+    for name, (sql, params) in queries.items():
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params(1)).fetchall()
+        timings = []
+        for uid in sample_users:
+            t0 = time.perf_counter()
+            conn.execute(sql, params(uid)).fetchall()
+            timings.append((time.perf_counter() - t0) * 1000)
+        timings.sort()
+        print(f"  [{name}] 平均 {statistics.mean(timings):.3f} ms, p95 {timings[int(len(timings) * 0.95) - 1]:.3f} ms")
+        for row in plan:
+            print(f"      {row[3]}")
+
+def main():
+    parser = argparse.ArgumentParser(description="按用户索引的查询计划与延迟对比")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--per-user", type=int, default=200, help="每个用户的上课记录数（约）")
+    parser.add_argument("--events-per-user", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, version, queries in (("before (v2)", 2, QUERIES_BEFORE), ("after (v3)", 3, QUERIES_AFTER)):
+            conn = get_conn(str(Path(tmp) / f"bench_v{version}.db"))
+            migrate(conn, target=version)
+            t0 = time.perf_counter()
+            n = populate(conn, version >= 3, args.users, args.per_user, args.events_per_user, args.seed)
+            print(f"== {label}: {args.users} 用户, {n} 条上课记录, 构建耗时 {time.perf_counter() - t0:.1f}s")
+            run_queries(conn, queries, args.users, args.samples, args.seed)
+            conn.close()
+
+if __name__ == "__main__":
+    main()
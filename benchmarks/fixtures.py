@@ -0,0 +1,62 @@
+"""
+基准测试共用的合成数据：按教务网 kbList 的字段格式生成课表条目。
+"""
+import random
+
+NAMES = ["高等数学（甲）Ⅰ", "大学物理（甲）Ⅱ", "线性代数", "程序设计基础", "数据结构基础", "计算机组成",
+         "思想道德与法治", "大学英语Ⅲ", "体育Ⅰ", "概率论与数理统计", "离散数学及其应用", "操作系统"]
+TEACHERS = ["张三", "李四", "王五", "赵六", "孙七;周八"]
+ROOMS = ["紫金港东1A-101", "紫金港西2-205", "玉泉教7-302", "紫金港东2-301(录播.4K)", "紫金港体育馆"]
+XXQ = ["秋冬", "秋", "冬", "春夏", "春", "夏"]
+
+def make_kblist(n_items: int = 30, seed: int = 0, term: str = "2025-2026-1"):
+    """生成 n_items 条 kbList 条目，相同 seed 结果相同"""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n_items):
+        name = rnd.choice(NAMES)
+        xxq = rnd.choice(XXQ[:3] if term.endswith("-1") else XXQ[3:])
+        a = rnd.choice([1, 1, 2, 3])
+        b = rnd.choice([8, 8, 16, 7])
+        if a > b:
+            a, b = b, a
+        flag = rnd.choice(["", "", "", "|单周", "|双周"])
+        pc = rnd.choice([1, 2, 2, 3, 5])
+        kcb = f"{name}<br>{xxq}{{第{a}-{b}周{flag}|{pc}节/周}}<br>{rnd.choice(TEACHERS)}<br>{rnd.choice(ROOMS)}zwfzwf"
+        if rnd.random() < 0.1:
+            kcb = kcb.replace("zwfzwf", "2025年11月20日(14:00-16:00)zwf")
+        out.append({
+            "kcb": kcb,
+            "xkkh": f"({term})-{211000 + i % 20}-{rnd.randint(1000, 9999)}-{i}",
+            "xxq": xxq,
+            "xqj": str(rnd.randint(1, 7)),
+            "djj": str(rnd.randint(1, 14 - pc)),
+            "skcd": str(pc),
+            "kcmc": name,
+            "dsz": "0",
+            "sfyjskc": "0",
+        })
+    return out
+
+def make_kbcx_response(n_items: int = 30, seed: int = 0, term: str = "2025-2026-1", extra_kb: int = 40) -> dict:
+    """
+    按课表查询接口（xskbcx_cxXsKb）的结构生成完整响应：kbList 前后还有学生信息、实践课列表等字段，
+    extra_kb 控制这些字段的大致体积（KB），用来模拟真实响应的大小。
+    """
+    rnd = random.Random(seed + 1)
+    kb_list = make_kblist(n_items, seed, term)
+    for e in kb_list:
+        # 真实条目还带有大量展示字段
+        e.update({"jxb_id": f"{rnd.getrandbits(64):016X}", "kch": e["xkkh"][13:19], "zcd": "1-8周", "xm": rnd.choice(TEACHERS),
+                  "cdmc": rnd.choice(ROOMS), "jc": f"{e['djj']}节", "xnm": term[:4], "xqm": term[-1]})
+    filler = [{"qtkcgs": f"{rnd.choice(NAMES)} 第{i}周 实践", "sxbj": "1", "xf": "2.0", "kcmc": rnd.choice(NAMES),
+               "jxbmc": f"({term})-{rnd.randint(100000, 999999)}"} for i in range(max(1, extra_kb * 1024 // 160))]
+    return {
+        "xsxx": {"XH": "3200100000", "XM": "测试", "XNMC": term[:9], "XQMMC": "秋冬", "KCMS": len(kb_list)},
+        "kbList": kb_list,
+        "xh": "3200100000",
+        "sjkList": filler,
+        "xqbzxxszList": [],
+        "xskbsfxstkzt": "0",
+        "zckbsfxssj": "1",
+    }
@@ -0,0 +1,107 @@
+"""
+事件循环阻塞负载测试：在同一个事件循环里同时跑“上游请求”和数据库负载，
+对比数据库操作直接在协程里同步执行（改造前）与经 AsyncDatabase 线程池执行（改造后）时，
+上游请求的 p50/p99 延迟。
+
+上游请求用 asyncio.sleep 模拟固定 RTT，测得的额外延迟即事件循环被阻塞的时间。
+数据库负载为真实的课表增量同步（解析 + 写库）与日历区间查询交替进行。
+
+用法：
+    python -m benchmarks.load_event_loop --duration 10 --upstream 50 --db-clients 8
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from app.services.calendar import build_events_from_db
+from app.services.timetable_sync import sync_kblist_to_db
+from app.storage.async_db import AsyncDatabase
+from app.storage.db import ConnectionPool
+from app.storage.migrations import migrate
+from benchmarks.fixtures import make_kblist
+
+TERM = "2025-2026-1"
+
+def db_job(conn, rnd: random.Random, users: int, kb_variants):
+    uid = rnd.randint(1, users)
+    if rnd.random() < 0.5:
+        sync_kblist_to_db(conn, uid, TERM, rnd.choice(kb_variants))
+    else:
+        build_events_from_db(conn, "2025-09-15T00:00:00", "2026-01-31T23:59:59", username=f"u{uid}")
+
+async def upstream_client(latency: float, stop_at: float, samples: List[float]):
+    while time.perf_counter() < stop_at:
+        t0 = time.perf_counter()
+        await asyncio.sleep(latency)
+        samples.append((time.perf_counter() - t0) * 1000)
+
+async def db_client_inline(pool: ConnectionPool, seed: int, users: int, kb_variants, stop_at: float, counter: List[int]):
+    rnd = random.Random(seed)
+    while time.perf_counter() < stop_at:
+        # 改造前：协程内直接同步调用 sqlite3，期间整个事件循环停摆
+        with pool.connection() as conn:
+            db_job(conn, rnd, users, kb_variants)
+        counter[0] += 1
+        await asyncio.sleep(0)
+
+async def db_client_async(db: AsyncDatabase, seed: int, users: int, kb_variants, stop_at: float, counter: List[int]):
+    rnd = random.Random(seed)
+    while time.perf_counter() < stop_at:
+        await db.run(db_job, rnd, users, kb_variants)
+        counter[0] += 1
+
+async def run_mode(mode: str, db: AsyncDatabase, args, kb_variants):
+    stop_at = time.perf_counter() + args.duration
+    samples: List[float] = []
+    counter = [0]
+    tasks = [upstream_client(args.latency, stop_at, samples) for _ in range(args.upstream)]
+    for i in range(args.db_clients):
+        if mode == "inline":
+            tasks.append(db_client_inline(db.pool, i, args.users, kb_variants, stop_at, counter))
+        else:
+            tasks.append(db_client_async(db, i, args.users, kb_variants, stop_at, counter))
+    await asyncio.gather(*tasks)
+    samples.sort()
+    p = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))]
+    print(f"== {mode}: 上游请求 {len(samples)} 次, p50 {p(0.50):.1f} ms, p99 {p(0.99):.1f} ms, "
+          f"max {samples[-1]:.1f} ms (基准 {args.latency * 1000:.0f} ms); 数据库操作 {counter[0] / args.duration:.1f} ops/s")
+
+async def main_async(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ConnectionPool(str(Path(tmp) / "load.db"), size=args.pool_size)
+        db = AsyncDatabase(pool)
+        await db.run(migrate)
+
+        kb_variants = [make_kblist(40, seed=s, term=TERM) for s in range(4)]
+
+        def seed_users(conn):
+            conn.executemany(
+                "INSERT INTO users(id, username, password_encrypted) VALUES (?, ?, 'x')",
+                ((uid, f"u{uid}") for uid in range(1, args.users + 1)),
+            )
+            conn.commit()
+            for uid in range(1, args.users + 1):
+                sync_kblist_to_db(conn, uid, TERM, kb_variants[uid % len(kb_variants)])
+
+        await db.run(seed_users)
+        for mode in ("inline", "async"):
+            await run_mode(mode, db, args, kb_variants)
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="上游请求与数据库混合负载下的事件循环延迟对比")
+    parser.add_argument("--duration", type=float, default=10.0, help="每种模式的持续秒数")
+    parser.add_argument("--upstream", type=int, default=50, help="并发上游请求数")
+    parser.add_argument("--latency", type=float, default=0.03, help="模拟的上游 RTT（秒）")
+    parser.add_argument("--db-clients", type=int, default=8, help="并发数据库负载数")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--pool-size", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
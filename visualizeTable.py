@@ -13,6 +13,7 @@ SELECT id, starts_at, ends_at, week, weekday, period_start, period_count,
 FROM v_calendar_events
 WHERE 1=1
 """
+# 迁移 v7 之前的数据库（仍有 occurrences 表、没有视图）
 QUERY_JOIN = """
 SELECT o.id, o.starts_at, o.ends_at, o.week, o.weekday, o.period_start, o.period_count,
        o.classroom, o.season, o.semester, o.single_week, o.double_week, o.note,
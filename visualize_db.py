@@ -21,22 +21,21 @@ def visualize_data(db_path: str):
         conn = sqlite3.connect(db_path)
         conn.row_factory = sqlite3.Row
         
-        # SQL 查询，连接 courses 和 occurrences 表
+        # SQL 查询：v_calendar_events 视图把 course_schedules 按周展开并连接 courses 表
         sql = """
         SELECT 
-            c.name as course_name,
-            c.teacher,
-            o.week,
-            o.weekday,
-            o.period_start,
-            o.period_count,
-            o.classroom,
-            o.season,
-            o.starts_at,
-            o.ends_at
-        FROM occurrences o
-        JOIN courses c ON o.course_id = c.id
-        ORDER BY o.starts_at, o.week, o.weekday, o.period_start;
+            course_name,
+            teacher,
+            week,
+            weekday,
+            period_start,
+            period_count,
+            classroom,
+            season,
+            starts_at,
+            ends_at
+        FROM v_calendar_events
+        ORDER BY starts_at, week, weekday, period_start;
         """
         
         cur = conn.execute(sql)